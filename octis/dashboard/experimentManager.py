@@ -2,6 +2,8 @@ import importlib
 import json
 import os
 import sys
+import threading
+from collections import OrderedDict
 from importlib import util
 from pathlib import Path
 
@@ -10,7 +12,9 @@ import numpy as np
 from skopt.space.space import Real, Categorical, Integer
 
 import octis.configuration.defaults as defaults
-from octis.models.model import load_model_output
+from octis.models.model import LazyModelOutput
+from octis.optimization.trial_store import (
+    load_optimization_results, trial_store_path)
 
 path = Path(os.path.dirname(os.path.realpath(__file__)))
 pathDataset = str(path.parent.parent)
@@ -24,6 +28,13 @@ sys.modules[spec.name] = module
 spec.loader.exec_module(module)
 importlib.invalidate_caches()
 
+# number of model outputs kept open by openModelOutput
+MODEL_OUTPUT_CACHE_SIZE = 8
+
+# model outputs opened by this process, in least recently used order
+_model_output_cache = OrderedDict()
+_model_output_cache_lock = threading.Lock()
+
 
 def importClass(class_name, module_name, module_path):
     """
@@ -121,7 +132,7 @@ def startExperiment(parameters):
         parameters["path"], parameters["experimentId"]))
     json_file = str(os.path.join(optimizationPath,
                                  parameters["experimentId"] + ".json"))
-    if os.path.isfile(json_file):
+    if os.path.isfile(json_file) or os.path.isfile(trial_store_path(json_file)):
         Optimizer = importOptimizer()
         optimizer = Optimizer()
         optimizer.resume_optimization(json_file)
@@ -199,7 +210,8 @@ def startExperiment(parameters):
                            n_random_starts=parameters["optimization"]["n_random_starts"],
                            acq_func=parameters["optimization"]["acquisition_function"],
                            number_of_call=parameters["optimization"]["iterations"],
-                           save_models=True, save_name=parameters["experimentId"], save_path=optimizationPath)
+                           save_models=True, save_name=parameters["experimentId"], save_path=optimizationPath,
+                           save_format={"layout": "npy"})
 
 
 def retrieveBoResults(result_path):
@@ -212,10 +224,9 @@ def retrieveBoResults(result_path):
     :return: returns the results of BO
     :rtype: Dict
     """
-    if os.path.isfile(result_path):
-        # open json file
-        with open(result_path, 'rb') as file:
-            result = json.load(file)
+    if os.path.isfile(result_path) or os.path.isfile(trial_store_path(result_path)):
+        # read the trial store, or the json file
+        result = load_optimization_results(result_path)
         f_val = result['f_val']
         # output dictionary
         dict_return = dict()
@@ -238,10 +249,9 @@ def retrieveIterationBoResults(path, iteration):
     :return: returns the BO results until the given iteration
     :rtype: Dict
     """
-    if os.path.isfile(path):
-        # open json file
-        with open(path, 'rb') as file:
-            result = json.load(file)
+    if os.path.isfile(path) or os.path.isfile(trial_store_path(path)):
+        # read the trial store, or the json file
+        result = load_optimization_results(path)
         values = result["f_val"]
 
         type_of_problem = result['optimization_type']
@@ -296,19 +306,27 @@ def singleInfo(path):
     :return: average, median, best and worst result of the object function evaluations
     :rtype: Dict
     """
-    if os.path.isfile(path):
-        with open(path, 'rb') as file:
-            result = json.load(file)
+    if os.path.isfile(path) or os.path.isfile(trial_store_path(path)):
+        result = load_optimization_results(path)
         values = result['f_val']
         type_of_problem = result['optimization_type']
+        # the best and the worst results of a multi-fidelity optimization are
+        # the ones of the configurations evaluated at the full budget
+        candidates = list(range(len(values)))
+        if "multi_fidelity" in result:
+            budgets = result["multi_fidelity"]["budgets"]
+            full_budget = [i for i in candidates
+                           if budgets[i] == result["multi_fidelity"]["max_budget"]]
+            if full_budget:
+                candidates = full_budget
         if type_of_problem == 'Maximize':
-            best_seen = max(values)
-            worse_seen = min(values)
-            best_index = np.argmax(values)
+            best_index = max(candidates, key=lambda i: values[i])
+            worse_index = min(candidates, key=lambda i: values[i])
         else:
-            best_seen = min(values)
-            worse_seen = max(values)
-            best_index = np.argmin(values)
+            best_index = min(candidates, key=lambda i: values[i])
+            worse_index = max(candidates, key=lambda i: values[i])
+        best_seen = values[best_index]
+        worse_seen = values[worse_index]
         median_seen = np.median(values)
         mean_seen = np.mean(values)
 
@@ -382,9 +400,86 @@ def singleInfo(path):
     return None
 
 
-def getModelInfo(experiment_path, iteration, modelRun):
+def resultSignature(path):
+    """
+    Return the size and the modification time of the json file of a single
+    experiment and of its trial store, without reading them
+
+    :param path: path of the json file of a single experiment
+    :type path: String
+
+    :return: signature of the results, None if the experiment has no results
+    :rtype: List
+    """
+    signature = []
+    for result_path in [path, trial_store_path(path)]:
+        try:
+            stat = os.stat(result_path)
+            signature.append([stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            signature.append(None)
+    if signature == [None, None]:
+        return None
+    return signature
+
+
+def _toBuiltin(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(type(obj).__name__ + " is not JSON serializable")
+
+
+def cachedSingleInfo(path, index):
     """
-    Retrieve the output of the given model
+    Return the result of singleInfo for a single experiment, computing it
+    only if its results have changed since it was added to the index
+
+    :param path: path of the json file of a single experiment
+    :type path: String
+    :param index: summary index, a dictionary from the path of the json file
+                  of each experiment to its signature and its summary
+    :type index: Dict
+
+    :return: average, median, best and worst result of the object function
+             evaluations
+    :rtype: Dict
+    """
+    signature = resultSignature(path)
+    if signature is None:
+        index.pop(path, None)
+        return None
+    entry = index.get(path)
+    if entry is not None and entry["signature"] == signature:
+        return entry["summary"]
+    summary = json.loads(json.dumps(singleInfo(path), default=_toBuiltin))
+    index[path] = {"signature": signature, "summary": summary}
+    return summary
+
+
+def _modelOutputPaths(experiment_path, iteration, modelRun):
+    """
+    Return the paths of the output of the given model and of the vocabulary
+    """
+    outputfile = str(os.path.join(experiment_path,
+                                  "models",
+                                  str(iteration) + "_" + str(modelRun)))
+    if not os.path.isdir(outputfile):
+        # model output saved with the npz layout
+        outputfile = outputfile + ".npz"
+    vocabularyfile = str(os.path.join(experiment_path,
+                                      "models",
+                                      "vocabulary.json"))
+    return outputfile, vocabularyfile
+
+
+def openModelOutput(experiment_path, iteration, modelRun):
+    """
+    Open the output of the given model, without converting its matrices to
+    lists. The matrices are read only when they are first accessed, and the
+    ones of the outputs saved with the npy layout are memory-mapped. The last MODEL_OUTPUT_CACHE_SIZE outputs opened are kept
+    in a LRU cache, with their vocabulary and the top words of their topics
 
     :param experiment_path:  path of the experiment folder
     :type experiment_path: String
@@ -393,16 +488,165 @@ def getModelInfo(experiment_path, iteration, modelRun):
     :param modelRun: number of model run
     :type modelRun: Int
 
-    :return: output of the model and vocabulary
+    :return: dictionary with the arrays of the model output ("output"), the
+             vocabulary ("vocabulary") and the top words of the topics
+             computed so far ("topics"), False if the model output or the
+             vocabulary are not found
     :rtype: Dict
     """
-    outputfile = str(os.path.join(experiment_path,
-                                  "models",
-                                  str(iteration) + "_" + str(modelRun) + ".npz"))
-    vocabularyfile = str(os.path.join(experiment_path,
-                                      "models",
-                                      "vocabulary.json"))
-    if os.path.isfile(outputfile) and os.path.isfile(vocabularyfile):
-        output = load_model_output(outputfile, vocabularyfile, 20)
-        return output
-    return False
+    outputfile, vocabularyfile = _modelOutputPaths(
+        experiment_path, iteration, modelRun)
+    if not (os.path.exists(outputfile) and os.path.isfile(vocabularyfile)):
+        return False
+    # a model output saved again under the same name is opened again
+    key = (outputfile, os.path.getmtime(outputfile))
+    with _model_output_cache_lock:
+        if key in _model_output_cache:
+            _model_output_cache.move_to_end(key)
+            return _model_output_cache[key]
+
+    with open(vocabularyfile, 'r') as file:
+        vocabulary = json.load(file)
+    model_output = {
+        "output": LazyModelOutput(outputfile, mmap_mode='r'),
+        "vocabulary": vocabulary,
+        "topics": dict()}
+    with _model_output_cache_lock:
+        _model_output_cache[key] = model_output
+        while len(_model_output_cache) > MODEL_OUTPUT_CACHE_SIZE:
+            _model_output_cache.popitem(last=False)
+    return model_output
+
+
+def _topWords(model_output, topic, top_words):
+    """
+    Return the top words of a topic, as [word, weight] pairs sorted by weight
+    """
+    key = (topic, top_words)
+    if key not in model_output["topics"]:
+        row = np.asarray(model_output["output"]["topic-word-matrix"][topic])
+        top_words = min(top_words, len(row))
+        top_k = np.argpartition(-row, top_words - 1)[:top_words]
+        top_k = top_k[np.argsort(-row[top_k], kind='stable')]
+        model_output["topics"][key] = [
+            [model_output["vocabulary"][str(i)], float(row[i])] for i in top_k]
+    return model_output["topics"][key]
+
+
+def getModelSummary(experiment_path, iteration, modelRun, top_words=20):
+    """
+    Retrieve the sizes of the output of the given model and the top words of
+    its topics, without the matrices
+
+    :param experiment_path:  path of the experiment folder
+    :type experiment_path: String
+    :param iteration: number of iteration
+    :type iteration: Int
+    :param modelRun: number of model run
+    :type modelRun: Int
+    :param top_words: number of top words of each topic
+    :type top_words: Int
+
+    :return: number of topics, words and (test) documents and top words of
+             each topic, False if the model output is not found
+    :rtype: Dict
+    """
+    model_output = openModelOutput(experiment_path, iteration, modelRun)
+    if model_output is False:
+        return False
+    output = model_output["output"]
+    num_topics, num_words = output.shape("topic-word-matrix")
+    # the sizes of the topic-document matrices are read from their headers
+    summary = {"num_topics": num_topics, "num_words": num_words,
+               "num_documents": output.shape("topic-document-matrix")[1],
+               "topics": [_topWords(model_output, topic, top_words)
+                          for topic in range(num_topics)]}
+    if "test-topic-document-matrix" in output:
+        summary["num_test_documents"] = output.shape(
+            "test-topic-document-matrix")[1]
+    return summary
+
+
+def getTopicWords(experiment_path, iteration, modelRun, topic, top_words=20):
+    """
+    Retrieve the top words of a topic of the given model
+
+    :param topic: index of the topic
+    :type topic: Int
+    :param top_words: number of top words
+    :type top_words: Int
+
+    :return: [word, weight] pairs sorted by weight, False if the model output
+             is not found
+    :rtype: List
+    """
+    model_output = openModelOutput(experiment_path, iteration, modelRun)
+    if model_output is False:
+        return False
+    return _topWords(model_output, topic, top_words)
+
+
+def getTopicRow(experiment_path, iteration, modelRun, topic, start=0,
+                end=None):
+    """
+    Retrieve a range of the weights of the words in a topic of the given
+    model
+
+    :param topic: index of the topic
+    :type topic: Int
+    :param start: index of the first word
+    :type start: Int
+    :param end: index after the last word (None for the last word)
+    :type end: Int
+
+    :return: weights of the words, False if the model output is not found
+    :rtype: List
+    """
+    model_output = openModelOutput(experiment_path, iteration, modelRun)
+    if model_output is False:
+        return False
+    return np.asarray(model_output["output"]["topic-word-matrix"][
+        topic, start:end], dtype=float).tolist()
+
+
+def getWordTopics(experiment_path, iteration, modelRun, word):
+    """
+    Retrieve the weights of a word in each topic of the given model
+
+    :param word: index of the word
+    :type word: Int
+
+    :return: weight of the word in each topic, False if the model output is
+             not found
+    :rtype: List
+    """
+    model_output = openModelOutput(experiment_path, iteration, modelRun)
+    if model_output is False:
+        return False
+    return np.asarray(model_output["output"]["topic-word-matrix"][
+        :, word], dtype=float).tolist()
+
+
+def getDocumentTopics(experiment_path, iteration, modelRun, start, end,
+                      test=False):
+    """
+    Retrieve the topic distributions of a range of documents of the given
+    model
+
+    :param start: index of the first document
+    :type start: Int
+    :param end: index after the last document
+    :type end: Int
+    :param test: True for the test documents, False for the training ones
+    :type test: Bool
+
+    :return: for each document, the weight of each topic, False if the model
+             output is not found
+    :rtype: List
+    """
+    model_output = openModelOutput(experiment_path, iteration, modelRun)
+    if model_output is False:
+        return False
+    key = "test-topic-document-matrix" if test else "topic-document-matrix"
+    return np.asarray(model_output["output"][key][:, start:end],
+                      dtype=float).T.tolist()
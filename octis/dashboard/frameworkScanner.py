@@ -2,6 +2,8 @@ import os
 import json
 from pathlib import Path
 
+from octis.dataset.dataset import Dataset
+
 # get the path to the framework folder
 path = Path(os.path.dirname(os.path.realpath(__file__)))
 path = str(path.parent.parent)
@@ -30,11 +32,9 @@ def getDatasetMetadata(datasetName):
     :return: dict with metadata if dataset is found, False otherwise
     :rtype: Dict
     """
-    file = str(os.path.join(
-        path, "preprocessed_datasets", datasetName, "corpus.tsv"))
-    if os.path.isfile(file):
-        f = open(file,)
-        return {"total_documents": sum(1 for line in f)}
+    datasetPath = str(os.path.join(path, "preprocessed_datasets", datasetName))
+    if os.path.isfile(os.path.join(datasetPath, "corpus.tsv")):
+        return {"total_documents": Dataset.count_documents(datasetPath)}
     return False
 
 
@@ -51,17 +51,9 @@ def getDocPreview(datasetName, documentNumber):
     :return: First 40 words in the document
     :rtype: String
     """
-    datasetPath = str(os.path.join(
-        path, "preprocessed_datasets", datasetName, "corpus.tsv"))
-    corpus = []
-    if os.path.isfile(datasetPath):
-        with open(datasetPath, 'r') as corpus_file:
-            for line in corpus_file:
-                corpus.append(line.split("\t")[0])
-        splitted = corpus[documentNumber].split()
-        if len(splitted) > 40:
-            return " ".join(splitted[0:40])
-        return corpus[documentNumber]
+    datasetPath = str(os.path.join(path, "preprocessed_datasets", datasetName))
+    if os.path.isfile(os.path.join(datasetPath, "corpus.tsv")):
+        return " ".join(Dataset.read_document(datasetPath, documentNumber)[0:40])
     return False
 
 
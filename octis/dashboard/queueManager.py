@@ -1,90 +1,165 @@
 import os
-import time
 import json
-from collections import namedtuple
+import tempfile
 from experimentManager import startExperiment
 import experimentManager as expManager
 import multiprocessing as mp
-from subprocess import Popen
+from multiprocessing.connection import wait
 import signal
 
 
+def available_resources():
+    """
+    Return the resources of the machine that can be reserved by the
+    experiments
+
+    :return: number of cpus and megabytes of memory (None if unknown)
+    :rtype: tuple
+    """
+    cpus = os.cpu_count()
+    memory = None
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * \
+            os.sysconf('SC_PHYS_PAGES') // 2 ** 20
+    except (AttributeError, ValueError, OSError):
+        pass
+    return cpus, memory
+
+
 class QueueManager:
     """
-    The QueueManager class is used to track old, ongoing and new experiments
+    The QueueManager class is used to track old, ongoing and new experiments.
+
+    Up to `slots` experiments run at the same time, each one in its own
+    process. The experiments are started in the order of the queue, as long
+    as their reservations (the optional "resources" of their parameters, with
+    the number of "cpus" and the megabytes of "memory" they need) fit in the
+    resources left by the running ones. The scheduler waits on the sentinels
+    of the running processes and on a wake-up pipe, so that a new experiment
+    is started as soon as an experiment ends or the queue changes.
     """
     running = None
     toRun = None
     order = None
     completed = None
     process = None
-    busy = None
+    held = None
+    summaries = None
     idle = None
     path = None
 
-    def __init__(self, path):
+    def __init__(self, path, slots=1, cpus=None, memory=None):
         """
         Initialize the queue manager.
         Loads old queues
-        """
+
+        :param path: path of the state of the queue
+        :type path: String
+        :param slots: number of experiments that can run at the same time
+        :type slots: Int
+        :param cpus: number of cpus that can be reserved by the experiments
+                     (default: the cpus of the machine)
+        :type cpus: Int
+        :param memory: megabytes of memory that can be reserved by the
+                       experiments (default: the memory of the machine)
+        :type memory: Int
+        """
+        if slots < 1:
+            raise Exception("slots must be at least 1")
         manager = mp.Manager()
         self.path = path
+        self.slots = slots
+        available_cpus, available_memory = available_resources()
+        self.cpus = cpus if cpus is not None else available_cpus
+        self.memory = memory if memory is not None else available_memory
         self.running = manager.list()
-        self.running.append(None)
         self.toRun = manager.dict()
         self.order = manager.list()
         self.completed = manager.dict()
-        self.busy = manager.list()
-        self.busy.append(False)
-        self.process = manager.list()
+        self.process = manager.dict()
+        # True when the queue has been paused and no experiment must start
+        self.held = manager.list()
+        self.held.append(False)
+        # summary index of the results of the experiments, by json file
+        self.summaries = manager.dict()
+        self.summaryPath = os.path.splitext(path)[0] + ".summaries.json"
+        self._lock = mp.RLock()
+        self._wakeup_reader, self._wakeup_writer = mp.Pipe(duplex=False)
+        self._wakeup_lock = mp.Lock()
 
         self.load_state(path)
         self.idle = mp.Process(target=self._run)
         self.idle.start()
 
+    def _state(self):
+        return {"running": list(self.running),
+                "toRun": dict(self.toRun),
+                "order": list(self.order),
+                "completed": dict(self.completed)}
+
     def save_state(self, path):
         """
-        Saves the state of the queue
+        Saves the state of the queue and the summary index of the results
         """
-        with open(path, "w") as fp:
-            json.dump({"running": self.running[0],
-                       "toRun": dict(self.toRun),
-                       "order": list(self.order),
-                       "completed": dict(self.completed)},
-                      fp)
+        with self._lock:
+            state = self._state()
+        QueueManager._dump(state, path)
+        QueueManager._dump(dict(self.summaries), self.summaryPath)
+
+    @staticmethod
+    def _dump(data, path):
+        # the state is saved by the scheduler and by the server, replace the
+        # file atomically so that it is never half written
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, path)
 
     def load_state(self, path):
         """
-        Loads the state of the queue
+        Loads the state of the queue. The experiments that were running when
+        the state was saved are put back at the top of the queue.
         """
         if not os.path.isfile(path):
             with open(path, "w") as state:
-                json.dump({"running": self.running[0],
-                       "toRun": dict(self.toRun),
-                       "order": list(self.order),
-                       "completed": dict(self.completed)},
-                       state)
+                json.dump(self._state(), state)
 
         with open(path, "r") as fp:
             data = json.load(fp)
-            self.running[0] = data["running"]
+            running = data["running"]
+            # the state of an older dashboard stores a single experiment
+            if running is None:
+                running = []
+            elif not isinstance(running, list):
+                running = [running]
             self.toRun.update(data["toRun"])
-            self.order.extend(data["order"])
+            self.order.extend([exp for exp in running if exp in self.toRun])
+            self.order.extend(
+                [exp for exp in data["order"] if exp not in running])
             self.completed.update(data["completed"])
 
+        if os.path.isfile(self.summaryPath):
+            with open(self.summaryPath, "r") as fp:
+                self.summaries.update(json.load(fp))
+
+    def _wakeup(self):
+        """
+        Wake the scheduler up, to start the experiments that can run
+        """
+        with self._wakeup_lock:
+            self._wakeup_writer.send(True)
+
     def next(self):
         """
-        If there is no running experiments, choose te next one to run
+        Resume the queue, if it was paused, and start the next experiments
+        that can run
 
-        :return: a tuple containing id of the batch and id of
-                 the next experiment to run
-        :rtype: tuple
+        :return: ids of the running experiments
+        :rtype: List
         """
-        if self.running[0] is None:
-            self.running[0] = self.order.pop(0)
-            self.busy[0] = False
-            self.start()
-        return self.running[0]
+        self.start()
+        return self.getRunningExperiments()
 
     def add_experiment(self, batch, id, parameters):
         """
@@ -94,7 +169,10 @@ class QueueManager:
         :type batch: String
         :param id: id of the experiment
         :type id: String
-        :param parameters: dictionary with the parameters of the experiment
+        :param parameters: dictionary with the parameters of the experiment.
+                           The optional "resources" entry is the reservation
+                           of the experiment, with the number of "cpus" and
+                           the megabytes of "memory" it needs
         :type parameters: Dict
 
         :return: True if the experiment was added to the queue, False otherwise
@@ -103,49 +181,156 @@ class QueueManager:
         toAdd = batch+id
         parameters["batchId"] = batch
         parameters["experimentId"] = id
-        if toAdd not in self.completed and toAdd not in self.toRun:
+        with self._lock:
+            if toAdd in self.completed or toAdd in self.toRun:
+                return False
             self.toRun[toAdd] = parameters
             self.order.append(toAdd)
-            return True
-        return False
+        self._wakeup()
+        return True
+
+    def _reservation(self, experiment):
+        """
+        Return the cpus and the megabytes of memory reserved by an experiment
+        """
+        resources = self.toRun.get(experiment, {}).get("resources", {})
+        return resources.get("cpus", 0), resources.get("memory", 0)
+
+    def _next_experiment(self, exiting=()):
+        """
+        Return the first experiment of the queue that can start, None if
+        there is none. An experiment can start if there is a free slot and
+        its reservation fits in the resources left by the live processes:
+        the experiments after one that does not fit are started in its place
+        (backfill), so that the resources are not left idle. An experiment
+        that needs more than the resources of the machine only runs alone.
+        The caller must hold the lock of the queue.
+
+        :param exiting: experiments whose process has not been joined yet,
+                        including the ones of a paused run: their processes
+                        keep their slots and their resources, and they are
+                        not started again until they end
+        :type exiting: Collection
+        """
+        if self.held[0]:
+            return None
+        busy = set(self.running) | set(exiting)
+        if len(busy) >= self.slots:
+            return None
+        used_cpus, used_memory = 0, 0
+        for exp in busy:
+            cpus, memory = self._reservation(exp)
+            used_cpus, used_memory = used_cpus + cpus, used_memory + memory
+        for experiment in self.order:
+            if experiment in exiting:
+                continue
+            if len(busy) == 0:
+                return experiment
+            cpus, memory = self._reservation(experiment)
+            if self.cpus is not None and used_cpus + cpus > self.cpus:
+                continue
+            if self.memory is not None and used_memory + memory > self.memory:
+                continue
+            return experiment
+        return None
 
-    def _run(self):
+    def _dispatch(self, processes):
+        """
+        Start the experiments that can run
+
+        :param processes: running processes of the scheduler, by sentinel
+        :type processes: Dict
+        """
+        with self._lock:
+            exiting = set(exp for exp, _ in processes.values())
+            experiment = self._next_experiment(exiting)
+            while experiment is not None:
+                self.order.remove(experiment)
+                process = mp.Process(
+                    target=QueueManager._execute_and_update,
+                    args=(self.toRun[experiment],))
+                process.start()
+                print("starting " + experiment)
+                self.process[experiment] = process.pid
+                self.running.append(experiment)
+                processes[process.sentinel] = (experiment, process)
+                exiting.add(experiment)
+                experiment = self._next_experiment(exiting)
+
+    def _finish(self, experiment, pid):
         """
-        Put the current experiment in the finished queue
+        Put an experiment that has ended in the finished queue, unless it has
+        been paused
+
+        :param experiment: id of the experiment
+        :type experiment: String
+        :param pid: pid of the process of the experiment that has ended
+        :type pid: Int
+        """
+        with self._lock:
+            # the process of a paused run is no longer the one of the
+            # experiment, even if the experiment has been started again
+            if self.process.get(experiment) != pid:
+                return
+            self.running.remove(experiment)
+            self.process.pop(experiment, None)
+            if experiment in self.toRun:
+                # the summary is computed again from the final results
+                self.summaries.pop(
+                    self._getResultPath(self.toRun[experiment]), None)
+                self.completed[experiment] = self.toRun[experiment]
+                del self.toRun[experiment]
+        self.save_state(self.path)
 
-        :return: a tuple containing id of the batch and id of the
-                 completed experiment
-        :rtype: tuple
+    def _run(self):
+        """
+        Start the experiments of the queue and put the completed ones in the
+        finished queue, as soon as a process ends or the queue changes
         """
+        processes = dict()
         while True:
-            time.sleep(4)
-            if not self.busy[0]:
-                if self.running[0] is not None:
-                    finished = self.running[0]
-                    self.completed[finished] = self.toRun[finished]
-                    del self.toRun[finished]
-                    self.running[0] = None
-                    self.save_state(self.path)
-                if len(self.order) > 0 and self.running[0] is None:
-                    self.running[0] = self.order.pop(0)
-                    self.start()
-            time.sleep(6)
-
-    def pause(self):
-        """
-        pause the running experiment
-
-        :return: a tuple containing id of the batch and id of the
-                 paused experiment
-        :rtype: tuple
-        """
-        if self.busy[0] and self.running[0] != None:
-            paused = self.running[0]
-            to_stop = self.process.pop()
-            os.kill(to_stop, signal.SIGTERM)
-            self.order.insert(0, paused)
-            self.running[0] = None
-            return paused
+            self._dispatch(processes)
+            for ready in wait([self._wakeup_reader] + list(processes)):
+                if ready is self._wakeup_reader:
+                    while self._wakeup_reader.poll():
+                        self._wakeup_reader.recv()
+                else:
+                    experiment, process = processes.pop(ready)
+                    process.join()
+                    self._finish(experiment, process.pid)
+
+    def pause(self, experimentId=None):
+        """
+        Pause a running experiment, or all of them, and hold the queue until
+        it is started again
+
+        :param experimentId: id of the experiment to pause (default: all the
+                             running experiments)
+        :type experimentId: String
+
+        :return: id of the paused experiment (the first one if all of them
+                 are paused), False if no experiment was paused
+        :rtype: String
+        """
+        with self._lock:
+            self.held[0] = True
+            if experimentId is None:
+                paused = list(self.running)
+            elif experimentId in self.running:
+                paused = [experimentId]
+            else:
+                paused = []
+            for experiment in reversed(paused):
+                self.running.remove(experiment)
+                to_stop = self.process.pop(experiment, None)
+                if to_stop is not None:
+                    try:
+                        os.kill(to_stop, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+                self.order.insert(0, experiment)
+        if len(paused) > 0:
+            return paused[0]
         return False
 
     def getBatchNames(self):
@@ -159,7 +344,7 @@ class QueueManager:
         batch_names = []
         to_remove = []
         for key, value in self.completed.items():
-            if not self.getExperimentInfo(value["batchId"], value["experimentId"]):
+            if not self._hasResults(value):
                 to_remove.append(key)
             else:
                 if value["batchId"] not in batch_names:
@@ -185,7 +370,7 @@ class QueueManager:
         experiments = []
         to_remove = []
         for key, value in self.completed.items():
-            if not self.getExperimentInfo(value["batchId"], value["experimentId"]):
+            if not self._hasResults(value):
                 to_remove.append(key)
             else:
                 if value["batchId"] == batch_name:
@@ -216,53 +401,75 @@ class QueueManager:
         if batch + experimentId in self.toRun:
             experiment = self.toRun[batch+experimentId]
         if experiment is not None:
-            path = str(os.path.join(
-                experiment["path"], experiment["experimentId"], experiment["experimentId"]+".json"))
-            return expManager.singleInfo(path)
+            return expManager.cachedSingleInfo(
+                self._getResultPath(experiment), self.summaries)
         return None
 
+    @staticmethod
+    def _getResultPath(experiment):
+        """
+        Return the path of the json file of the results of an experiment
+        """
+        return str(os.path.join(
+            experiment["path"], experiment["experimentId"],
+            experiment["experimentId"]+".json"))
+
+    def _hasResults(self, experiment):
+        """
+        Return True if the experiment has results, without reading them
+        """
+        return expManager.resultSignature(
+            self._getResultPath(experiment)) is not None
+
     def start(self):
         """
-        Start a new experiment in a new process
+        Resume the queue, if it was paused, and start the experiments that
+        can run
         """
-        if not self.busy[0]:
-            self.busy[0] = True
-            process = mp.Process(
-                target=QueueManager._execute_and_update, args=(
-                    self.toRun,
-                    self.running,
-                    self.busy
-                ))
-            process.start()
-            print("starting "+self.running[0])
-            self.process.append(process.pid)
+        self.held[0] = False
+        self._wakeup()
 
     def stop(self):
         """
-        Stop the current experiment and save the information about it
+        Stop the running experiments and save the information about them
         """
-        self.idle.terminate()
-        self.pause()
-        self.save_state(self.path)
+        # the lock is taken first, so that the scheduler is never terminated
+        # while it holds the lock
+        with self._lock:
+            self.idle.terminate()
+            self.idle.join()
+            self.pause()
+            self.save_state(self.path)
 
     @staticmethod
-    def _execute_and_update(toRun, running, busy):
+    def _execute_and_update(parameters):
         """
         start an experiment using a static method
 
-        :param toRun: list of experiments to run
-        :type: List
-        :param running: id of the running experiment
-        :type: String
-        :param busy: specify if the queuemanager is busy
-        :type busy: boolean
+        :param parameters: parameters of the experiment
+        :type parameters: Dict
         """
-        startExperiment(toRun[running[0]])
-        busy[0] = False
+        startExperiment(parameters)
 
-    def getModel(self, batch, experimentId, iteration, modelRun):
+    def _getExperimentPath(self, batch, experimentId):
+        """
+        Return the folder of the experiment with the given batch name and
+        id, None if the experiment is not found
         """
-        Retrieve output of the model for a single model
+        experiment = None
+        if batch+experimentId in self.completed:
+            experiment = self.completed[batch+experimentId]
+        if batch+experimentId in self.toRun:
+            experiment = self.toRun[batch+experimentId]
+        if experiment is not None:
+            return str(os.path.join(
+                experiment["path"], experiment["experimentId"]))
+        return None
+
+    def getModelSummary(self, batch, experimentId, iteration, modelRun):
+        """
+        Retrieve the sizes of the output of a single model and the top words
+        of its topics
 
         :param batch: name of the batch
         :type batch: String
@@ -273,19 +480,56 @@ class QueueManager:
         :param modelRun: numeber of model run of the model to retrieve
         :type modelRun: Int
 
-        :return: output of the model (topic-word-matrix,
-                 document-topic-matrix and vocabulary)
+        :return: summary of the output of the model
         :rtype: Dict
         """
-        experiment = None
-        if batch+experimentId in self.completed:
-            experiment = self.completed[batch+experimentId]
-        if batch+experimentId in self.toRun:
-            experiment = self.toRun[batch+experimentId]
-        if experiment is not None:
-            path = str(os.path.join(
-                experiment["path"], experiment["experimentId"]))
-            return expManager.getModelInfo(path, iteration, modelRun)
+        path = self._getExperimentPath(batch, experimentId)
+        if path is not None:
+            return expManager.getModelSummary(path, iteration, modelRun)
+        return False
+
+    def getTopicWords(self, batch, experimentId, iteration, modelRun, topic,
+                      top_words=20):
+        """
+        Retrieve the top words of a topic of a single model
+        """
+        path = self._getExperimentPath(batch, experimentId)
+        if path is not None:
+            return expManager.getTopicWords(
+                path, iteration, modelRun, topic, top_words)
+        return False
+
+    def getTopicRow(self, batch, experimentId, iteration, modelRun, topic,
+                    start=0, end=None):
+        """
+        Retrieve a range of the weights of the words in a topic of a single
+        model
+        """
+        path = self._getExperimentPath(batch, experimentId)
+        if path is not None:
+            return expManager.getTopicRow(
+                path, iteration, modelRun, topic, start, end)
+        return False
+
+    def getWordTopics(self, batch, experimentId, iteration, modelRun, word):
+        """
+        Retrieve the weights of a word in each topic of a single model
+        """
+        path = self._getExperimentPath(batch, experimentId)
+        if path is not None:
+            return expManager.getWordTopics(path, iteration, modelRun, word)
+        return False
+
+    def getDocumentTopics(self, batch, experimentId, iteration, modelRun,
+                          start, end, test=False):
+        """
+        Retrieve the topic distributions of a range of documents of a single
+        model
+        """
+        path = self._getExperimentPath(batch, experimentId)
+        if path is not None:
+            return expManager.getDocumentTopics(
+                path, iteration, modelRun, start, end, test)
         return False
 
     def getExperimentIterationInfo(self, batch, experimentId, iteration=0):
@@ -347,7 +591,7 @@ class QueueManager:
         expIds = []
         to_remove = []
         for key, exp in self.completed.items():
-            if not self.getExperimentInfo(exp["batchId"], exp["experimentId"]):
+            if not self._hasResults(exp):
                 to_remove.append(key)
             else:
                 expIds.append([exp["experimentId"],
@@ -379,12 +623,26 @@ class QueueManager:
 
     def getRunning(self):
         """
-        returns the id of the running experiment
+        returns the id of the first running experiment
 
-        :return: id of the running experiment
+        :return: id of the running experiment, None if no experiment is
+                 running
         :rtype: String
         """
-        return self.running[0]
+        running = list(self.running)
+        if len(running) > 0:
+            return running[0]
+        return None
+
+    def getRunningExperiments(self):
+        """
+        returns the ids of the running experiments
+
+        :return: ids of the running experiments, in the order they were
+                 started
+        :rtype: List
+        """
+        return list(self.running)
 
     def editOrder(self, newOrder):
         """
@@ -393,12 +651,17 @@ class QueueManager:
         :param newOrder: new order of the experiments
         :type newOrder: List
         """
-        FinalOrder = []
-        for el in newOrder:
-            if el in self.order:
-                FinalOrder.append(el)
-        self.order[:] = []
-        self.order.extend(FinalOrder)
+        with self._lock:
+            FinalOrder = []
+            for el in newOrder:
+                if el in self.order:
+                    FinalOrder.append(el)
+            # the experiments added meanwhile keep their place at the bottom
+            for el in self.order:
+                if el not in FinalOrder:
+                    FinalOrder.append(el)
+            self.order[:] = FinalOrder
+        self._wakeup()
 
     def deleteFromOrder(self, experimentId):
         """
@@ -407,5 +670,10 @@ class QueueManager:
         :param experimentId: id of the experiment to remove from the queue
         :type experimentId: String
         """
-        self.order = list(filter(lambda a: a != experimentId, self.order))
-        del self.toRun[experimentId]
+        with self._lock:
+            self.order[:] = [exp for exp in self.order if exp != experimentId]
+            if experimentId in self.toRun:
+                self.summaries.pop(
+                    self._getResultPath(self.toRun[experimentId]), None)
+                del self.toRun[experimentId]
+        self._wakeup()
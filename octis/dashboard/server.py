@@ -10,6 +10,8 @@ import argparse
 import webbrowser
 import frameworkScanner as fs
 import octis.configuration.defaults as defaults
+from octis.optimization.trial_store import (
+    load_optimization_results, trial_store_path)
 from multiprocessing import Process, Pool
 import json
 from flask import Flask, render_template, request, send_file
@@ -36,59 +38,61 @@ def downloadSingleExp():
     batchId = request.args.get("batchId")
 
     paused = False
-    if (experimentId + batchId) == queueManager.running:
+    if (batchId + experimentId) in queueManager.getRunningExperiments():
         paused = True
-        queueManager.pause()
+        queueManager.pause(batchId + experimentId)
 
-    expPath = ""
-    createdPath = os.path.join(
-        queueManager.getExperiment(batchId, experimentId)["path"],
-        experimentId,
-        experimentId)
-    jsonReport = {}
-    if os.path.isfile(createdPath+".json"):
-        expPath = createdPath
-
-    with open(expPath+".json") as p:
-        jsonReport = json.load(p)
-
-    info = queueManager.getExperimentInfo(batchId, experimentId)
-
-    n_row = info["current_iteration"]
-    n_extra_metrics = len(jsonReport["extra_metric_names"])
-
-    df = pd.DataFrame()
-    df['dataset'] = [jsonReport["dataset_name"]] * n_row
-    df['surrogate model'] = [jsonReport["surrogate_model"]] * n_row
-    df['acquisition function'] = [jsonReport["acq_func"]] * n_row
-    df['num_iteration'] = [i for i in range(n_row)]
-    df['time'] = [jsonReport['time_eval'][i] for i in range(n_row)]
-    df['Median(model_runs)'] = [np.median(
-        jsonReport['dict_model_runs'][jsonReport['metric_name']]['iteration_' + str(i)]) for i in range(n_row)]
-    df['Mean(model_runs)'] = [np.mean(
-        jsonReport['dict_model_runs'][jsonReport['metric_name']]['iteration_' + str(i)]) for i in range(n_row)]
-    df['Standard_Deviation(model_runs)'] = [np.std(
-        jsonReport['dict_model_runs'][jsonReport['metric_name']]['iteration_' + str(i)]) for i in range(n_row)]
-
-    for hyperparameter in list(jsonReport["x_iters"]):
-        df[hyperparameter] = jsonReport["x_iters"][hyperparameter][0:n_row]
-
-    for metric, i in zip(jsonReport["extra_metric_names"], range(n_extra_metrics)):
-        df[metric + '(median, not optimized)'] = [np.median(
-            jsonReport["dict_model_runs"][metric]['iteration_' + str(i)]) for i in range(n_row)]
-
-        df[metric + '(Mean, not optimized)'] = [np.mean(
-            jsonReport["dict_model_runs"][metric]['iteration_' + str(i)]) for i in range(n_row)]
-
-        df[metric + '(Standard_Deviation, not optimized)'] = [np.std(
-            jsonReport["dict_model_runs"][metric]['iteration_' + str(i)]) for i in range(n_row)]
-
-    name_file = expPath + ".csv"
-
-    df.to_csv(name_file, index=False, na_rep='Unkown')
-
-    if paused:
-        queueManager.start()
+    try:
+        expPath = ""
+        createdPath = os.path.join(
+            queueManager.getExperiment(batchId, experimentId)["path"],
+            experimentId,
+            experimentId)
+        jsonReport = {}
+        if os.path.isfile(createdPath+".json") or os.path.isfile(
+                trial_store_path(createdPath+".json")):
+            expPath = createdPath
+
+        jsonReport = load_optimization_results(expPath+".json")
+
+        info = queueManager.getExperimentInfo(batchId, experimentId)
+
+        n_row = info["current_iteration"]
+        n_extra_metrics = len(jsonReport["extra_metric_names"])
+
+        df = pd.DataFrame()
+        df['dataset'] = [jsonReport["dataset_name"]] * n_row
+        df['surrogate model'] = [jsonReport["surrogate_model"]] * n_row
+        df['acquisition function'] = [jsonReport["acq_func"]] * n_row
+        df['num_iteration'] = [i for i in range(n_row)]
+        df['time'] = [jsonReport['time_eval'][i] for i in range(n_row)]
+        df['Median(model_runs)'] = [np.median(
+            jsonReport['dict_model_runs'][jsonReport['metric_name']]['iteration_' + str(i)]) for i in range(n_row)]
+        df['Mean(model_runs)'] = [np.mean(
+            jsonReport['dict_model_runs'][jsonReport['metric_name']]['iteration_' + str(i)]) for i in range(n_row)]
+        df['Standard_Deviation(model_runs)'] = [np.std(
+            jsonReport['dict_model_runs'][jsonReport['metric_name']]['iteration_' + str(i)]) for i in range(n_row)]
+
+        for hyperparameter in list(jsonReport["x_iters"]):
+            df[hyperparameter] = jsonReport["x_iters"][hyperparameter][0:n_row]
+
+        for metric, i in zip(jsonReport["extra_metric_names"], range(n_extra_metrics)):
+            df[metric + '(median, not optimized)'] = [np.median(
+                jsonReport["dict_model_runs"][metric]['iteration_' + str(i)]) for i in range(n_row)]
+
+            df[metric + '(Mean, not optimized)'] = [np.mean(
+                jsonReport["dict_model_runs"][metric]['iteration_' + str(i)]) for i in range(n_row)]
+
+            df[metric + '(Standard_Deviation, not optimized)'] = [np.std(
+                jsonReport["dict_model_runs"][metric]['iteration_' + str(i)]) for i in range(n_row)]
+
+        name_file = expPath + ".csv"
+
+        df.to_csv(name_file, index=False, na_rep='Unkown')
+    finally:
+        # the queue is started again even if the report cannot be written
+        if paused:
+            queueManager.start()
 
     return send_file(expPath+".csv",
                      mimetype="text/csv",
@@ -174,6 +178,12 @@ def startExperiment():
     }
     expParams["optimize_metrics"] = []
     expParams["track_metrics"] = []
+    resources = {}
+    for resource in ["cpus", "memory"]:
+        if resource in data and data[resource][0] != "":
+            resources[resource] = typed(data[resource][0])
+    if resources:
+        expParams["resources"] = resources
 
     model_parameters_to_optimize = []
 
@@ -304,14 +314,14 @@ def ManageExperiments():
         if exp_info is not None:
             exp_list[exp].update(exp_info)
     order = queueManager.getOrder()
-    running = queueManager.getRunning()
+    running = queueManager.getRunningExperiments()
     return render_template("ManageExperiments.html", order=order, experiments=exp_list, running=running)
 
 
 @ app.route("/pauseExp", methods=["POST"])
 def pauseExp():
     """
-    Pause the current experiment
+    Pause the running experiments
 
     :return: ack signal
     :rtype: Dict
@@ -323,14 +333,12 @@ def pauseExp():
 @ app.route("/startExp", methods=["POST"])
 def startExp():
     """
-    Start the next experiment in the queue
+    Start the next experiments in the queue
 
     :return: ack signal
     :rtype: Dict
     """
-    print(queueManager.getRunning())
-    if queueManager.getRunning() == None:
-        queueManager.next()
+    queueManager.next()
     return {"DONE": "YES"}
 
 
@@ -343,10 +351,10 @@ def deleteExp():
     :rtype: Dict
     """
     data = request.json['data']
-    print(queueManager.getRunning())
-    if queueManager.getRunning() is not None and queueManager.getRunning() == data:
-        queueManager.pause()
+    if data in queueManager.getRunningExperiments():
+        queueManager.pause(data)
         queueManager.deleteFromOrder(data)
+        queueManager.start()
     else:
         queueManager.deleteFromOrder(data)
     return {"DONE": "YES"}
@@ -386,7 +394,7 @@ def SingleExperiment(batch="", exp_id=""):
     :rtype: render template
     """
     models = defaults.model_hyperparameters
-    output = queueManager.getModel(batch, exp_id, 0, 0)
+    output = queueManager.getModelSummary(batch, exp_id, 0, 0)
     global_info = queueManager.getExperimentInfo(batch, exp_id)
     iter_info = queueManager.getExperimentIterationInfo(batch, exp_id, 0)
     exp_info = queueManager.getExperiment(batch, exp_id)
@@ -412,13 +420,80 @@ def getIterationData():
     :rtype: Dict
     """
     data = request.json['data']
-    output = queueManager.getModel(data["batchId"], data["experimentId"],
-                                   int(data["iteration"]), data["model_run"])
+    output = queueManager.getModelSummary(data["batchId"], data["experimentId"],
+                                          int(data["iteration"]), data["model_run"])
     iter_info = queueManager.getExperimentIterationInfo(data["batchId"], data["experimentId"],
                                                         int(data["iteration"]))
     return {"iterInfo": iter_info, "output": output}
 
 
+@ app.route("/getTopicWords", methods=["POST"])
+def getTopicWords():
+    """
+    Return the top words of a topic of a single iteration and model run of an
+    experiment
+
+    :return: [word, weight] pairs of the top words of the topic
+    :rtype: Dict
+    """
+    data = request.json['data']
+    words = queueManager.getTopicWords(data["batchId"], data["experimentId"],
+                                       int(data["iteration"]), int(data["model_run"]),
+                                       int(data["topic"]), int(data.get("top_words", 20)))
+    return {"words": words}
+
+
+@ app.route("/getTopicRow", methods=["POST"])
+def getTopicRow():
+    """
+    Return a range of the weights of the words in a topic of a single
+    iteration and model run of an experiment
+
+    :return: weights of the words from start to end
+    :rtype: Dict
+    """
+    data = request.json['data']
+    end = data.get("end")
+    row = queueManager.getTopicRow(data["batchId"], data["experimentId"],
+                                   int(data["iteration"]), int(data["model_run"]),
+                                   int(data["topic"]), int(data.get("start", 0)),
+                                   None if end is None else int(end))
+    return {"row": row}
+
+
+@ app.route("/getWordTopics", methods=["POST"])
+def getWordTopics():
+    """
+    Return the weights of a word in each topic of a single iteration and model
+    run of an experiment
+
+    :return: weight of the word in each topic
+    :rtype: Dict
+    """
+    data = request.json['data']
+    weights = queueManager.getWordTopics(data["batchId"], data["experimentId"],
+                                         int(data["iteration"]), int(data["model_run"]),
+                                         int(data["word"]))
+    return {"weights": weights}
+
+
+@ app.route("/getDocumentTopics", methods=["POST"])
+def getDocumentTopics():
+    """
+    Return the topic distributions of a range of documents of a single
+    iteration and model run of an experiment
+
+    :return: for each document from start to end, the weight of each topic
+    :rtype: Dict
+    """
+    data = request.json['data']
+    documents = queueManager.getDocumentTopics(data["batchId"], data["experimentId"],
+                                               int(data["iteration"]), int(data["model_run"]),
+                                               int(data["start"]), int(data["end"]),
+                                               bool(data.get("test", False)))
+    return {"documents": documents}
+
+
 def typed(value):
     """
     Handles typing of data
@@ -465,6 +540,9 @@ if __name__ == '__main__':
     parser.add_argument("--port", type=int, help="port", default=5000)
     parser.add_argument("--host", type=str, help="host", default='localhost')
     parser.add_argument("--dashboardState", type=str, help="dashboardState", default="")
+    parser.add_argument("--slots", type=int, help="number of experiments running at the same time", default=1)
+    parser.add_argument("--cpus", type=int, help="cpus that can be reserved by the experiments", default=None)
+    parser.add_argument("--memory", type=int, help="megabytes of memory that can be reserved by the experiments", default=None)
 
     args = parser.parse_args()
 
@@ -474,7 +552,8 @@ if __name__ == '__main__':
     else:
         dashboardState = os.path.join(os.getcwd(),"queueManagerState.json")
 
-    queueManager = QueueManager(dashboardState)
+    queueManager = QueueManager(dashboardState, slots=args.slots,
+                                cpus=args.cpus, memory=args.memory)
 
     url = 'http://' + str(args.host) + ':' + str(args.port)
     webbrowser.open_new(url)
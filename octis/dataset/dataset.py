@@ -1,13 +1,157 @@
 import codecs
+import hashlib
 import json
+import os
 import pickle
-from os.path import join, exists
+import tempfile
+from os.path import join, exists, getmtime
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from octis.dataset.downloader import get_data_home, _pkl_filepath, download_dataset
 
+# folder, inside a dataset folder, of the columnar binary version of the dataset
+COLUMNAR_FOLDER = "columnar"
+_COLUMNAR_VERSION = 1
+
+# suffix of the line-offset index of a text file
+LINE_INDEX_SUFFIX = ".idx"
+_LINE_INDEX_CHUNK = 1 << 24
+# indexes stored in the octis data home in this process, keyed by text file
+_home_line_indexes = dict()
+
+
+def _build_line_offsets(file_name):
+    """
+    Returns the byte offsets of the start of each line of a text file,
+    followed by the size of the file (uint64)
+    """
+    size = os.path.getsize(file_name)
+    starts = [np.zeros(1, dtype=np.uint64)]
+    with open(file_name, 'rb') as file:
+        position = 0
+        while True:
+            chunk = file.read(_LINE_INDEX_CHUNK)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+            starts.append((newlines + position + 1).astype(np.uint64))
+            position += len(chunk)
+    offsets = np.concatenate(starts)
+    # a line starts after every newline but the last one of the file
+    offsets = offsets[offsets < size] if size > 0 else offsets[:0]
+    return np.append(offsets, np.uint64(size))
+
+
+def _is_line_index_valid(file_name, index_name):
+    """
+    Checks that a line-offset index exists, is not older than its text file
+    and ends at the size of the text file
+    """
+    if index_name is None:
+        return False
+    try:
+        index_stat, file_stat = os.stat(index_name), os.stat(file_name)
+    except FileNotFoundError:
+        return False
+    if index_stat.st_mtime_ns < file_stat.st_mtime_ns or index_stat.st_size < 8:
+        return False
+    with open(index_name, 'rb') as index_file:
+        index_file.seek(-8, os.SEEK_END)
+        end = np.frombuffer(index_file.read(8), dtype='<u8')[0]
+    return int(end) == file_stat.st_size
+
+
+def _write_line_index(file_name, index_name):
+    """
+    Builds the line-offset index of a text file and writes it atomically, so
+    that the readers never see it half written
+    """
+    # the temporary file is created first, not to read the text file when
+    # the folder of the index is not writable
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(index_name))
+    try:
+        with os.fdopen(fd, 'wb') as index_file:
+            index_file.write(
+                _build_line_offsets(file_name).astype('<u8').tobytes())
+        os.replace(tmp_name, index_name)
+    except:
+        if exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def line_index(file_name):
+    """
+    Returns the path of the line-offset index of a text file (the file name
+    followed by LINE_INDEX_SUFFIX), building it if it does not exist or is
+    out of date. The index holds the byte offsets (little-endian uint64) of
+    the start of each line, followed by the size of the file, so that a line
+    is read with a single seek and the lines are counted from the size of
+    the index. The index of a file in a folder that is not writable is
+    stored in the line_indexes folder of the octis data home
+    Parameters
+    ----------
+    file_name : path of the text file
+
+    Returns
+    -------
+    index_name : path of the index
+    """
+    file_name = os.path.abspath(file_name)
+    index_name = file_name + LINE_INDEX_SUFFIX
+    if _is_line_index_valid(file_name, index_name):
+        return index_name
+    if _is_line_index_valid(file_name, _home_line_indexes.get(file_name)):
+        return _home_line_indexes[file_name]
+    try:
+        _write_line_index(file_name, index_name)
+        return index_name
+    except OSError:
+        # the folder of the file is not writable
+        index_name = join(
+            get_data_home(), "line_indexes",
+            hashlib.md5(file_name.encode('utf-8')).hexdigest() + LINE_INDEX_SUFFIX)
+    if not _is_line_index_valid(file_name, index_name):
+        os.makedirs(os.path.dirname(index_name), exist_ok=True)
+        _write_line_index(file_name, index_name)
+    _home_line_indexes[file_name] = index_name
+    return index_name
+
+
+def count_lines(file_name):
+    """
+    Returns the number of lines of a text file, from its line-offset index
+    Parameters
+    ----------
+    file_name : path of the text file
+    """
+    return os.path.getsize(line_index(file_name)) // 8 - 1
+
+
+def read_line(file_name, line):
+    """
+    Returns a line of a text file (without the line terminator), read with a
+    single seek through its line-offset index
+    Parameters
+    ----------
+    file_name : path of the text file
+    line : number of the line, from 0
+    """
+    index_name = line_index(file_name)
+    if not 0 <= line < os.path.getsize(index_name) // 8 - 1:
+        raise IndexError("line " + str(line) + " out of range in " + file_name)
+    with open(index_name, 'rb') as index_file:
+        index_file.seek(8 * line)
+        start, end = np.frombuffer(index_file.read(16), dtype='<u8').tolist()
+    with open(file_name, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    return data.decode('utf-8').rstrip("\r\n")
+
 
 class Dataset:
     """
@@ -33,50 +177,201 @@ class Dataset:
         self.__original_indexes = document_indexes
         self.dataset_path = None
         self.is_cached = False
+        # token table and memory-mapped token ids and document offsets of a
+        # dataset loaded from the columnar format
+        self._columnar = None
+        # token ids, document-term matrices and their partitions, keyed by
+        # vocabulary, shared by all the models trained on the dataset
+        self._bow_cache = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._columnar is not None:
+            # the corpus is rebuilt (or memory-mapped again) on demand, so
+            # that the processes using the dataset share the same pages
+            state['_Dataset__corpus'] = None
+            state['_columnar'] = {'path': self._columnar['path']}
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_bow_cache', dict())
+        self.__dict__.update(state)
+        if self._columnar is not None:
+            self._columnar = self._open_columnar(self._columnar['path'])
 
     def get_corpus(self):
+        if self.__corpus is None and self._columnar is not None:
+            table = np.array(self._columnar['table'], dtype=object)
+            words = table[np.asarray(self._columnar['tokens'])].tolist()
+            offsets = self._columnar['offsets'].tolist()
+            self.__corpus = [words[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
         return self.__corpus
 
+    def get_document(self, index):
+        """
+        Returns a single document of the corpus, without building the corpus
+        if the dataset was loaded from the columnar format
+        Parameters
+        ----------
+        index : position of the document in the corpus
+        """
+        if self.__corpus is None and self._columnar is not None:
+            offsets = self._columnar['offsets']
+            ids = np.asarray(self._columnar['tokens'][offsets[index]:offsets[index + 1]])
+            return [self._columnar['table'][i] for i in ids.tolist()]
+        return self.get_corpus()[index]
+
+    @staticmethod
+    def read_document(path, index):
+        """
+        Returns a single document of the corpus.tsv of a dataset folder, in
+        the order of the file, with a single seek through the line-offset
+        index of the file (built the first time). A folder written by save
+        has the documents in the order of the corpus
+        Parameters
+        ----------
+        path : path of the dataset folder
+        index : position of the document in corpus.tsv
+        """
+        return read_line(join(path, "corpus.tsv"), index).split("\t")[0].split()
+
+    @staticmethod
+    def count_documents(path):
+        """
+        Returns the number of documents of the corpus.tsv of a dataset
+        folder, from the line-offset index of the file
+        Parameters
+        ----------
+        path : path of the dataset folder
+        """
+        return count_lines(join(path, "corpus.tsv"))
+
     # Partitioned Corpus getter
     def get_partitioned_corpus(self, use_validation=True):
-        if "last-training-doc" in self.__metadata:
-            last_training_doc = self.__metadata["last-training-doc"]
-            if use_validation:
-                last_validation_doc = self.__metadata["last-validation-doc"]
-                if self.__corpus is not None and last_training_doc != 0:
-                    train_corpus = []
-                    test_corpus = []
-                    validation_corpus = []
-
-                    for i in range(last_training_doc):
-                        train_corpus.append(self.__corpus[i])
-                    for i in range(last_training_doc, last_validation_doc):
-                        validation_corpus.append(self.__corpus[i])
-                    for i in range(last_validation_doc, len(self.__corpus)):
-                        test_corpus.append(self.__corpus[i])
-                    return train_corpus, validation_corpus, test_corpus
-            else:
-                if self.__corpus is not None and last_training_doc != 0:
-                    if "last-validation-doc" in self.__metadata.keys():
-                        last_validation_doc = self.__metadata["last-validation-doc"]
-                    else:
-                        last_validation_doc = 0
+        self.get_corpus()
+        if "last-training-doc" not in self.__metadata:
+            return [self.__corpus]
+        if self.__corpus is not None:
+            bounds = self._get_partition_bounds(len(self.__corpus), use_validation)
+            if bounds is not None:
+                return tuple(self.__corpus[start:end] for start, end in bounds)
 
-                    train_corpus = []
-                    test_corpus = []
-                    for i in range(last_training_doc):
-                        train_corpus.append(self.__corpus[i])
+    def _get_partition_bounds(self, num_docs, use_validation=True):
+        """
+        Returns the (start, end) document ranges of the partitions of the
+        dataset, or None if the dataset has no training partition
+        Parameters
+        ----------
+        num_docs : number of documents of the dataset
+        use_validation : True if the validation partition is returned, False
+            if it is left out
+        """
+        last_training_doc = self.__metadata["last-training-doc"]
+        if last_training_doc == 0:
+            return None
+        if use_validation:
+            last_validation_doc = self.__metadata["last-validation-doc"]
+            return [(0, last_training_doc), (last_training_doc, last_validation_doc),
+                    (last_validation_doc, num_docs)]
+        last_validation_doc = self.__metadata.get("last-validation-doc", 0)
+        if last_validation_doc != 0:
+            return [(0, last_training_doc), (last_validation_doc, num_docs)]
+        return [(0, last_training_doc), (last_training_doc, num_docs)]
+
+    def get_token_ids(self, vocabulary=None):
+        """
+        Returns the documents as ids of the words of a vocabulary. The words
+        that are not in the vocabulary are left out. The result is computed
+        once and cached
+        Parameters
+        ----------
+        vocabulary : list of words, the id of a word is its position in the
+            list (default: the vocabulary of the dataset)
 
-                    if last_validation_doc != 0:
-                        for i in range(last_validation_doc, len(self.__corpus)):
-                            test_corpus.append(self.__corpus[i])
-                    else:
-                        for i in range(last_training_doc, len(self.__corpus)):
-                            test_corpus.append(self.__corpus[i])
-                    return train_corpus, test_corpus
-        else:
-            return [self.__corpus]
+        Returns
+        -------
+        token_ids : int32 array of the token ids of all the documents
+        offsets : int64 array, the token ids of the i-th document are
+            token_ids[offsets[i]:offsets[i + 1]]
+        """
+        vocabulary = self._get_vocabulary_key(vocabulary)
+        key = ('token_ids', vocabulary)
+        if key not in self._bow_cache:
+            vocab2id = {w: i for i, w in enumerate(vocabulary)}
+            if self.__corpus is None and self._columnar is not None:
+                # map the token table of the columnar dataset, instead of
+                # looking up every token
+                table_ids = np.array([vocab2id.get(w, -1) for w in self._columnar['table']], dtype=np.int32)
+                token_ids = table_ids[np.asarray(self._columnar['tokens'])]
+                offsets = np.asarray(self._columnar['offsets'], dtype=np.int64)
+            else:
+                corpus = self.get_corpus()
+                token_ids = np.fromiter((vocab2id.get(w, -1) for doc in corpus for w in doc), dtype=np.int32)
+                offsets = np.zeros(len(corpus) + 1, dtype=np.int64)
+                np.cumsum([len(doc) for doc in corpus], out=offsets[1:])
+            known = token_ids >= 0
+            if not known.all():
+                kept = np.zeros(len(known) + 1, dtype=np.int64)
+                np.cumsum(known, out=kept[1:])
+                token_ids, offsets = token_ids[known], kept[offsets]
+            self._bow_cache[key] = (token_ids, offsets)
+        return self._bow_cache[key]
+
+    def get_document_term_matrix(self, vocabulary=None):
+        """
+        Returns the document-term matrix of the corpus, computed once and
+        cached
+        Parameters
+        ----------
+        vocabulary : list of words, the column of a word is its position in
+            the list (default: the vocabulary of the dataset)
 
+        Returns
+        -------
+        dtm : sparse CSR matrix (documents x words) of the word counts, with
+            int32 indices and sorted column indices
+        """
+        vocabulary = self._get_vocabulary_key(vocabulary)
+        key = ('dtm', vocabulary)
+        if key not in self._bow_cache:
+            token_ids, offsets = self.get_token_ids(vocabulary)
+            dtm = sparse.csr_matrix(
+                (np.ones(len(token_ids), dtype=np.int64), token_ids, offsets),
+                shape=(len(offsets) - 1, len(vocabulary)))
+            dtm.sum_duplicates()
+            if dtm.nnz <= np.iinfo(np.int32).max:
+                dtm.indices = dtm.indices.astype(np.int32, copy=False)
+                dtm.indptr = dtm.indptr.astype(np.int32, copy=False)
+            self._bow_cache[key] = dtm
+        return self._bow_cache[key]
+
+    def get_partitioned_document_term_matrix(self, use_validation=True, vocabulary=None):
+        """
+        Returns the document-term matrices of the partitions of the corpus,
+        as get_partitioned_corpus returns their documents
+        Parameters
+        ----------
+        use_validation : True if the validation partition is returned, False
+            if it is left out
+        vocabulary : list of words, the column of a word is its position in
+            the list (default: the vocabulary of the dataset)
+        """
+        vocabulary = self._get_vocabulary_key(vocabulary)
+        dtm = self.get_document_term_matrix(vocabulary)
+        if "last-training-doc" not in self.__metadata:
+            return [dtm]
+        key = ('partitions', vocabulary, use_validation)
+        if key not in self._bow_cache:
+            bounds = self._get_partition_bounds(dtm.shape[0], use_validation)
+            if bounds is None:
+                return None
+            self._bow_cache[key] = tuple(dtm[start:end] for start, end in bounds)
+        return self._bow_cache[key]
+
+    def _get_vocabulary_key(self, vocabulary):
+        if vocabulary is None:
+            vocabulary = self.__vocabulary
+        return tuple(vocabulary)
 
     # Edges getter
     def get_edges(self):
@@ -306,11 +601,115 @@ class Dataset:
             self._save_vocabulary(path + "/vocabulary.txt")
             self._save_metadata(path + "/metadata.json")
             self._save_document_indexes(path + "/indexes.txt")
+
+            # the boundaries are the ones computed when loading corpus.tsv
+            n_train = partition.count('train')
+            n_val = partition.count('val')
+            self._save_columnar(
+                join(path, COLUMNAR_FOLDER), [doc for p in partitions for doc in p],
+                labs if self.__labels else None, [n_train, n_train + n_val])
             self.dataset_path = path
 
         except:
             raise Exception("error in saving the dataset")
 
+    def _save_columnar(self, path, corpus, labels, partitions):
+        """
+        Saves the dataset in the columnar binary format: a token table, the
+        token ids of all the documents (int32), the offsets of the documents,
+        the partition boundaries, the labels and the metadata
+        Parameters
+        ----------
+        path : path of the folder to write
+        corpus : documents (lists of tokens) in the order of the partitions
+        labels : labels as written in corpus.tsv (None if there are no labels)
+        partitions : last training and last validation document, or an empty
+                     list to keep the ones in the metadata
+        """
+        Path(path).mkdir(parents=True, exist_ok=True)
+        vocabulary = self.get_vocabulary()
+        token2id = {word: i for i, word in enumerate(vocabulary)}
+        lengths = np.fromiter((len(doc) for doc in corpus), dtype=np.int64, count=len(corpus))
+        offsets = np.zeros(len(corpus) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        tokens = np.fromiter(
+            (token2id.setdefault(word, len(token2id)) for doc in corpus for word in doc),
+            dtype=np.int32, count=int(offsets[-1]))
+
+        # the metadata are written last, a partially written folder is ignored
+        if exists(join(path, "metadata.json")):
+            os.remove(join(path, "metadata.json"))
+        with open(join(path, "vocabulary.txt"), 'w', encoding='utf8') as outfile:
+            for word in token2id:
+                outfile.write(word + "\n")
+        np.save(join(path, "tokens.npy"), tokens)
+        np.save(join(path, "offsets.npy"), offsets)
+        np.save(join(path, "partitions.npy"), np.array(partitions, dtype=np.int64))
+        with open(join(path, "labels.json"), 'w') as outfile:
+            json.dump(labels, outfile, default=lambda x: x.item())
+        with open(join(path, "metadata.json"), 'w') as outfile:
+            json.dump({"version": _COLUMNAR_VERSION, "vocabulary_size": len(vocabulary),
+                       "metadata": self.get_metadata()}, outfile)
+
+    @staticmethod
+    def _open_columnar(path):
+        """
+        Opens the token table and memory-maps the token ids and the document
+        offsets of a dataset saved in the columnar format
+        Parameters
+        ----------
+        path : path of the folder to read
+        """
+        with open(join(path, "vocabulary.txt"), 'r', encoding='utf8') as vocabulary_file:
+            table = [line.rstrip("\n") for line in vocabulary_file]
+        return {'path': path, 'table': table,
+                'tokens': np.load(join(path, "tokens.npy"), mmap_mode='r'),
+                'offsets': np.load(join(path, "offsets.npy"), mmap_mode='r')}
+
+    def _load_columnar(self, path, multilabel=False):
+        """
+        Loads a dataset saved in the columnar format. The documents are
+        built only when the corpus is requested
+        Parameters
+        ----------
+        path : path of the folder to read
+        """
+        with open(join(path, "metadata.json"), 'r') as metadata_file:
+            info = json.load(metadata_file)
+        if info["version"] != _COLUMNAR_VERSION:
+            raise Exception("unsupported columnar dataset version in " + path)
+        self._columnar = self._open_columnar(path)
+        self.__corpus = None
+        self.__vocabulary = self._columnar['table'][:info["vocabulary_size"]]
+        self.__metadata = info["metadata"] if info["metadata"] is not None else dict()
+        partitions = np.load(join(path, "partitions.npy"))
+        if len(partitions) > 0:
+            self.__metadata['last-training-doc'] = int(partitions[0])
+            self.__metadata['last-validation-doc'] = int(partitions[1])
+        with open(join(path, "labels.json"), 'r') as labels_file:
+            labels = json.load(labels_file)
+        if labels is not None:
+            if multilabel:
+                self.__labels = [doc.split() for doc in labels]
+            else:
+                self.__labels = labels
+
+    @staticmethod
+    def _is_columnar_valid(path, sources):
+        """
+        Checks that a columnar dataset exists and is not older than the files
+        it was built from
+        Parameters
+        ----------
+        path : path of the columnar folder
+        sources : paths of the source files
+        """
+        metadata_path = join(path, "metadata.json")
+        if not exists(metadata_path):
+            return False
+        return all(getmtime(source) <= getmtime(metadata_path)
+                   for source in sources if exists(source))
+
     def load_custom_dataset_from_folder(self, path, multilabel=False):
         """
         Loads all the dataset from a folder
@@ -319,6 +718,18 @@ class Dataset:
         path : path of the folder to read
         """
         self.dataset_path = path
+        self._bow_cache = dict()
+        columnar_path = join(path, COLUMNAR_FOLDER)
+        sources = [join(path, name) for name in ["corpus.tsv", "metadata.json", "vocabulary.txt"]]
+        if self._is_columnar_valid(columnar_path, sources):
+            try:
+                self._load_columnar(columnar_path, multilabel)
+                if exists(self.dataset_path + "/indexes.txt"):
+                    self._load_document_indexes(self.dataset_path + "/indexes.txt")
+            except:
+                raise Exception("error in loading the dataset:" + self.dataset_path)
+            return
+        self._columnar = None
         try:
             if exists(self.dataset_path + "/metadata.json"):
                 self._load_metadata(self.dataset_path + "/metadata.json")
@@ -376,9 +787,24 @@ class Dataset:
             instead of trying to download the data from the source site.
         """
 
+        self._bow_cache = dict()
         data_home = get_data_home(data_home=data_home)
         cache_path = _pkl_filepath(data_home, dataset_name + ".pkz")
         dataset_home = join(data_home, dataset_name)
+        columnar_path = join(dataset_home, COLUMNAR_FOLDER)
+        if exists(cache_path) and self._is_columnar_valid(columnar_path, [cache_path]):
+            try:
+                self._load_columnar(columnar_path)
+                self.is_cached = True
+                self.dataset_path = cache_path
+                return
+            except Exception as e:
+                print(80 * '_')
+                print('Columnar dataset loading failed')
+                print(80 * '_')
+                print(e)
+
+        self._columnar = None
         cache = None
         if exists(cache_path):
             try:
@@ -406,4 +832,9 @@ class Dataset:
         self.__metadata = cache["metadata"]
         self.dataset_path = cache_path
         self.__labels = cache["labels"]
+        try:
+            self._save_columnar(columnar_path, self.__corpus, self.__labels, [])
+        except OSError:
+            # the dataset will be loaded from the cache again
+            pass
 
@@ -1,3 +1,8 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from sklearn import svm
 from sklearn.metrics import (
@@ -9,12 +14,43 @@ import octis.configuration.citations as citations
 from octis.evaluation_metrics.metrics import AbstractMetric
 from sklearn.preprocessing import MultiLabelBinarizer
 
-stored_average = None
-stored_use_log = None
-stored_scale = None
-stored_kernel = None
-stored_model_output_hash = None
-stored_svm_results = [None, None]
+# number of classifier results kept by compute_SVM_output
+SVM_CACHE_SIZE = 32
+
+# classifier results of this process, in least recently used order
+_svm_cache = OrderedDict()
+_svm_cache_lock = threading.Lock()
+# locks of the classifiers being fitted, so that metrics scored concurrently
+# on the same model output wait for a single fit
+_svm_fit_locks = dict()
+
+
+def _reset_svm_cache_lock():
+    # a forked child must not inherit a lock held by another thread
+    global _svm_cache_lock, _svm_fit_locks
+    _svm_cache_lock = threading.Lock()
+    _svm_fit_locks = dict()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_svm_cache_lock)
+
+
+def _digest(*values):
+    """
+    Return a digest of strings and NumPy arrays, computed on the array
+    buffers instead of their (truncated) representations
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            digest.update(str((value.dtype.str, value.shape)).encode('utf-8'))
+            digest.update(value.data)
+        else:
+            digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
 
 
 class ClassificationScore(AbstractMetric):
@@ -27,6 +63,7 @@ class ClassificationScore(AbstractMetric):
         self._test_document_representations = None
 
         self._labels = dataset.get_labels()
+        self._labels_digest = _digest(self._labels)
         self.average = average
 
         self.same_svm = same_svm
@@ -89,37 +126,61 @@ class ClassificationScore(AbstractMetric):
 
 
 def compute_SVM_output(model_output, metric, super_metric):
-    global stored_average
-    global stored_use_log
-    global stored_scale
-    global stored_kernel
-    global stored_svm_results
-    global stored_model_output_hash
-
-    model_output_hash = hash(str(model_output))
-
-    test_labels = None
-    predicted_test_labels = None
-    flag = True
-
-    if (stored_average == metric.average and
-        stored_use_log == metric.use_log and
-        stored_scale == metric.scale and
-        stored_kernel == metric.kernel and
-            stored_model_output_hash == model_output_hash):
-        test_labels, predicted_test_labels = stored_svm_results
-    else:
-        test_labels, predicted_test_labels = super_metric.score(model_output)
-
-        stored_average = metric.average
-        stored_use_log = metric.use_log
-        stored_scale = metric.scale
-        stored_kernel = metric.kernel
-        stored_svm_results = [test_labels, predicted_test_labels]
-        stored_model_output_hash = model_output_hash
-        flag = False
-
-    return [test_labels, predicted_test_labels, flag]
+    """
+    Return the test labels and the labels predicted by the classifier of a
+    metric, fitting the classifier only if no metric has fitted it on the
+    same model output (and labels and settings) before
+
+    Parameters
+    ----------
+    model_output : dictionary, output of the model. keys
+                   'topic-document-matrix' and
+                   'test-topic-document-matrix' are required.
+    metric : ClassificationScore metric
+    super_metric : ClassificationScore view of the metric, which fits the
+                   classifier
+
+    Returns
+    -------
+    [test labels, predicted test labels, True if the results were cached]
+    """
+    key = (_digest(model_output["topic-document-matrix"],
+                   model_output["test-topic-document-matrix"]),
+           metric._labels_digest, metric.average, metric.use_log,
+           metric.scale, metric.kernel)
+
+    with _svm_cache_lock:
+        svm_results = _get_svm_results(key)
+        if svm_results is not None:
+            return svm_results
+        fit_lock = _svm_fit_locks.setdefault(key, threading.Lock())
+    with fit_lock:
+        with _svm_cache_lock:
+            svm_results = _get_svm_results(key)
+        if svm_results is not None:
+            return svm_results
+        try:
+            test_labels, predicted_test_labels = super_metric.score(model_output)
+            with _svm_cache_lock:
+                _svm_cache[key] = (test_labels, predicted_test_labels)
+                while len(_svm_cache) > SVM_CACHE_SIZE:
+                    _svm_cache.popitem(last=False)
+        finally:
+            with _svm_cache_lock:
+                _svm_fit_locks.pop(key, None)
+    return [test_labels, predicted_test_labels, False]
+
+
+def _get_svm_results(key):
+    """
+    Return the cached results of a classifier, or None. The caller must hold
+    _svm_cache_lock.
+    """
+    svm_results = _svm_cache.get(key)
+    if svm_results is None:
+        return None
+    _svm_cache.move_to_end(key)
+    return [svm_results[0], svm_results[1], True]
 
 
 class F1Score(ClassificationScore):
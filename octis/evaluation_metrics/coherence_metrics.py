@@ -1,15 +1,10 @@
 from octis.evaluation_metrics.metrics import AbstractMetric
+from octis.evaluation_metrics.embeddings_store import load_word_embeddings
 from octis.dataset.dataset import Dataset
-from gensim.corpora.dictionary import Dictionary
-from gensim.models import CoherenceModel
-from gensim.models import KeyedVectors
-import gensim.downloader as api
+from octis.evaluation_metrics.cooccurrence_index import get_cooccurrence_index, get_window_size
 import octis.configuration.citations as citations
 import numpy as np
 import itertools
-from scipy import spatial
-from sklearn.metrics import pairwise_distances
-from operator import add
 
 
 class Coherence(AbstractMetric):
@@ -23,7 +18,7 @@ class Coherence(AbstractMetric):
         topk : how many most likely words to consider in
         the evaluation
         measure : (default 'c_npmi') measure to use.
-        processes: number of processes
+        processes: number of processes used to build the co-occurrence index
         other measures: 'u_mass', 'c_v', 'c_uci', 'c_npmi'
         """
         super().__init__()
@@ -31,10 +26,10 @@ class Coherence(AbstractMetric):
             self._texts = _load_default_texts()
         else:
             self._texts = texts
-        self._dictionary = Dictionary(self._texts)
         self.topk = topk
         self.processes = processes
         self.measure = measure
+        self._index = None
 
     def info(self):
         return {
@@ -61,14 +56,12 @@ class Coherence(AbstractMetric):
         if self.topk > len(topics[0]):
             raise Exception('Words in topics are less than topk')
         else:
-            npmi = CoherenceModel(
-                topics=topics,
-                texts=self._texts,
-                dictionary=self._dictionary,
-                coherence=self.measure,
-                processes=self.processes,
-                topn=self.topk)
-            return npmi.get_coherence()
+            if self._index is None:
+                # the index is shared with the other metrics using the same
+                # texts and window, and persisted across processes
+                self._index = get_cooccurrence_index(
+                    self._texts, window_size=get_window_size(self.measure), processes=self.processes)
+            return self._index.coherence(topics, measure=self.measure, topn=self.topk)
 
 
 class WECoherencePairwise(AbstractMetric):
@@ -89,11 +82,7 @@ class WECoherencePairwise(AbstractMetric):
         self.binary = binary
         self.topk = topk
         self.word2vec_path = word2vec_path
-        if word2vec_path is None:
-            self._wv = api.load('word2vec-google-news-300')
-        else:
-            self._wv = KeyedVectors.load_word2vec_format(
-                word2vec_path, binary=self.binary)
+        self._wv = load_word_embeddings(word2vec_path, binary=self.binary)
 
     def info(self):
         return {
@@ -117,30 +106,18 @@ class WECoherencePairwise(AbstractMetric):
         """
         topics = model_output["topics"]
 
-        result = 0.0
-        for topic in topics:
-            E = []
-
-            # Create matrix E (normalize word embeddings of
-            # words represented as vectors in wv)
-            for word in topic[0:self.topk]:
-                if word in self._wv.key_to_index.keys():
-                    word_embedding = self._wv.__getitem__(word)
-                    normalized_we = word_embedding / word_embedding.sum()
-                    E.append(normalized_we)
-            if len(E) > 0:
-                E = np.array(E)
-
-                # Perform cosine similarity between E rows
-                distances = np.sum(1 - pairwise_distances(E, metric='cosine') - np.diag(np.ones(len(E))))
-                topic_coherence = distances/(self.topk*(self.topk-1))
-            else:
-                topic_coherence = -1
+        embeddings, mask = _topics_embeddings(topics, self._wv, self.topk)
+        # normalize word embeddings of words represented as vectors in wv
+        embeddings = _unit_rows(embeddings / _masked_sum(embeddings, mask))
 
-            # Update result with the computed coherence of the topic
-            result += topic_coherence
-        result = result/len(topics)
-        return result
+        # cosine similarity between the words of each topic, excluding the
+        # similarity of a word with itself
+        similarities = np.clip(np.matmul(embeddings, embeddings.transpose(0, 2, 1)), -1, 1)
+        pair_mask = mask[:, :, None] & mask[:, None, :]
+        pair_mask[:, np.arange(mask.shape[1]), np.arange(mask.shape[1])] = False
+        topic_coherences = np.where(pair_mask, similarities, 0).sum(axis=(1, 2))/(self.topk*(self.topk-1))
+        topic_coherences[~mask.any(axis=1)] = -1
+        return topic_coherences.mean()
 
 
 class WECoherenceCentroid(AbstractMetric):
@@ -158,11 +135,7 @@ class WECoherenceCentroid(AbstractMetric):
         self.topk = topk
         self.binary = binary
         self.word2vec_path = word2vec_path
-        if self.word2vec_path is None:
-            self._wv = api.load('word2vec-google-news-300')
-        else:
-            self._wv = KeyedVectors.load_word2vec_format(
-                self.word2vec_path, binary=self.binary)
+        self._wv = load_word_embeddings(self.word2vec_path, binary=self.binary)
 
     @staticmethod
     def info():
@@ -183,40 +156,61 @@ class WECoherenceCentroid(AbstractMetric):
         if self.topk > len(topics[0]):
             raise Exception('Words in topics are less than topk')
         else:
-            result = 0
-            for topic in topics:
-                E = []
-                # average vector of the words in topic (centroid)
-                t = np.zeros(self._wv.vector_size)
-                # Create matrix E (normalize word embeddings of
-                # words represented as vectors in wv) and
-                # average vector of the words in topic
-                for word in topic[0:self.topk]:
-                    if word in self._wv.key_to_index.keys():
-                        word_embedding = self._wv.__getitem__(word)
-                        normalized_we = word_embedding/sum(word_embedding)
-                        E.append(normalized_we)
-                        t = list(map(add, t, word_embedding))
-
-                t = np.array(t)
-                if sum(t) != 0:
-                    t = t/(len(t)*sum(t))
-
-                if len(E) > 0:
-                    topic_coherence = 0
-                    # Perform cosine similarity between each word embedding in E
-                    # and t.
-                    for word_embedding in E:
-                        distance = spatial.distance.cosine(word_embedding, t)
-                        topic_coherence += distance
-                    topic_coherence = topic_coherence/self.topk
-                else:
-                    topic_coherence = -1
-
-                # Update result with the computed coherence of the topic
-                result += topic_coherence
-            result /= len(topics)
-            return result
+            embeddings, mask = _topics_embeddings(topics, self._wv, self.topk)
+            # average vector of the words in topic (centroid)
+            centroids = np.where(mask[:, :, None], embeddings, 0).sum(axis=1)
+            centroid_sums = centroids.sum(axis=1, keepdims=True)
+            centroids = centroids/np.where(centroid_sums != 0, centroids.shape[1]*centroid_sums, 1)
+            # normalize word embeddings of words represented as vectors in wv
+            embeddings = _unit_rows(embeddings / _masked_sum(embeddings, mask))
+
+            # cosine distance between each word embedding and the centroid
+            distances = np.abs(1 - np.einsum('tkd,td->tk', embeddings, _unit_rows(centroids)))
+            topic_coherences = np.where(mask, distances, 0).sum(axis=1)/self.topk
+            topic_coherences[~mask.any(axis=1)] = -1
+            return topic_coherences.mean()
+
+
+def _topics_embeddings(topics, wv, topk):
+    """
+    Gather the embeddings of the top-k words of all the topics
+
+    Parameters
+    ----------
+    topics : list of topics (lists of words)
+    wv : word embeddings (KeyedVectors)
+    topk : how many most likely words to consider
+
+    Returns
+    -------
+    embeddings : array of shape (n_topics, topk, embedding size), zero for the
+        words that are not in the embeddings vocabulary
+    mask : boolean array of shape (n_topics, topk), True for the words that are
+        in the embeddings vocabulary
+    """
+    indexes = np.full((len(topics), topk), -1, dtype=np.int64)
+    for i, topic in enumerate(topics):
+        for j, word in enumerate(topic[0:topk]):
+            indexes[i, j] = wv.key_to_index.get(word, -1)
+    mask = indexes >= 0
+    embeddings = np.zeros((len(topics), topk, wv.vector_size))
+    embeddings[mask] = wv.vectors[indexes[mask]]
+    return embeddings, mask
+
+
+def _masked_sum(embeddings, mask):
+    """
+    Return the sum of the components of each embedding, one for the masked ones
+    """
+    return np.where(mask, embeddings.sum(axis=-1), 1)[..., None]
+
+
+def _unit_rows(vectors):
+    """
+    Divide the vectors by their norm, leaving the null vectors unchanged
+    """
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
 
 
 def _load_default_texts():
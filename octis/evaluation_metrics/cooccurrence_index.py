@@ -0,0 +1,448 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+from os.path import exists, join
+
+import numpy as np
+from gensim.models.coherencemodel import COHERENCE_MEASURES, SLIDING_WINDOW_SIZES
+
+from octis.dataset.downloader import get_data_home
+
+"""
+Precomputed word (co-)occurrence index used to score topic coherence.
+
+The index stores, for every word of a corpus, the set of "virtual documents"
+in which the word occurs. A virtual document is either a whole document
+(boolean document estimation, used by 'u_mass') or a sliding window over a
+document (used by 'c_v', 'c_uci' and 'c_npmi'), with exactly the same
+semantics as gensim's text analysis accumulators. The set of virtual documents
+of a word is stored as sorted, disjoint runs [start, end) in CSR layout, so
+the occurrence count of a word is the total length of its runs and the
+co-occurrence count of two words is the overlap of their runs.
+
+An index is built once per (corpus, window size), persisted as plain .npy
+files and memory-mapped on load, so that it is shared by all the Coherence
+metrics of a process and by all the processes using the same corpus.
+"""
+
+_INDEX_VERSION = 1
+_CHUNK_SIZE = 5000
+_ARRAYS = ['indptr', 'starts', 'ends', 'end_keys', 'cumulative']
+
+# indexes already loaded in this process, keyed by (fingerprint, window size)
+_loaded_indexes = {}
+
+
+def get_window_size(measure):
+    """
+    Return the window size used by a coherence measure (None for the
+    boolean document estimation)
+    """
+    if measure not in COHERENCE_MEASURES:
+        raise Exception('Unknown coherence measure ' + str(measure))
+    return SLIDING_WINDOW_SIZES.get(measure)
+
+
+def corpus_fingerprint(texts):
+    """
+    Return a digest identifying the content of a corpus
+
+    Parameters
+    ----------
+    texts : list of documents (list of lists of strings)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for doc in texts:
+        # each document is hashed as a JSON list, which delimits its tokens,
+        # so that e.g. ["new york"] and ["new", "york"] have different digests
+        digest.update(json.dumps(list(doc)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_cooccurrence_index(texts, window_size=None, processes=1, index_home=None):
+    """
+    Return the co-occurrence index of a corpus, building it only if it has not
+    been built before in this process or on disk
+
+    Parameters
+    ----------
+    texts : list of documents (list of lists of strings)
+    window_size : size of the sliding window, None to use whole documents
+    processes : number of processes used to build the index
+    index_home : folder where the indexes are stored (default
+        <octis data home>/coherence_index)
+
+    Returns
+    -------
+    index : CooccurrenceIndex
+    """
+    fingerprint = corpus_fingerprint(texts)
+    key = (fingerprint, window_size)
+    if key in _loaded_indexes:
+        return _loaded_indexes[key]
+
+    if index_home is None:
+        index_home = join(get_data_home(), 'coherence_index')
+    window_name = 'doc' if window_size is None else str(window_size)
+    path = join(index_home, fingerprint + '_' + window_name)
+    if exists(join(path, 'metadata.json')):
+        index = CooccurrenceIndex.load(path)
+    else:
+        index = CooccurrenceIndex.build(texts, window_size, processes)
+        try:
+            index.save(path)
+            index = CooccurrenceIndex.load(path)
+        except OSError:
+            # the index can still be used from memory
+            pass
+    _loaded_indexes[key] = index
+    return index
+
+
+def _runs_of_chunk(args):
+    """
+    Compute the occurrence runs of the words of a chunk of documents
+
+    Parameters
+    ----------
+    args : tuple (ids, lengths, window_size, first_window) where ids are the
+        concatenated word ids of the documents, lengths the number of words of
+        each document and first_window the number of virtual documents preceding
+        the chunk
+
+    Returns
+    -------
+    words, starts, ends : word id, first and last (excluded) virtual document
+        of each run
+    num_windows : number of virtual documents of the chunk
+    """
+    ids, lengths, window_size, first_window = args
+    if window_size is None:
+        num_doc_windows = np.ones(len(lengths), dtype=np.int64)
+    else:
+        # a document shorter than the window is a single window
+        num_doc_windows = np.maximum(1, lengths - window_size + 1)
+    window_offsets = first_window + np.concatenate(([0], np.cumsum(num_doc_windows)[:-1]))
+    doc_of_token = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    offsets = window_offsets[doc_of_token]
+
+    # A word is added to the window in which it enters and, as in gensim's
+    # WordOccurrenceAccumulator, removed from the window that follows its
+    # position, even if it occurs again inside that window. Every word is also
+    # removed at the end of its document.
+    if window_size is None:
+        set_steps = offsets
+        has_unset = np.zeros(len(ids), dtype=bool)
+    else:
+        set_steps = offsets + np.maximum(0, positions - window_size + 1)
+        has_unset = positions <= lengths[doc_of_token] - window_size - 1
+    unset_steps = offsets[has_unset] + positions[has_unset] + 1
+    end_steps = offsets + num_doc_windows[doc_of_token]
+
+    words = np.concatenate((ids, ids[has_unset], ids))
+    steps = np.concatenate((set_steps, unset_steps, end_steps))
+    is_set = np.concatenate((np.ones(len(ids), dtype=bool),
+                             np.zeros(len(unset_steps) + len(ids), dtype=bool)))
+    # within the same step a removal happens before an insertion
+    order = np.lexsort((is_set, steps, words))
+    words, steps, is_set = words[order], steps[order], is_set[order]
+
+    first_of_word = np.ones(len(words), dtype=bool)
+    first_of_word[1:] = words[1:] != words[:-1]
+    previous_set = np.zeros(len(words), dtype=bool)
+    previous_set[1:] = is_set[:-1]
+    previous_set[first_of_word] = False
+    run_starts = is_set & ~previous_set
+    run_ends = ~is_set & previous_set
+
+    words, starts, ends = words[run_starts], steps[run_starts], steps[run_ends]
+    # merge runs that are adjacent
+    if len(starts) > 1:
+        keep = np.ones(len(starts), dtype=bool)
+        keep[1:] = (words[1:] != words[:-1]) | (starts[1:] != ends[:-1])
+        last = np.concatenate((np.flatnonzero(keep)[1:], [len(starts)])) - 1
+        words, starts, ends = words[keep], starts[keep], ends[last]
+    return words, starts, ends, int(num_doc_windows.sum())
+
+
+class CooccurrenceIndex:
+    def __init__(self, vocabulary, num_docs, window_size, indptr, starts, ends,
+                 end_keys=None, cumulative=None):
+        """
+        Initialize the index
+
+        Parameters
+        ----------
+        vocabulary : list of words, the position of a word is its id
+        num_docs : number of virtual documents (documents or windows)
+        window_size : size of the sliding window, None for whole documents
+        indptr : array of size len(vocabulary) + 1, runs of the word with id i
+            are in positions indptr[i]:indptr[i+1] of starts and ends
+        starts : first virtual document of each run
+        ends : last (excluded) virtual document of each run
+        end_keys : ends made globally sorted by adding (id * (num_docs + 1))
+        cumulative : cumulative length of the runs, starting from 0
+        """
+        self.vocabulary = vocabulary
+        self.token2id = {word: i for i, word in enumerate(vocabulary)}
+        self.num_docs = num_docs
+        self.window_size = window_size
+        self.indptr = indptr
+        self.starts = starts
+        self.ends = ends
+        if end_keys is None:
+            rows = np.repeat(np.arange(len(vocabulary), dtype=np.int64), np.diff(indptr))
+            end_keys = ends + rows * (num_docs + 1)
+        if cumulative is None:
+            cumulative = np.concatenate(([0], np.cumsum(ends - starts)))
+        self.end_keys = end_keys
+        self.cumulative = cumulative
+
+    @classmethod
+    def build(cls, texts, window_size=None, processes=1):
+        """
+        Build the index of a corpus
+
+        Parameters
+        ----------
+        texts : list of documents (list of lists of strings)
+        window_size : size of the sliding window, None to use whole documents
+        processes : number of processes used to compute the runs
+
+        Returns
+        -------
+        index : CooccurrenceIndex
+        """
+        token2id = {}
+        chunks = []
+        num_docs = 0
+        for begin in range(0, len(texts), _CHUNK_SIZE):
+            docs = texts[begin:begin + _CHUNK_SIZE]
+            lengths = np.fromiter((len(doc) for doc in docs), dtype=np.int64, count=len(docs))
+            ids = np.fromiter((token2id.setdefault(word, len(token2id)) for doc in docs for word in doc),
+                              dtype=np.int64, count=int(lengths.sum()))
+            if window_size is None:
+                num_windows = len(docs)
+            else:
+                num_windows = int(np.maximum(1, lengths - window_size + 1).sum())
+            chunks.append((ids, lengths, window_size, num_docs))
+            num_docs += num_windows
+
+        if processes > 1 and len(chunks) > 1:
+            with mp.Pool(processes) as pool:
+                results = pool.map(_runs_of_chunk, chunks)
+        else:
+            results = [_runs_of_chunk(chunk) for chunk in chunks]
+
+        if results:
+            words = np.concatenate([r[0] for r in results])
+            starts = np.concatenate([r[1] for r in results])
+            ends = np.concatenate([r[2] for r in results])
+        else:
+            words = starts = ends = np.zeros(0, dtype=np.int64)
+        # runs of different chunks never overlap, only their order is needed
+        order = np.lexsort((starts, words))
+        words, starts, ends = words[order], starts[order], ends[order]
+        indptr = np.zeros(len(token2id) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(words, minlength=len(token2id)), out=indptr[1:])
+        return cls(list(token2id), num_docs, window_size, indptr, starts, ends)
+
+    def save(self, path):
+        """
+        Save the index in a folder. The folder is written atomically, so that
+        concurrent processes never read a partial index.
+
+        Parameters
+        ----------
+        path : folder path
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent)
+        try:
+            for name in _ARRAYS:
+                np.save(join(tmp_path, name + '.npy'), getattr(self, name))
+            with open(join(tmp_path, 'vocabulary.txt'), 'w', encoding='utf8') as outfile:
+                for word in self.vocabulary:
+                    outfile.write(word + '\n')
+            metadata = {'version': _INDEX_VERSION, 'num_docs': self.num_docs,
+                        'window_size': self.window_size}
+            with open(join(tmp_path, 'metadata.json'), 'w') as outfile:
+                json.dump(metadata, outfile)
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            # another process saved the same index first
+            if not exists(join(path, 'metadata.json')):
+                raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with save(), memory-mapping its arrays
+
+        Parameters
+        ----------
+        path : folder path
+
+        Returns
+        -------
+        index : CooccurrenceIndex
+        """
+        with open(join(path, 'metadata.json'), 'r') as infile:
+            metadata = json.load(infile)
+        if metadata['version'] != _INDEX_VERSION:
+            raise Exception('Unsupported coherence index version in ' + path)
+        with open(join(path, 'vocabulary.txt'), 'r', encoding='utf8') as infile:
+            vocabulary = [line.rstrip('\n') for line in infile]
+        arrays = {name: np.load(join(path, name + '.npy'), mmap_mode='r') for name in _ARRAYS}
+        return cls(vocabulary, metadata['num_docs'], metadata['window_size'], **arrays)
+
+    def occurrences(self, ids):
+        """
+        Return the number of virtual documents containing each word
+
+        Parameters
+        ----------
+        ids : array of word ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        return self.cumulative[self.indptr[ids + 1]] - self.cumulative[self.indptr[ids]]
+
+    def _coverage(self, ids, positions):
+        """
+        Return, for each word, the number of virtual documents preceding the
+        given position that contain the word
+        """
+        first = self.indptr[ids]
+        last = self.indptr[ids + 1]
+        k = np.searchsorted(self.end_keys, ids * (self.num_docs + 1) + positions, side='right')
+        coverage = self.cumulative[k] - self.cumulative[first]
+        partial = k < last
+        k_partial = k[partial]
+        coverage[partial] += np.maximum(0, positions[partial] - self.starts[k_partial])
+        return coverage
+
+    def co_occurrences(self, ids1, ids2):
+        """
+        Return the number of virtual documents containing both words of each
+        pair
+
+        Parameters
+        ----------
+        ids1 : array of word ids
+        ids2 : array of word ids, of the same length of ids1
+        """
+        ids1 = np.asarray(ids1, dtype=np.int64)
+        ids2 = np.asarray(ids2, dtype=np.int64)
+        # iterate over the runs of the word with fewer runs
+        num_runs1 = self.indptr[ids1 + 1] - self.indptr[ids1]
+        num_runs2 = self.indptr[ids2 + 1] - self.indptr[ids2]
+        swap = num_runs2 > num_runs1
+        ids1, ids2 = np.where(swap, ids2, ids1), np.where(swap, ids1, ids2)
+        num_runs = np.minimum(num_runs1, num_runs2)
+
+        pair_of_run = np.repeat(np.arange(len(ids1)), num_runs)
+        run_offsets = np.arange(len(pair_of_run)) - np.repeat(np.cumsum(num_runs) - num_runs, num_runs)
+        runs = self.indptr[ids2][pair_of_run] + run_offsets
+        words = ids1[pair_of_run]
+        overlap = (self._coverage(words, np.asarray(self.ends[runs]))
+                   - self._coverage(words, np.asarray(self.starts[runs])))
+        return np.bincount(pair_of_run, weights=overlap, minlength=len(ids1)).astype(np.int64)
+
+    def topics_to_ids(self, topics, topn):
+        """
+        Convert the topics to arrays of word ids, ignoring the words that are
+        not in the corpus, as gensim's CoherenceModel does
+
+        Parameters
+        ----------
+        topics : list of topics (lists of words)
+        topn : number of words of each topic to consider
+        """
+        id_topics = []
+        for topic in topics:
+            ids = [self.token2id[word] for word in topic if word in self.token2id]
+            if not ids:
+                raise ValueError('unable to interpret topic as either a list of tokens or a list of ids')
+            id_topics.append(np.array(ids))
+        if len(id_topics[0]) > topn:
+            id_topics = [topic[:topn] for topic in id_topics]
+        return id_topics
+
+    def accumulator(self, segmented_topics):
+        """
+        Return an accumulator that can be used by gensim's confirmation
+        measures for the given segmented topics
+
+        Parameters
+        ----------
+        segmented_topics : output of a gensim segmentation
+        """
+        pairs = set()
+        for segments in segmented_topics:
+            for w_prime, w_star in segments:
+                w_prime = np.atleast_1d(w_prime)
+                w_star = np.atleast_1d(w_star)
+                words = np.union1d(w_prime, w_star)
+                for i in range(len(words)):
+                    for j in range(i, len(words)):
+                        pairs.add((int(words[i]), int(words[j])))
+        pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        words = np.unique(pairs)
+        return _TopicsAccumulator(
+            self.num_docs, dict(zip(words.tolist(), self.occurrences(words).tolist())),
+            dict(zip(map(tuple, pairs.tolist()), self.co_occurrences(pairs[:, 0], pairs[:, 1]).tolist())))
+
+    def coherence(self, topics, measure='c_npmi', topn=10):
+        """
+        Compute the coherence of the topics, with the same result of gensim's
+        CoherenceModel
+
+        Parameters
+        ----------
+        topics : list of topics (lists of words)
+        measure : 'u_mass', 'c_v', 'c_uci' or 'c_npmi'
+        topn : number of words of each topic to consider
+
+        Returns
+        -------
+        score : coherence score
+        """
+        if get_window_size(measure) != self.window_size:
+            raise Exception('The index has not been built for the measure ' + measure)
+        id_topics = self.topics_to_ids(topics, topn)
+        coherence_measure = COHERENCE_MEASURES[measure]
+        segmented_topics = coherence_measure.seg(id_topics)
+        accumulator = self.accumulator(segmented_topics)
+        kwargs = dict(with_std=False, with_support=False)
+        if measure == 'c_v':
+            kwargs['topics'] = id_topics
+            kwargs['measure'] = 'nlr'
+            kwargs['gamma'] = 1
+        elif measure != 'u_mass':
+            kwargs['normalize'] = (measure == 'c_npmi')
+        confirmed_measures = coherence_measure.conf(segmented_topics, accumulator, **kwargs)
+        return coherence_measure.aggr(confirmed_measures)
+
+
+class _TopicsAccumulator:
+    """
+    Occurrence counts of the words of a set of topics, exposing the interface
+    of gensim's text analysis accumulators
+    """
+
+    def __init__(self, num_docs, occurrences, co_occurrences):
+        self.num_docs = num_docs
+        self._occurrences = occurrences
+        self._co_occurrences = co_occurrences
+
+    def __getitem__(self, word_or_words):
+        if hasattr(word_or_words, '__len__'):
+            w1, w2 = int(word_or_words[0]), int(word_or_words[1])
+            return self._co_occurrences[(w1, w2) if w1 <= w2 else (w2, w1)]
+        return self._occurrences[int(word_or_words)]
@@ -0,0 +1,116 @@
+import numpy as np
+
+"""
+Divergence kernels shared by the diversity and the topic significance
+metrics.
+
+The kernels compare the rows of a (topics x words) matrix with each other or
+with a reference distribution. The word axis is processed in chunks, so the
+temporary arrays never exceed _MAX_CHUNK_ELEMENTS values whatever the size
+of the vocabulary. The chunks are computed in float32 (or in the given
+dtype) and summed in float64.
+"""
+
+# largest number of values of the temporary arrays of a chunk
+_MAX_CHUNK_ELEMENTS = 2 ** 22
+
+# added to the distributions to grant absolute continuity
+EPSILON = 0.00001
+
+
+def _word_chunks(n_words, values_per_word):
+    chunk_size = max(1, _MAX_CHUNK_ELEMENTS // max(1, values_per_word))
+    for start in range(0, n_words, chunk_size):
+        yield slice(start, start + chunk_size)
+
+
+def kl_divergence_to_reference(P, Q, epsilon=EPSILON, dtype=np.float32):
+    """
+    Return the Kullback-Leibler divergence from the distribution Q to each
+    row of P
+
+    Parameters
+    ----------
+    P : (n x words) matrix of distributions
+    Q : reference distribution over the words
+    epsilon : value added to the distributions
+    dtype : type of the computations of the chunks
+
+    Returns
+    -------
+    divergences : array of the n divergences
+    """
+    P = np.asarray(P)
+    Q = np.asarray(Q)
+    divergences = np.zeros(len(P))
+    for words in _word_chunks(P.shape[1], len(P)):
+        p = P[:, words].astype(dtype) + epsilon
+        q = Q[words].astype(dtype) + epsilon
+        divergences += np.sum(p * np.log(p / q), axis=1, dtype=np.float64)
+    return divergences
+
+
+def pairwise_kl_divergence(P, epsilon=EPSILON, dtype=np.float32):
+    """
+    Return the matrix of the Kullback-Leibler divergences between the rows
+    of P, KL(P[i] || P[j]) at row i and column j
+
+    Parameters
+    ----------
+    P : (n x words) matrix of distributions
+    epsilon : value added to the distributions
+    dtype : type of the computations of the chunks
+
+    Returns
+    -------
+    divergences : (n x n) matrix of the divergences
+    """
+    P = np.asarray(P)
+    divergences = np.zeros((len(P), len(P)))
+    for words in _word_chunks(P.shape[1], len(P)):
+        p = P[:, words].astype(dtype) + epsilon
+        log_p = np.log(p)
+        # sum(p_i * log(p_i / p_j)) = sum(p_i * log(p_i)) - sum(p_i * log(p_j))
+        divergences += np.sum(p * log_p, axis=1, dtype=np.float64)[:, None]
+        divergences -= np.dot(p, log_p.T)
+    return divergences
+
+
+def pairwise_log_odds_ratio(P, dtype=np.float32):
+    """
+    Return the matrix of the log odds ratios between the rows of P, the
+    absolute difference of the log probabilities of the words that have a
+    non-zero probability in either row, averaged over the vocabulary
+
+    Parameters
+    ----------
+    P : (n x words) matrix of distributions
+    dtype : type of the computations of the chunks
+
+    Returns
+    -------
+    log_odds_ratios : (n x n) matrix of the log odds ratios
+    """
+    P = np.asarray(P)
+    log_odds_ratios = np.zeros((len(P), len(P)))
+    for words in _word_chunks(P.shape[1], len(P) ** 2):
+        p = P[:, words].astype(dtype)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_p = np.log(p)
+            differences = np.abs(log_p[:, None, :] - log_p[None, :, :])
+        positive = p > 0
+        differences = np.where(positive[:, None, :] | positive[None, :, :], differences, 0)
+        log_odds_ratios += np.sum(differences, axis=2, dtype=np.float64)
+    return log_odds_ratios / P.shape[1]
+
+
+def mean_pairwise(matrix, per_topic=False):
+    """
+    Return the mean of a matrix of pairwise scores over the distinct pairs
+    of rows (i < j) or, if per_topic is True, the mean score of each row
+    with the other rows
+    """
+    n = len(matrix)
+    if per_topic:
+        return (matrix.sum(axis=1) - np.diag(matrix)) / (n - 1)
+    return matrix[np.triu_indices(n, 1)].mean()
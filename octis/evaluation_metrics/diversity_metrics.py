@@ -1,12 +1,22 @@
 from octis.evaluation_metrics.metrics import AbstractMetric
+from octis.evaluation_metrics.embeddings_store import load_word_embeddings
 import octis.configuration.citations as citations
-import itertools
 import numpy as np
-from octis.evaluation_metrics.rbo import rbo
-from octis.evaluation_metrics.word_embeddings_rbo import word_embeddings_rbo
-from octis.evaluation_metrics.word_embeddings_rbo_centroid import word_embeddings_rbo as weirbo_centroid
-import gensim.downloader as api
-from gensim.models import KeyedVectors
+from octis.evaluation_metrics.divergences import mean_pairwise, pairwise_kl_divergence, pairwise_log_odds_ratio
+from octis.evaluation_metrics.metric_suite import shared_intermediate
+from octis.evaluation_metrics.rbo import pairwise_rbo_ext, topics_to_ids
+from octis.evaluation_metrics.word_embeddings_rbo import pairwise_word_embeddings_rbo_ext, unit_word_vectors
+from octis.evaluation_metrics.word_embeddings_rbo_centroid import pairwise_word_embeddings_rbo_ext as \
+    pairwise_weirbo_centroid_ext
+from octis.evaluation_metrics.word_embeddings_rbo_centroid import word_vectors
+
+
+def _topic_ids(model_output, topk):
+    """
+    Integer matrix of the top-k words of the topics (see rbo.topics_to_ids)
+    """
+    return shared_intermediate(
+        model_output, ('topic-ids', topk), lambda: topics_to_ids(model_output['topics'], topk))
 
 
 class TopicDiversity(AbstractMetric):
@@ -46,9 +56,7 @@ class TopicDiversity(AbstractMetric):
         if self.topk > len(topics[0]):
             raise Exception('Words in topics are less than ' + str(self.topk))
         else:
-            unique_words = set()
-            for topic in topics:
-                unique_words = unique_words.union(set(topic[:self.topk]))
+            unique_words = _topic_ids(model_output, self.topk)[2]
             td = len(unique_words) / (self.topk * len(topics))
             return td
 
@@ -79,13 +87,8 @@ class InvertedRBO(AbstractMetric):
         if self.topk > len(topics[0]):
             raise Exception('Words in topics are less than topk')
         else:
-            collect = []
-            for list1, list2 in itertools.combinations(topics, 2):
-                word2index = get_word2index(list1, list2)
-                indexed_list1 = [word2index[word] for word in list1]
-                indexed_list2 = [word2index[word] for word in list2]
-                rbo_val = rbo(indexed_list1[:self.topk], indexed_list2[:self.topk], p=self.weight)[2]
-                collect.append(rbo_val)
+            collect = pairwise_rbo_ext(
+                topics, p=self.weight, topk=self.topk, topic_ids=_topic_ids(model_output, self.topk))
             return 1 - np.mean(collect)
 
 
@@ -109,10 +112,7 @@ class WordEmbeddingsInvertedRBO(AbstractMetric):
         self.norm = normalize
         self.binary = binary
         self.word2vec_path = word2vec_path
-        if word2vec_path is None:
-            self._wv = api.load('word2vec-google-news-300')
-        else:
-            self._wv = KeyedVectors.load_word2vec_format(word2vec_path, binary=self.binary)
+        self._wv = load_word_embeddings(word2vec_path, binary=self.binary)
 
     def score(self, model_output):
         """
@@ -124,16 +124,13 @@ class WordEmbeddingsInvertedRBO(AbstractMetric):
         if self.topk > len(topics[0]):
             raise Exception('Words in topics are less than topk')
         else:
-            collect = []
-            for list1, list2 in itertools.combinations(topics, 2):
-                word2index = get_word2index(list1, list2)
-                index2word = {v: k for k, v in word2index.items()}
-                indexed_list1 = [word2index[word] for word in list1]
-                indexed_list2 = [word2index[word] for word in list2]
-                rbo_val = word_embeddings_rbo(
-                    indexed_list1[:self.topk], indexed_list2[:self.topk], p=self.weight,
-                    index2word=index2word, word2vec=self._wv, norm=self.norm)[2]
-                collect.append(rbo_val)
+            topic_ids = _topic_ids(model_output, self.topk)
+            vectors = shared_intermediate(
+                model_output, ('unit-word-vectors', self.topk, id(self._wv)),
+                lambda: unit_word_vectors(topic_ids[2], self._wv))
+            collect = pairwise_word_embeddings_rbo_ext(
+                topics, p=self.weight, word2vec=self._wv, norm=self.norm, topk=self.topk, topic_ids=topic_ids,
+                vectors=vectors)
             return 1 - np.mean(collect)
 
 
@@ -152,10 +149,7 @@ class WordEmbeddingsInvertedRBOCentroid(AbstractMetric):
         self.norm = normalize
         self.binary = binary
         self.word2vec_path = word2vec_path
-        if word2vec_path is None:
-            self.wv = api.load('word2vec-google-news-300')
-        else:
-            self.wv = KeyedVectors.load_word2vec_format( word2vec_path, binary=self.binary)
+        self.wv = load_word_embeddings(word2vec_path, binary=self.binary)
 
     def score(self, model_output):
         """
@@ -167,17 +161,12 @@ class WordEmbeddingsInvertedRBOCentroid(AbstractMetric):
         if self.topk > len(topics[0]):
             raise Exception('Words in topics are less than topk')
         else:
-            collect = []
-            for list1, list2 in itertools.combinations(topics, 2):
-                word2index = get_word2index(list1, list2)
-                index2word = {v: k for k, v in word2index.items()}
-                indexed_list1 = [word2index[word] for word in list1]
-                indexed_list2 = [word2index[word] for word in list2]
-                rbo_val = weirbo_centroid(
-                    indexed_list1[:self.topk], indexed_list2[:self.topk], p=self.weight, index2word=index2word,
-                    embedding_space=self.wv, norm=self.norm)[2]
-
-                collect.append(rbo_val)
+            topic_ids = _topic_ids(model_output, self.topk)
+            vectors = shared_intermediate(
+                model_output, ('word-vectors', self.topk, id(self.wv)), lambda: word_vectors(topic_ids[2], self.wv))
+            collect = pairwise_weirbo_centroid_ext(
+                topics, p=self.weight, embedding_space=self.wv, norm=self.norm, topk=self.topk, topic_ids=topic_ids,
+                vectors=vectors)
             return 1 - np.mean(collect)
 
 
@@ -188,22 +177,15 @@ class LogOddsRatio(AbstractMetric):
         """
         super().__init__()
 
-    def score(self, model_output):
-        beta = model_output['topic-word-matrix']
-        lor = 0
-        count = 0
-        for i, j in itertools.combinations(range(len(beta)), 2):
-            lor += _LOR(beta[i], beta[j])
-            count += 1
-        return lor / count
-
+    def score(self, model_output, per_topic=False):
+        """
+        Retrieves the score of the metric
 
-def _LOR(P, Q):
-    lor = 0
-    for v, w in zip(P, Q):
-        if v > 0 or w > 0:
-            lor = lor + np.abs(np.log(v) - np.log(w))
-    return lor / len(P)
+        :param model_output: dictionary, output of the model. the 'topic-word-matrix' key is required.
+        :param per_topic: if True, it returns for each topic its mean log odds ratio with the other topics
+        """
+        beta = model_output['topic-word-matrix']
+        return mean_pairwise(pairwise_log_odds_ratio(beta), per_topic)
 
 
 class KLDivergence(AbstractMetric):
@@ -213,33 +195,12 @@ class KLDivergence(AbstractMetric):
         """
         super().__init__()
 
-    def score(self, model_output):
-        beta = model_output['topic-word-matrix']
-        kl_div = 0
-        count = 0
-        for i, j in itertools.combinations(range(len(beta)), 2):
-            kl_div += _KL(beta[i], beta[j])
-            count += 1
-        return kl_div / count
-
-
-def _KL(P, Q):
-    """
-    Perform Kullback-Leibler divergence
-
-    Parameters
-    ----------
-    P : distribution P
-    Q : distribution Q
-
-    Returns
-    -------
-    divergence : divergence from Q to P
-    """
-    # add epsilon to grant absolute continuity
-    epsilon = 0.00001
-    P = P+epsilon
-    Q = Q+epsilon
+    def score(self, model_output, per_topic=False):
+        """
+        Retrieves the score of the metric
 
-    divergence = np.sum(P*np.log(P/Q))
-    return divergence
+        :param model_output: dictionary, output of the model. the 'topic-word-matrix' key is required.
+        :param per_topic: if True, it returns for each topic its mean divergence from the other topics
+        """
+        beta = model_output['topic-word-matrix']
+        return mean_pairwise(pairwise_kl_divergence(beta), per_topic)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from os.path import abspath, exists, getmtime, getsize, join
+
+import gensim.downloader as api
+from gensim.models import KeyedVectors
+
+from octis.dataset.downloader import get_data_home
+
+"""
+Process-wide store of the word embeddings used by the evaluation metrics.
+
+The first time an embedding space is requested, it is loaded (or downloaded)
+and converted to gensim's native format, with the vectors in a separate .npy
+file. Later loads, in this or in any other process, memory-map the vectors
+read-only, so that all the metric instances share one page-cache-backed copy.
+"""
+
+DEFAULT_EMBEDDINGS = 'word2vec-google-news-300'
+
+# embeddings already loaded in this process, keyed by store folder and source
+_loaded_embeddings = {}
+
+
+def _embeddings_key(word2vec_path, binary):
+    if word2vec_path is None:
+        return DEFAULT_EMBEDDINGS
+    word2vec_path = abspath(word2vec_path)
+    # a different file at the same path must not use the stored conversion
+    return '|'.join([word2vec_path, str(getsize(word2vec_path)), str(getmtime(word2vec_path)), str(binary)])
+
+
+def load_word_embeddings(word2vec_path=None, binary=True, store_home=None):
+    """
+    Return the word embeddings, loading them only once per process
+
+    Parameters
+    ----------
+    word2vec_path : path of an embeddings file in word2vec format, if None
+        'word2vec-google-news-300' is downloaded
+    binary : True if the word2vec file is binary, False otherwise
+    store_home : folder where the converted embeddings are stored (default
+        <octis data home>/embeddings)
+
+    Returns
+    -------
+    wv : KeyedVectors, with read-only memory-mapped vectors when the store
+        folder is writable
+    """
+    if store_home is None:
+        store_home = join(get_data_home(), 'embeddings')
+    key = _embeddings_key(word2vec_path, binary)
+    # the embeddings of another store are other files, with their own mapping
+    loaded_key = (abspath(store_home), key)
+    if loaded_key in _loaded_embeddings:
+        return _loaded_embeddings[loaded_key]
+
+    path = join(store_home, hashlib.md5(key.encode('utf-8')).hexdigest())
+    kv_path = join(path, 'embeddings.kv')
+    if exists(kv_path):
+        wv = KeyedVectors.load(kv_path, mmap='r')
+    else:
+        if word2vec_path is None:
+            wv = api.load(DEFAULT_EMBEDDINGS)
+        else:
+            wv = KeyedVectors.load_word2vec_format(word2vec_path, binary=binary)
+        try:
+            _save_embeddings(wv, path)
+            wv = KeyedVectors.load(kv_path, mmap='r')
+        except OSError:
+            # the embeddings can still be used from memory
+            pass
+    _loaded_embeddings[loaded_key] = wv
+    return wv
+
+
+def _save_embeddings(wv, path):
+    """
+    Save the embeddings in a folder, storing the vectors as a separate .npy
+    file. The folder is written atomically, so that concurrent processes
+    never read partial embeddings.
+    """
+    parent = os.path.dirname(abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent)
+    try:
+        wv.save(join(tmp_path, 'embeddings.kv'), separately=['vectors'])
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        # another process saved the same embeddings first
+        if not exists(join(path, 'embeddings.kv')):
+            raise
@@ -0,0 +1,154 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+"""
+Scoring of many metrics on the same model outputs.
+
+A MetricSuite wraps each model output in a ModelOutput, a dictionary that
+memoizes the intermediate results the metrics derive from it (the integer
+matrix of the top words, the normalized topic-word and topic-document
+distributions, the embeddings of the top words, ...). The metrics get them
+through shared_intermediate, so each one is computed once per model output
+whatever the number of metrics that need it, and the metrics can be scored
+concurrently on a thread or a process pool.
+"""
+
+# metrics of a worker process of a MetricSuite
+_worker_metrics = None
+
+
+def _init_metric_worker(metrics):
+    global _worker_metrics
+    _worker_metrics = metrics
+
+
+def _score_metrics(indexes, model_output):
+    shared_output = ModelOutput(model_output)
+    return [_worker_metrics[i].score(shared_output) for i in indexes]
+
+
+class ModelOutput(dict):
+    """
+    Model output that memoizes the intermediate results of the metrics
+    """
+
+    def __init__(self, model_output):
+        super().__init__(model_output)
+        self._intermediates = dict()
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+
+    def intermediate(self, key, compute):
+        """
+        Return the intermediate result identified by key, calling compute()
+        if no metric has computed it yet. Concurrent requests of the same key
+        wait for a single computation. The arrays are returned read-only, as
+        they are shared by all the metrics.
+        """
+        with self._lock:
+            if key in self._intermediates:
+                return self._intermediates[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._intermediates:
+                    return self._intermediates[key]
+            value = compute()
+            for array in (value if isinstance(value, tuple) else (value,)):
+                if isinstance(array, np.ndarray):
+                    array.setflags(write=False)
+            with self._lock:
+                self._intermediates[key] = value
+                del self._key_locks[key]
+        return value
+
+    def __reduce__(self):
+        # the intermediates and the locks stay in this process
+        return dict, (dict(self),)
+
+
+def shared_intermediate(model_output, key, compute):
+    """
+    Return compute(), computed once per model output when the model output
+    is shared by the metrics of a MetricSuite
+
+    :param model_output: output of a topic model
+    :param key: hashable identifier of the intermediate result (it must
+     include all the parameters the result depends on)
+    :param compute: function without arguments that computes the result
+    """
+    if isinstance(model_output, ModelOutput):
+        return model_output.intermediate(key, compute)
+    return compute()
+
+
+class MetricSuite:
+    def __init__(self, metrics, n_jobs=1, backend='thread'):
+        """
+        Initialize a suite of metrics scored on the same model outputs
+
+        :param metrics: list of metrics
+        :param n_jobs: number of metrics scored at the same time (default: 1)
+        :param backend: 'thread' to score the metrics on a thread pool, which
+         shares the intermediate results among all the metrics, or 'process'
+         to score them on a process pool, which shares them among the
+         metrics of each worker (default: 'thread')
+        """
+        if backend not in ['thread', 'process']:
+            raise Exception("backend must be 'thread' or 'process'")
+        self.metrics = list(metrics)
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self._executor = None
+
+    def score(self, model_output):
+        """
+        Retrieves the scores of the metrics
+
+        :param model_output: output of a topic model
+        :return: list of the scores, in the order of the metrics
+        """
+        n_jobs = min(self.n_jobs, len(self.metrics))
+        if n_jobs <= 1:
+            shared_output = ModelOutput(model_output)
+            return [metric.score(shared_output) for metric in self.metrics]
+
+        executor = self._get_executor(n_jobs)
+        if self.backend == 'thread':
+            shared_output = ModelOutput(model_output)
+            return list(executor.map(lambda metric: metric.score(shared_output), self.metrics))
+
+        # each worker scores a group of metrics, so that the model output is
+        # shipped once per worker
+        groups = [list(range(i, len(self.metrics), n_jobs)) for i in range(n_jobs)]
+        scores = [None] * len(self.metrics)
+        for group, group_scores in zip(groups, executor.map(
+                _score_metrics, groups, [dict(model_output)] * n_jobs)):
+            for i, score in zip(group, group_scores):
+                scores[i] = score
+        return scores
+
+    def _get_executor(self, n_jobs):
+        if self._executor is None:
+            if self.backend == 'thread':
+                self._executor = ThreadPoolExecutor(n_jobs)
+            else:
+                self._executor = ProcessPoolExecutor(
+                    n_jobs, initializer=_init_metric_worker, initargs=(self.metrics,))
+        return self._executor
+
+    def close(self):
+        """
+        Shut down the pool of the suite, if any
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
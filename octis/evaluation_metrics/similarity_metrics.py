@@ -4,8 +4,7 @@ import numpy as np
 from itertools import combinations
 from scipy.spatial.distance import cosine
 from octis.evaluation_metrics.metrics import AbstractMetric
-from gensim.models import KeyedVectors
-import gensim.downloader as api
+from octis.evaluation_metrics.embeddings_store import load_word_embeddings
 
 
 class WordEmbeddingsRBOMatch(WordEmbeddingsInvertedRBO):
@@ -70,10 +69,7 @@ class WordEmbeddingsPairwiseSimilarity(AbstractMetric):
         :param binary: If True, indicates whether the data is in binary word2vec format.
         """
         super().__init__()
-        if word2vec_path is None:
-            self.wv = api.load('word2vec-google-news-300')
-        else:
-            self.wv = KeyedVectors.load_word2vec_format( word2vec_path, binary=binary)
+        self.wv = load_word_embeddings(word2vec_path, binary=binary)
 
         self.topk = topk
 
@@ -116,10 +112,7 @@ class WordEmbeddingsCentroidSimilarity(AbstractMetric):
 
         """
         super().__init__()
-        if word2vec_path is None:
-            self.wv = api.load('word2vec-google-news-300')
-        else:
-            self.wv = KeyedVectors.load_word2vec_format(word2vec_path, binary=binary)
+        self.wv = load_word_embeddings(word2vec_path, binary=binary)
         self.topk = topk
 
     def score(self, model_output):
@@ -172,10 +165,7 @@ class WordEmbeddingsWeightedSumSimilarity(AbstractMetric):
 
         """
         super().__init__()
-        if word2vec_path is None:
-            self.wv = api.load('word2vec-google-news-300')
-        else:
-            self.wv = KeyedVectors.load_word2vec_format(word2vec_path, binary=binary)
+        self.wv = load_word_embeddings(word2vec_path, binary=binary)
         self.topk = topk
         self.id2word = id2word
 
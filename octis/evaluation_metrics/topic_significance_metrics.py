@@ -1,37 +1,32 @@
 import numpy as np
 import octis.configuration.citations as citations
+from octis.evaluation_metrics.divergences import kl_divergence_to_reference
+from octis.evaluation_metrics.metric_suite import shared_intermediate
 from octis.evaluation_metrics.metrics import AbstractMetric
 
 
-def _KL(P, Q):
-    """
-    Perform Kullback-Leibler divergence
+def _replace_zeros_lines(arr):
+    arr[~arr.any(axis=1)] = 1.0 / arr.shape[1]
+    return arr
 
-    Parameters
-    ----------
-    P : distribution P
-    Q : distribution Q
 
-    Returns
-    -------
-    divergence : divergence from Q to P
+def _nonzero_lines(model_output, key):
     """
-    # add epsilon to grant absolute continuity
-    epsilon = 0.00001
-    P = P+epsilon
-    Q = Q+epsilon
-
-    divergence = np.sum(P*np.log(P/Q))
-    return divergence
+    Float copy of a matrix of the model output, with uniform values in
+    place of its zero lines
+    """
+    return shared_intermediate(
+        model_output, ('nonzero-lines', key), lambda: _replace_zeros_lines(model_output[key].astype(float)))
 
 
-def _replace_zeros_lines(arr):
-    zero_lines = np.where(~arr.any(axis=1))[0]
-    val = 1.0 / len(arr[0])
-    vett = np.full(len(arr[0]), val)
-    for zero_line in zero_lines:
-        arr[zero_line] = vett.copy()
-    return arr
+def _line_distributions(model_output, key):
+    """
+    Lines of a matrix of the model output, normalized to sum up to 1
+    """
+    def normalize():
+        matrix = _nonzero_lines(model_output, key)
+        return matrix / matrix.sum(axis=1, keepdims=True)
+    return shared_intermediate(model_output, ('line-distributions', key), normalize)
 
 
 class KL_uniform(AbstractMetric):
@@ -63,27 +58,20 @@ class KL_uniform(AbstractMetric):
         result : score
 
         """
-        phi = _replace_zeros_lines(model_output["topic-word-matrix"].astype(float))
+        # normalize phi, sum up to 1
+        P = _line_distributions(model_output, "topic-word-matrix")
 
         # make uniform distribution
-        val = 1.0 / len(phi[0])
-        unif_distr = np.full(len(phi[0]), val)
+        unif_distr = np.full(P.shape[1], 1.0 / P.shape[1])
 
-        divergences = []
-        for topic in range(len(phi)):
-
-            # normalize phi, sum up to 1
-            P = phi[topic] / phi[topic].sum()
-
-            divergence = _KL(P, unif_distr)
-            divergences.append(divergence)
+        divergences = kl_divergence_to_reference(P, unif_distr)
 
         # KL-uniform = mean of the divergences
         # between topic-word distributions and uniform distribution
         if per_topic:
-            return divergences
+            return list(divergences)
         else:
-            result = np.array(divergences).mean()
+            result = divergences.mean()
             return result
 
 
@@ -100,7 +88,7 @@ class KL_vacuous(AbstractMetric):
             "name": "KL_Vacuous, Vacuous semantic distribution"
         }
 
-    def score(self, model_output):
+    def score(self, model_output, per_topic=False):
         """
         Retrieves the score of the metric
 
@@ -110,34 +98,30 @@ class KL_vacuous(AbstractMetric):
                        'topic-word-matrix' required
                        'topic-document-matrix' required
 
+        per_topic: if True, it returns the score for each topic
+
         Returns
         -------
         result : score
         """
-        phi = _replace_zeros_lines(model_output["topic-word-matrix"].astype(float))
-        theta = _replace_zeros_lines(model_output["topic-document-matrix"].astype(float))
-
-        vacuous = np.zeros(phi.shape[1])
-        for topic in range(len(theta)):
+        phi = _nonzero_lines(model_output, "topic-word-matrix")
+        theta = _nonzero_lines(model_output, "topic-document-matrix")
 
-            # get probability of the topic in the corpus
-            p_topic = theta[topic].sum()/len(theta[0])
+        # get probability of the topics in the corpus
+        p_topic = theta.sum(axis=1) / theta.shape[1]
 
-            # get probability of the words:
-            # P(Wi | vacuous_dist) = P(Wi | topic)*P(topic)
-            vacuous += phi[topic]*p_topic
+        # get probability of the words:
+        # P(Wi | vacuous_dist) = sum of P(Wi | topic)*P(topic)
+        vacuous = p_topic.dot(phi)
 
-        divergences = []
-        for topic in range(len(phi)):
-
-            # normalize phi, sum up to 1
-            P = phi[topic] / phi[topic].sum()
-
-            divergence = _KL(P, vacuous)
-            divergences.append(divergence)
+        # normalize phi, sum up to 1
+        P = _line_distributions(model_output, "topic-word-matrix")
+        divergences = kl_divergence_to_reference(P, vacuous)
 
         # KL-vacuous = mean of the divergences between topic-word distributions and vacuous distribution
-        result = np.array(divergences).mean()
+        if per_topic:
+            return list(divergences)
+        result = divergences.mean()
         return result
 
 
@@ -154,7 +138,7 @@ class KL_background(AbstractMetric):
             "name": "KL_Background, Background distribution over documents"
         }
 
-    def score(self, model_output):
+    def score(self, model_output, per_topic=False):
         """
         Retrieves the score of the metric
 
@@ -163,27 +147,25 @@ class KL_background(AbstractMetric):
         model_output : dictionary, output of the model
                        'topic-document-matrix' required
 
+        per_topic: if True, it returns the score for each topic
+
         Returns
         -------
         result : score
         """
-        theta = _replace_zeros_lines(model_output["topic-document-matrix"].astype(float))
+        # normalize theta, sum up to 1
+        P = _line_distributions(model_output, "topic-document-matrix")
 
         # make uniform distribution
-        val = 1.0 / len(theta[0])
-        unif_distr = np.full(len(theta[0]), val)
+        unif_distr = np.full(P.shape[1], 1.0 / P.shape[1])
 
-        divergences = []
-        for topic in range(len(theta)):
-            # normalize theta, sum up to 1
-            P = theta[topic] / theta[topic].sum()
-
-            divergence = _KL(P, unif_distr)
-            divergences.append(divergence)
+        divergences = kl_divergence_to_reference(P, unif_distr)
 
         # KL-background = mean of the divergences
         # between topic-doc distributions and uniform distribution
-        result = np.array(divergences).mean()
+        if per_topic:
+            return list(divergences)
+        result = divergences.mean()
         if np.isnan(result):
             return 0
         return result
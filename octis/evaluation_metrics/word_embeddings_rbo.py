@@ -3,7 +3,10 @@ from __future__ import division
 import math
 from bisect import bisect_left
 from collections import namedtuple
-from collections import OrderedDict
+
+import numpy as np
+
+from octis.evaluation_metrics.rbo import first_occurrences, rbo_ext_from_agreements, topics_to_ids
 
 RBO = namedtuple("RBO", "min res ext")
 RBO.__doc__ += ": Result of full RBO analysis"
@@ -29,41 +32,54 @@ def set_at_depth(lst, depth):
     return ans
 
 
-def embeddings_overlap(list1, list2, depth, index2word, word2vec, norm=True):
-    # set1, set2 = set_at_depth(list1, depth), set_at_depth(list2, depth)
-    # return len(set1.intersection(set2)), len(set1), len(set2)
+def similarity_block(vectors1, vectors2, norm=True):
+    """Similarities between two sets of unit-norm word vectors: the cosine
+    similarity or, if ``norm`` is True, one minus the normalized angle.
+    """
+    cos_sim = np.clip(np.dot(vectors1, vectors2.T), -1, 1)
+    if norm:
+        return 1 - np.arccos(cos_sim.astype(np.float64)) / math.pi
+    return cos_sim.astype(np.float64)
+
+
+def greedy_overlaps(similarities, valid1, valid2):
+    """Embedding overlaps of many pairs of lists at all the depths.
+    ``similarities`` is the ``(n_pairs, k, k)`` block of the similarities
+    between the words of each pair of lists, and ``valid1`` / ``valid2``
+    mask the words that take part in the matching. At each depth ``d`` the
+    most similar words among the first ``d`` of both lists are matched
+    greedily, and the overlap is the sum of the similarities of the
+    matched words.
+    The similarities of each pair are sorted once: a word pair is
+    available from the depth of its later word onwards, so a single sweep
+    over the sorted similarities matches all the depths at once.
+    """
+    n_pairs, k, _ = similarities.shape
+    flat = similarities.reshape(n_pairs, k * k)
+    order = np.argsort(-flat, axis=1, kind='stable')
+    rows, cols = np.divmod(order, k)
+    pairs = np.arange(n_pairs)
+    depths = np.arange(1, k + 1)
+    used1 = np.zeros((n_pairs, k, k), dtype=bool)
+    used2 = np.zeros((n_pairs, k, k), dtype=bool)
+    overlaps = np.zeros((n_pairs, k))
+    for r in range(k * k):
+        i, j = rows[:, r], cols[:, r]
+        match = ((np.maximum(i, j)[:, None] < depths) & (valid1[pairs, i] & valid2[pairs, j])[:, None] &
+                 ~used1[pairs, :, i] & ~used2[pairs, :, j])
+        overlaps += match * flat[pairs, order[:, r]][:, None]
+        used1[pairs, :, i] |= match
+        used2[pairs, :, j] |= match
+    return overlaps
+
 
+def embeddings_overlap(list1, list2, depth, index2word, word2vec, norm=True):
     set1, set2 = set_at_depth(list1, depth), set_at_depth(list2, depth)
-    word_list1 = [index2word[index] for index in list1]
-    word_list2 = [index2word[index] for index in list2]
-
-    similarities = {}
-    for w1 in word_list1[:depth]:
-        for w2 in word_list2[:depth]:
-            cos_sim = word2vec.similarity(w1, w2)
-            if cos_sim > 1:
-                cos_sim = 1
-            elif cos_sim < -1:
-                cos_sim = -1
-
-            if norm:
-                similarities[(w1, w2)] = 1 - (math.acos(cos_sim) / math.pi)
-            else:
-                similarities[(w1, w2)] = cos_sim  # + 1)/2
-            # similarities[(w1,w2)] = (word2vec.similarity(w1, w2) + 1)/2
-
-    similarities = OrderedDict(sorted(similarities.items(), key=lambda x: -x[1]))
-
-    e_ov = 0
-    key_list = list(similarities.keys())
-    for k in key_list:
-        if k in similarities.keys():
-            # print(k, similarities[k])
-            e_ov = e_ov + similarities[k]
-            similarities = {save_k: v for save_k, v in similarities.items()
-                            if save_k[0] != k[0] and save_k[1] != k[1]}
-    # e_ov = 1
-    # print("****")
+    ids, _, words = topics_to_ids([list1[:depth], list2[:depth]], depth)
+    vectors = np.array([word2vec.get_vector(index2word[index], norm=True) for index in words])
+    first = first_occurrences(ids)
+    similarities = similarity_block(vectors[ids[0]], vectors[ids[1]], norm)
+    e_ov = greedy_overlaps(similarities[None], first[:1], first[1:])[0, -1]
     return e_ov, len(set1), len(set2)
 
 
@@ -103,7 +119,7 @@ def rbo_at_k(list1, list2, p, index2word, word2vec, depth=None):
 '''
 
 
-def rbo_min(list1, list2, p, index2word, word2vec, depth=None, norm=True):
+def rbo_min(list1, list2, p, index2word, word2vec, norm=True, depth=None):
     """Tight lower bound on RBO.
     See equation (11) in paper.
     """
@@ -181,6 +197,48 @@ def word_embeddings_rbo(list1, list2, p, index2word, word2vec, norm):
     return RBO(rbo_min(*args), rbo_res(*args), rbo_ext(*args))
 
 
+def unit_word_vectors(words, word2vec):
+    """Matrix of the normalized embeddings of ``words``."""
+    return np.array([word2vec.get_vector(w, norm=True) for w in words])
+
+
+def pairwise_word_embeddings_rbo_ext(topics, p, word2vec, norm=True, topk=None, chunk_size=10000,
+                                     topic_ids=None, vectors=None):
+    """``rbo_ext()`` of every pair of topics, in the order of
+    ``itertools.combinations(topics, 2)``.
+    The similarities between all the words of the topics are computed once,
+    from their normalized embeddings, and the overlaps of all the depths
+    are matched at once, ``chunk_size`` pairs of topics at a time.
+    ``topic_ids`` (the result of ``topics_to_ids(topics, topk)``) and
+    ``vectors`` (the ``unit_word_vectors()`` of its words) can be passed if
+    they are already available.
+    """
+    if not 0 < p <= 1:
+        raise ValueError("The ``p`` parameter must be between 0 and 1.")
+    if topic_ids is None:
+        topic_ids = topics_to_ids(topics, topk)
+    ids, lengths, words = topic_ids
+    first = first_occurrences(ids)
+    set_sizes = np.cumsum(first, axis=1)
+    if vectors is None:
+        vectors = unit_word_vectors(words, word2vec)
+    block = similarity_block(vectors, vectors, norm)
+
+    topics1, topics2 = np.triu_indices(len(topics), 1)
+    overlaps = np.empty((len(topics1), ids.shape[1]))
+    for start in range(0, len(topics1), chunk_size):
+        t1, t2 = topics1[start:start + chunk_size], topics2[start:start + chunk_size]
+        similarities = block[ids[t1][:, :, None], ids[t2][:, None, :]]
+        overlaps[start:start + chunk_size] = greedy_overlaps(similarities, first[t1], first[t2])
+    agreements = 2 * overlaps / (set_sizes[topics1] + set_sizes[topics2])
+
+    # S and L are the shorter and the longer list of each pair
+    s = np.minimum(lengths[topics1], lengths[topics2])
+    l = np.maximum(lengths[topics1], lengths[topics2])
+    pairs = np.arange(len(topics1))
+    return rbo_ext_from_agreements(agreements, overlaps[pairs, s - 1], overlaps[pairs, l - 1], s, l, p)
+
+
 def sort_dict(dct, *, ascending=False):
     """Sort keys in ``dct`` according to their corresponding values.
     Sorts in descending order by default, because the values are
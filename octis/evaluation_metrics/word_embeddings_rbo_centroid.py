@@ -6,6 +6,8 @@ import numpy as np
 from scipy.spatial import distance
 import math
 
+from octis.evaluation_metrics.rbo import first_occurrences, rbo_ext_from_agreements, topics_to_ids
+
 
 RBO = namedtuple("RBO", "min res ext")
 RBO.__doc__ += ": Result of full RBO analysis"
@@ -143,6 +145,65 @@ def word_embeddings_rbo(list1, list2, p, index2word, embedding_space, norm):
     return RBO(rbo_min(*args), rbo_res(*args), rbo_ext(*args))
 
 
+def word_vectors(words, embedding_space):
+    """Matrix of the embeddings of ``words``, followed by a zero vector, and
+    mask of the words in the embedding space (the missing ones have a zero
+    vector).
+    """
+    vectors = np.zeros((len(words) + 1, embedding_space.vector_size))
+    in_vocabulary = np.zeros(len(words) + 1, dtype=bool)
+    for i, w in enumerate(words):
+        if w in embedding_space:
+            vectors[i] = embedding_space[w]
+            in_vocabulary[i] = True
+    return vectors, in_vocabulary
+
+
+def pairwise_word_embeddings_rbo_ext(topics, p, embedding_space, norm=True, topk=None, topic_ids=None,
+                                     vectors=None):
+    """``rbo_ext()`` of every pair of topics, in the order of
+    ``itertools.combinations(topics, 2)``.
+    The centroids of the topics at all the depths are the prefix sums of
+    the embeddings of their words (the words missing from the embedding
+    space are skipped), so each depth costs one product of the centroid
+    matrix with itself.
+    ``topic_ids`` (the result of ``topics_to_ids(topics, topk)``) and
+    ``vectors`` (the ``word_vectors()`` of its words) can be passed if they
+    are already available.
+    """
+    if not 0 < p <= 1:
+        raise ValueError("The ``p`` parameter must be between 0 and 1.")
+    if topic_ids is None:
+        topic_ids = topics_to_ids(topics, topk)
+    ids, lengths, words = topic_ids
+    n_topics, k = ids.shape
+    set_sizes = np.cumsum(first_occurrences(ids), axis=1)
+
+    if vectors is None:
+        vectors = word_vectors(words, embedding_space)
+    vectors, in_vocabulary = vectors
+    if not in_vocabulary[ids[:, 0]].all():
+        raise Exception('The first word of each topic must be in the embedding space')
+    # the padding id -1 selects the last, zero, vector
+    centroids = np.cumsum(vectors[ids], axis=1)
+    centroids /= np.linalg.norm(centroids, axis=2, keepdims=True)
+
+    topics1, topics2 = np.triu_indices(n_topics, 1)
+    e_ov = np.empty((len(topics1), k))
+    for d in range(k):
+        e_ov[:, d] = np.dot(centroids[:, d], centroids[:, d].T)[topics1, topics2]
+    e_ov = np.clip(e_ov, -1, 1)
+    if norm:
+        e_ov = 1 - np.arccos(e_ov) / math.pi
+    agreements = 2 * e_ov / (set_sizes[topics1] + set_sizes[topics2])
+
+    # S and L are the shorter and the longer list of each pair
+    s = np.minimum(lengths[topics1], lengths[topics2])
+    l = np.maximum(lengths[topics1], lengths[topics2])
+    pairs = np.arange(len(topics1))
+    return rbo_ext_from_agreements(agreements, e_ov[pairs, s - 1], e_ov[pairs, l - 1], s, l, p)
+
+
 def sort_dict(dct, *, ascending=False):
     """Sort keys in ``dct`` according to their corresponding values.
     Sorts in descending order by default, because the values are
@@ -103,6 +103,8 @@ class CTM(AbstractModel):
         if self.use_partitions:
             train, validation, test = dataset.get_partitioned_corpus(
                 use_validation=True)
+            train_bow, validation_bow, test_bow = (
+                dataset.get_partitioned_document_term_matrix(use_validation=True))
 
             data_corpus_train = [' '.join(i) for i in train]
             data_corpus_test = [' '.join(i) for i in test]
@@ -111,6 +113,8 @@ class CTM(AbstractModel):
             x_train, x_test, x_valid, input_size = self.preprocess(
                 self.vocab, data_corpus_train, test=data_corpus_test,
                 validation=data_corpus_validation,
+                train_bow=train_bow, test_bow=test_bow,
+                validation_bow=validation_bow,
                 bert_train_path=(
                     self.hyperparameters['bert_path'] + "_train.pkl"),
                 bert_test_path=self.hyperparameters['bert_path'] + "_test.pkl",
@@ -142,6 +146,7 @@ class CTM(AbstractModel):
             data_corpus = [' '.join(i) for i in dataset.get_corpus()]
             x_train, input_size = self.preprocess(
                 self.vocab, train=data_corpus,
+                train_bow=dataset.get_document_term_matrix(),
                 bert_train_path=(
                     self.hyperparameters['bert_path'] + "_train.pkl"),
                 bert_model=self.hyperparameters["bert_model"])
@@ -196,45 +201,44 @@ class CTM(AbstractModel):
     @staticmethod
     def preprocess(
         vocab, train, bert_model, test=None, validation=None,
-            bert_train_path=None, bert_test_path=None, bert_val_path=None):
-        vocab2id = {w: i for i, w in enumerate(vocab)}
-        vec = CountVectorizer(
-            vocabulary=vocab2id, token_pattern=r'(?u)\b[\w+|\-]+\b')
-        entire_dataset = train.copy()
-        if test is not None:
-            entire_dataset.extend(test)
-        if validation is not None:
-            entire_dataset.extend(validation)
-
-        vec.fit(entire_dataset)
-        idx2token = {v: k for (k, v) in vec.vocabulary_.items()}
-
-        x_train = vec.transform(train)
+            bert_train_path=None, bert_test_path=None, bert_val_path=None,
+            train_bow=None, test_bow=None, validation_bow=None):
+        """
+        Builds the datasets of the partitions. The bag-of-words of the
+        documents are taken from the document-term matrices (columns in
+        vocabulary order) if given, otherwise they are computed from the texts
+        """
+        idx2token = {i: w for i, w in enumerate(vocab)}
+        if train_bow is None:
+            vocab2id = {w: i for i, w in enumerate(vocab)}
+            vec = CountVectorizer(
+                vocabulary=vocab2id, token_pattern=r'(?u)\b[\w+|\-]+\b')
+            vec.fit(train)
+            train_bow, test_bow, validation_bow = [
+                None if texts is None else vec.transform(texts)
+                for texts in (train, test, validation)]
+
         b_train = CTM.load_bert_data(bert_train_path, train, bert_model)
 
-        train_data = dataset.CTMDataset(x_train.toarray(), b_train, idx2token)
+        train_data = dataset.CTMDataset(train_bow.toarray(), b_train, idx2token)
         input_size = len(idx2token.keys())
 
         if test is not None and validation is not None:
-            x_test = vec.transform(test)
             b_test = CTM.load_bert_data(bert_test_path, test, bert_model)
-            test_data = dataset.CTMDataset(x_test.toarray(), b_test, idx2token)
+            test_data = dataset.CTMDataset(test_bow.toarray(), b_test, idx2token)
 
-            x_valid = vec.transform(validation)
             b_val = CTM.load_bert_data(bert_val_path, validation, bert_model)
             valid_data = dataset.CTMDataset(
-                x_valid.toarray(), b_val, idx2token)
+                validation_bow.toarray(), b_val, idx2token)
             return train_data, test_data, valid_data, input_size
         if test is None and validation is not None:
-            x_valid = vec.transform(validation)
             b_val = CTM.load_bert_data(bert_val_path, validation, bert_model)
             valid_data = dataset.CTMDataset(
-                x_valid.toarray(), b_val, idx2token)
+                validation_bow.toarray(), b_val, idx2token)
             return train_data, valid_data, input_size
         if test is not None and validation is None:
-            x_test = vec.transform(test)
             b_test = CTM.load_bert_data(bert_test_path, test, bert_model)
-            test_data = dataset.CTMDataset(x_test.toarray(), b_test, idx2token)
+            test_data = dataset.CTMDataset(test_bow.toarray(), b_test, idx2token)
             return train_data, test_data, input_size
         if test is None and validation is None:
             return train_data, input_size
@@ -2,6 +2,7 @@ from __future__ import print_function
 from octis.models.early_stopping.pytorchtools import EarlyStopping
 import torch
 import numpy as np
+from scipy import sparse
 from octis.models.ETM_model import data
 from sklearn.feature_extraction.text import CountVectorizer
 from torch import nn, optim
@@ -71,9 +72,9 @@ class ETM(BaseETM):
         self.hyperparameters['headerless_embeddings'] = headerless_embeddings
         self.early_stopping = None
         self.device = device
-        self.test_tokens, self.test_counts = None, None
-        self.valid_tokens, self.valid_counts = None, None
-        self.train_tokens, self.train_counts, self.vocab = None, None, None
+        # float32 CSR bag of words of the partitions
+        self.train_bow, self.test_bow, self.valid_bow = None, None, None
+        self.vocab = None
         self.use_partitions = use_partitions
         self.model = None
         self.optimizer = None
@@ -107,29 +108,23 @@ class ETM(BaseETM):
     def set_model(self, dataset, hyperparameters):
         if self.use_partitions:
             train_data, validation_data, testing_data = (
-                dataset.get_partitioned_corpus(use_validation=True))
-
-            data_corpus_train = [' '.join(i) for i in train_data]
-            data_corpus_test = [' '.join(i) for i in testing_data]
-            data_corpus_val = [' '.join(i) for i in validation_data]
+                dataset.get_partitioned_document_term_matrix(
+                    use_validation=True))
 
             vocab = dataset.get_vocabulary()
             self.vocab = {i: w for i, w in enumerate(vocab)}
             vocab2id = {w: i for i, w in enumerate(vocab)}
 
-            (self.train_tokens, self.train_counts, self.test_tokens,
-             self.test_counts, self.valid_tokens, self.valid_counts
-             ) = self.preprocess(
-                vocab2id, data_corpus_train, data_corpus_test, data_corpus_val)
+            self.train_bow, self.test_bow, self.valid_bow = self.preprocess(
+                vocab2id, train_data, testing_data, validation_data)
 
         else:
-            data_corpus = [' '.join(i) for i in dataset.get_corpus()]
             vocab = dataset.get_vocabulary()
             self.vocab = {i: w for i, w in enumerate(vocab)}
             vocab2id = {w: i for i, w in enumerate(vocab)}
 
-            self.train_tokens, self.train_counts = self.preprocess(
-                vocab2id, data_corpus, None)
+            self.train_bow = self.preprocess(
+                vocab2id, dataset.get_document_term_matrix())[0]
 
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() else "cpu")
@@ -152,19 +147,16 @@ class ETM(BaseETM):
         self.optimizer = self.set_optimizer()
 
     def _train_epoch(self, epoch):
-        self.data_list = []
         self.model.train()
         acc_loss = 0
         acc_kl_theta_loss = 0
         cnt = 0
-        indices = torch.arange(0, len(self.train_tokens))
+        indices = torch.arange(0, self.train_bow.shape[0])
         indices = torch.split(indices, self.hyperparameters['batch_size'])
         for idx, ind in enumerate(indices):
             self.optimizer.zero_grad()
             self.model.zero_grad()
-            data_batch = data.get_batch(
-                self.train_tokens, self.train_counts, ind,
-                len(self.vocab.keys()), self.device)
+            data_batch = data.get_batch(self.train_bow, ind, self.device)
             sums = data_batch.sum(1).unsqueeze(1)
             if self.hyperparameters['bow_norm']:
                 normalized_data_batch = data_batch / sums
@@ -195,8 +187,6 @@ class ETM(BaseETM):
                         self.optimizer.param_groups[0]['lr'],
                         cur_kl_theta, cur_loss, cur_real_loss))
 
-            self.data_list.append(normalized_data_batch)
-
         cur_loss = round(acc_loss / cnt, 2)
         cur_kl_theta = round(acc_kl_theta_loss / cnt, 2)
         cur_real_loss = round(cur_loss + cur_kl_theta, 2)
@@ -209,7 +199,7 @@ class ETM(BaseETM):
         print('*' * 100)
 
         # VALIDATION ###
-        if self.valid_tokens is None:
+        if self.valid_bow is None:
             return True
         else:
             model = self.model.to(self.device)
@@ -218,15 +208,14 @@ class ETM(BaseETM):
                 val_acc_loss = 0
                 val_acc_kl_theta_loss = 0
                 val_cnt = 0
-                indices = torch.arange(0, len(self.valid_tokens))
+                indices = torch.arange(0, self.valid_bow.shape[0])
                 indices = torch.split(
                     indices, self.hyperparameters['batch_size'])
                 for idx, ind in enumerate(indices):
                     self.optimizer.zero_grad()
                     self.model.zero_grad()
                     val_data_batch = data.get_batch(
-                        self.valid_tokens, self.valid_counts,
-                        ind, len(self.vocab.keys()), self.device)
+                        self.valid_bow, ind, self.device)
                     sums = val_data_batch.sum(1).unsqueeze(1)
                     if self.hyperparameters['bow_norm']:
                         val_normalized_data_batch = val_data_batch / sums
@@ -267,7 +256,6 @@ class ETM(BaseETM):
         self.model.eval()
         info = {}
         with torch.no_grad():
-            theta, _ = self.model.get_theta(torch.cat(self.data_list))
             gammas = self.model.get_beta().cpu().numpy()
             for k in range(self.hyperparameters['num_topics']):
                 if np.isnan(gammas[k]).any():
@@ -281,39 +269,38 @@ class ETM(BaseETM):
                 topic_w.append(topic_words)
 
         info['topic-word-matrix'] = gammas
-        info['topic-document-matrix'] = theta.cpu().detach().numpy().T
+        info['topic-document-matrix'] = self._get_topic_document_matrix(
+            self.train_bow)
         info['topics'] = topic_w
         return info
 
     def inference(self):
         assert isinstance(self.use_partitions, bool) and self.use_partitions
-        topic_d = []
-        self.model.eval()
-        indices = torch.arange(0, len(self.test_tokens))
-        indices = torch.split(indices, self.hyperparameters['batch_size'])
-
-        for idx, ind in enumerate(indices):
-            data_batch = data.get_batch(self.test_tokens, self.test_counts,
-                                        ind, len(self.vocab.keys()),
-                                        self.device)
-            sums = data_batch.sum(1).unsqueeze(1)
-            if self.hyperparameters['bow_norm']:
-                normalized_data_batch = data_batch / sums
-            else:
-                normalized_data_batch = data_batch
-            theta, _ = self.model.get_theta(normalized_data_batch)
-            topic_d.append(theta.cpu().detach().numpy())
-
         info = self.get_info()
-        emp_array = np.empty((0, self.hyperparameters['num_topics']))
-
-        # batch concatenation
-        for i in range(len(topic_d)):
-            emp_array = np.concatenate([emp_array, topic_d[i]])
-        info['test-topic-document-matrix'] = emp_array.T
-
+        info['test-topic-document-matrix'] = self._get_topic_document_matrix(
+            self.test_bow)
         return info
 
+    def _get_topic_document_matrix(self, bow):
+        """
+        Returns the (num_topics, num_documents) float32 matrix of the
+        topic proportions of the documents, computed a batch at a time
+        """
+        self.model.eval()
+        topic_document = np.empty(
+            (self.hyperparameters['num_topics'], bow.shape[0]),
+            dtype=np.float32)
+        indices = torch.arange(0, bow.shape[0])
+        indices = torch.split(indices, self.hyperparameters['batch_size'])
+        with torch.no_grad():
+            for ind in indices:
+                data_batch = data.get_batch(bow, ind, self.device)
+                if self.hyperparameters['bow_norm']:
+                    data_batch = data_batch / data_batch.sum(1).unsqueeze(1)
+                theta, _ = self.model.get_theta(data_batch)
+                topic_document[:, ind[0]:ind[-1] + 1] = theta.cpu().numpy().T
+        return topic_document
+
     def set_default_hyperparameters(self, hyperparameters):
         for k in hyperparameters.keys():
             if k in self.hyperparameters.keys():
@@ -326,49 +313,22 @@ class ETM(BaseETM):
     @staticmethod
     def preprocess(
             vocab2id, train_corpus, test_corpus=None, validation_corpus=None):
-
-        def split_bow(bow_in, n_docs):
-            indices = [
-                [w for w in bow_in[doc, :].indices] for doc in range(n_docs)]
-            counts = [
-                [c for c in bow_in[doc, :].data] for doc in range(n_docs)]
-            return indices, counts
-
-        vec = CountVectorizer(
-            vocabulary=vocab2id, token_pattern=r'(?u)\b\w+\b')
-
-        dataset = train_corpus.copy()
-        if test_corpus is not None:
-            dataset.extend(test_corpus)
-        if validation_corpus is not None:
-            dataset.extend(validation_corpus)
-
-        vec.fit(dataset)
-        idx2token = {v: k for (k, v) in vec.vocabulary_.items()}
-
-        x_train = vec.transform(train_corpus)
-        x_train_tokens, x_train_count = split_bow(x_train, x_train.shape[0])
-
-        if test_corpus is not None:
-            x_test = vec.transform(test_corpus)
-            x_test_tokens, x_test_count = split_bow(x_test, x_test.shape[0])
-
-            if validation_corpus is not None:
-                x_validation = vec.transform(validation_corpus)
-                x_val_tokens, x_val_count = split_bow(
-                    x_validation, x_validation.shape[0])
-
-                return (
-                    x_train_tokens, x_train_count, x_test_tokens,
-                    x_test_count, x_val_tokens, x_val_count)
-            else:
-                return (
-                    x_train_tokens, x_train_count, x_test_tokens, x_test_count)
+        """
+        Returns the bag of words of the given partitions, as float32 CSR
+        matrices, in the order train, test, validation
+        """
+        # the partitions are either document-term matrices, with the columns
+        # in vocabulary order, or lists of documents joined in strings
+        if sparse.issparse(train_corpus):
+            def vectorize(bow_in):
+                return bow_in
         else:
-            if validation_corpus is not None:
-                x_validation = vec.transform(validation_corpus)
-                x_val_tokens, x_val_count = split_bow(
-                    x_validation, x_validation.shape[0])
-                return x_train_tokens, x_train_count, x_val_tokens, x_val_count
-            else:
-                return x_train_tokens, x_train_count
+            vec = CountVectorizer(
+                vocabulary=vocab2id, token_pattern=r'(?u)\b\w+\b')
+            vec.fit(train_corpus)
+            vectorize = vec.transform
+
+        return tuple(
+            sparse.csr_matrix(vectorize(corpus), dtype=np.float32)
+            for corpus in (train_corpus, test_corpus, validation_corpus)
+            if corpus is not None)
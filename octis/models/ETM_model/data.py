@@ -1,15 +1,11 @@
 import numpy as np
 import torch
 
-def get_batch(tokens, counts, ind, vocab_size, device):
-    """fetch input data by batch."""
-    batch_size = len(ind)
-    data_batch = np.zeros((batch_size, vocab_size))
-    for i, doc_id in enumerate(ind):
-        doc = tokens[doc_id]
-        count = counts[doc_id]
-        if doc_id != -1:
-            for j, word in enumerate(doc):
-                data_batch[i, word] = count[j]
+def get_batch(bow, ind, device):
+    """fetch input data by batch.
+
+    bow is the CSR bag of words of the documents and ind the indices of the
+    documents of the batch. The rows are densified at once, as float32."""
+    data_batch = bow[np.asarray(ind)].toarray()
     data_batch = torch.from_numpy(data_batch).float().to(device)
     return data_batch
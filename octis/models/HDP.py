@@ -1,7 +1,7 @@
-from octis.models.model import AbstractModel
+from functools import partial
+from octis.models.model import AbstractModel, get_gensim_corpus, get_gensim_dictionary, get_topic_document_matrix
 import numpy as np
 from gensim.models import hdpmodel
-import gensim.corpora as corpora
 import octis.configuration.citations as citations
 import octis.configuration.defaults as defaults
 
@@ -14,7 +14,7 @@ class HDP(AbstractModel):
     update_with_test = False
 
     def __init__(self, max_chunks=None, max_time=None, chunksize=256, kappa=1.0, tau=64.0, K=15, T=150, alpha=1,
-                 gamma=1, eta=0.01, scale=1.0, var_converge=0.0001):
+                 gamma=1, eta=0.01, scale=1.0, var_converge=0.0001, inference_jobs=1):
         """
         Initialize HDP model
 
@@ -51,6 +51,9 @@ class HDP(AbstractModel):
         var_converge (float, optional) – Lower bound on the right side of
         convergence. Used when updating variational parameters
         for a single document.
+
+        inference_jobs (int, optional) – Number of worker processes that
+        infer the topic distributions of the documents after training.
         """
         super().__init__()
         self.hyperparameters["max_chunks"] = max_chunks
@@ -65,6 +68,7 @@ class HDP(AbstractModel):
         self.hyperparameters["eta"] = eta
         self.hyperparameters["scale"] = scale
         self.hyperparameters["var_converge"] = var_converge
+        self.inference_jobs = inference_jobs
 
     def info(self):
         """
@@ -116,18 +120,16 @@ class HDP(AbstractModel):
                  'topics', 'topic-word-matrix' and
                  'topic-document-matrix'
         """
-        partition = []
         if self.use_partitions:
-            partition = dataset.get_partitioned_corpus()
+            partition = dataset.get_partitioned_document_term_matrix()
         else:
-            partition = [dataset.get_corpus(), []]
+            partition = [dataset.get_document_term_matrix()]
 
         if self.id2word is None:
-            self.id2word = corpora.Dictionary(dataset.get_corpus())
+            self.id2word = get_gensim_dictionary(dataset.get_vocabulary())
 
         if self.id_corpus is None:
-            self.id_corpus = [self.id2word.doc2bow(
-                document) for document in partition[0]]
+            self.id_corpus = get_gensim_corpus(partition[0])
 
         hyperparameters["corpus"] = self.id_corpus
         hyperparameters["id2word"] = self.id2word
@@ -148,8 +150,7 @@ class HDP(AbstractModel):
 
         result["topic-document-matrix"] = self._get_topic_document_matrix()
         if self.use_partitions:
-            new_corpus = [self.id2word.doc2bow(
-                document) for document in partition[1]]
+            new_corpus = get_gensim_corpus(partition[1])
             if self.update_with_test:
                 self.trained_model.update(new_corpus)
                 self.id_corpus.extend(new_corpus)
@@ -168,19 +169,7 @@ class HDP(AbstractModel):
                 result["test-topic-document-matrix"] = self._get_topic_document_matrix()
 
             else:
-                test_document_topic_matrix = []
-                for document in new_corpus:
-
-                    document_topics_tuples = self.trained_model[document]
-                    document_topics = np.zeros(
-                        len(self.trained_model.get_topics()))
-                    for single_tuple in document_topics_tuples:
-                        document_topics[single_tuple[0]] = single_tuple[1]
-
-                    test_document_topic_matrix.append(document_topics)
-
-                result["test-topic-document-matrix"] = np.array(
-                    test_document_topic_matrix).transpose()
+                result["test-topic-document-matrix"] = self._get_topic_document_matrix(new_corpus)
 
         return result
 
@@ -198,21 +187,26 @@ class HDP(AbstractModel):
             ))
         return topic_terms
 
-    def _get_topic_document_matrix(self):
+    def _get_topic_document_matrix(self, corpus=None):
         """
         Return the topic representation of the
-        corpus
+        corpus (default: the training corpus)
         """
-        doc_topic_tuples = []
-        for document in self.id_corpus:
-            doc_topic_tuples.append(self.trained_model[document])
-
-        topic_document = np.zeros((
+        if corpus is None:
+            corpus = self.id_corpus
+        return get_topic_document_matrix(
+            partial(_infer_topics, self.trained_model), corpus,
             len(self.trained_model.get_topics()),
-            len(doc_topic_tuples)))
-
-        for ndoc in range(len(doc_topic_tuples)):
-            document = doc_topic_tuples[ndoc]
-            for topic_tuple in document:
-                topic_document[topic_tuple[0]][ndoc] = topic_tuple[1]
-        return topic_document
+            self.hyperparameters["chunksize"], self.inference_jobs)
+
+
+def _infer_topics(model, chunk, eps=0.01):
+    """
+    Return the topic distributions of a chunk of documents, as
+    HdpModel[document] computes them one document at a time
+    """
+    gamma = model.inference(chunk)
+    norm = gamma.sum(axis=1, keepdims=True)
+    topic_distributions = np.divide(gamma, norm, out=np.zeros_like(gamma), where=norm != 0)
+    topic_distributions[topic_distributions < eps] = 0
+    return topic_distributions
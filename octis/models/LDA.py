@@ -1,7 +1,7 @@
-from octis.models.model import AbstractModel
+from functools import partial
+from octis.models.model import AbstractModel, get_gensim_corpus, get_gensim_dictionary, get_topic_document_matrix
 import numpy as np
 from gensim.models import ldamodel
-import gensim.corpora as corpora
 import octis.configuration.citations as citations
 import octis.configuration.defaults as defaults
 
@@ -17,7 +17,7 @@ class LDA(AbstractModel):
         self, num_topics=100, distributed=False, chunksize=2000,
         passes=1, update_every=1, alpha="symmetric", eta=None, decay=0.5,
         offset=1.0, eval_every=10, iterations=50, gamma_threshold=0.001,
-            random_state=None):
+            random_state=None, inference_jobs=1):
         """
         Initialize LDA model
 
@@ -84,6 +84,8 @@ class LDA(AbstractModel):
         randomState object or a seed to generate one.s
         Useful for reproducibility.
 
+        inference_jobs (int, optional) – Number of worker processes that
+        infer the topic distributions of the documents after training.
 
         """
         super().__init__()
@@ -101,6 +103,7 @@ class LDA(AbstractModel):
         self.hyperparameters["iterations"] = iterations
         self.hyperparameters["gamma_threshold"] = gamma_threshold
         self.hyperparameters["random_state"] = random_state
+        self.inference_jobs = inference_jobs
 
     def info(self):
         """
@@ -166,17 +169,16 @@ class LDA(AbstractModel):
             hyperparams = {}
 
         if self.use_partitions:
-            train_corpus, test_corpus = dataset.get_partitioned_corpus(
+            train_dtm, test_dtm = dataset.get_partitioned_document_term_matrix(
                 use_validation=False)
         else:
-            train_corpus = dataset.get_corpus()
+            train_dtm = dataset.get_document_term_matrix()
 
         if self.id2word is None:
-            self.id2word = corpora.Dictionary(dataset.get_corpus())
+            self.id2word = get_gensim_dictionary(dataset.get_vocabulary())
 
         if self.id_corpus is None:
-            self.id_corpus = [self.id2word.doc2bow(document)
-                              for document in train_corpus]
+            self.id_corpus = get_gensim_corpus(train_dtm)
 
         if "num_topics" not in hyperparams:
             hyperparams["num_topics"] = self.hyperparameters["num_topics"]
@@ -209,8 +211,7 @@ class LDA(AbstractModel):
         result["topic-document-matrix"] = self._get_topic_document_matrix()
 
         if self.use_partitions:
-            new_corpus = [self.id2word.doc2bow(
-                document) for document in test_corpus]
+            new_corpus = get_gensim_corpus(test_dtm)
             if self.update_with_test:
                 self.trained_model.update(new_corpus)
                 self.id_corpus.extend(new_corpus)
@@ -231,17 +232,10 @@ class LDA(AbstractModel):
                     self._get_topic_document_matrix())
 
             else:
-                test_document_topic_matrix = []
-                for document in new_corpus:
-                    document_topics_tuples = self.trained_model[document]
-                    document_topics = np.zeros(
-                        self.hyperparameters["num_topics"])
-                    for single_tuple in document_topics_tuples:
-                        document_topics[single_tuple[0]] = single_tuple[1]
-
-                    test_document_topic_matrix.append(document_topics)
-                result["test-topic-document-matrix"] = np.array(
-                    test_document_topic_matrix).transpose()
+                result["test-topic-document-matrix"] = (
+                    self._get_topic_document_matrix(
+                        new_corpus,
+                        self.trained_model.minimum_probability))
         return result
 
     def _get_topics_words(self, topk):
@@ -256,23 +250,27 @@ class LDA(AbstractModel):
             topic_terms.append(topic_words_list)
         return topic_terms
 
-    def _get_topic_document_matrix(self):
+    def _get_topic_document_matrix(self, corpus=None,
+                                   minimum_probability=0):
         """
         Return the topic representation of the
-        corpus
+        corpus (default: the training corpus)
         """
-        doc_topic_tuples = []
-        for document in self.id_corpus:
-            doc_topic_tuples.append(
-                self.trained_model.get_document_topics(document,
-                                                       minimum_probability=0))
-
-        topic_document = np.zeros((
-            self.hyperparameters["num_topics"],
-            len(doc_topic_tuples)))
-
-        for ndoc in range(len(doc_topic_tuples)):
-            document = doc_topic_tuples[ndoc]
-            for topic_tuple in document:
-                topic_document[topic_tuple[0]][ndoc] = topic_tuple[1]
-        return topic_document
+        if corpus is None:
+            corpus = self.id_corpus
+        return get_topic_document_matrix(
+            partial(_infer_topics, self.trained_model, minimum_probability),
+            corpus, self.hyperparameters["num_topics"],
+            self.hyperparameters["chunksize"], self.inference_jobs)
+
+
+def _infer_topics(model, minimum_probability, chunk):
+    """
+    Return the topic distributions of a chunk of documents, as
+    get_document_topics computes them one document at a time
+    """
+    gamma, _ = model.inference(chunk)
+    topic_distributions = gamma / gamma.sum(axis=1, keepdims=True)
+    topic_distributions[
+        topic_distributions < max(minimum_probability, 1e-8)] = 0
+    return topic_distributions
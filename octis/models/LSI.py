@@ -1,7 +1,8 @@
-from octis.models.model import AbstractModel
+from functools import partial
+from octis.models.model import AbstractModel, get_gensim_corpus, get_gensim_dictionary, get_topic_document_matrix
+from gensim import matutils
 from gensim.models import lsimodel
 import numpy as np
-import gensim.corpora as corpora
 import octis.configuration.defaults as defaults
 
 
@@ -100,18 +101,16 @@ class LSI(AbstractModel):
                  'topics', 'topic-word-matrix' and
                  'topic-document-matrix'
         """
-        partition = []
         if self.use_partitions:
-            partition = dataset.get_partitioned_corpus(use_validation=False)
+            partition = dataset.get_partitioned_document_term_matrix(use_validation=False)
         else:
-            partition = [dataset.get_corpus(), []]
+            partition = [dataset.get_document_term_matrix()]
 
         if self.id2word == None:
-            self.id2word = corpora.Dictionary(dataset.get_corpus())
+            self.id2word = get_gensim_dictionary(dataset.get_vocabulary())
 
         if self.id_corpus == None:
-            self.id_corpus = [self.id2word.doc2bow(
-                document) for document in partition[0]]
+            self.id_corpus = get_gensim_corpus(partition[0])
 
         hyperparameters["corpus"] = self.id_corpus
         hyperparameters["id2word"] = self.id2word
@@ -134,8 +133,7 @@ class LSI(AbstractModel):
         result["topic-document-matrix"] = self._get_topic_document_matrix()
 
         if self.use_partitions:
-            new_corpus = [self.id2word.doc2bow(
-                document) for document in partition[1]]
+            new_corpus = get_gensim_corpus(partition[1])
             if self.update_with_test:
                 self.trained_model.add_documents(new_corpus)
                 self.id_corpus.extend(new_corpus)
@@ -156,19 +154,8 @@ class LSI(AbstractModel):
                     self._get_topic_document_matrix())
 
             else:
-                test_document_topic_matrix = []
-                for document in new_corpus:
-
-                    document_topics_tuples = self.trained_model[document]
-                    document_topics = np.zeros(
-                        self.hyperparameters["num_topics"])
-                    for single_tuple in document_topics_tuples:
-                        document_topics[single_tuple[0]] = single_tuple[1]
-
-                    test_document_topic_matrix.append(document_topics)
-
-                result["test-topic-document-matrix"] = np.array(
-                    test_document_topic_matrix).transpose()
+                result["test-topic-document-matrix"] = (
+                    self._get_topic_document_matrix(new_corpus, normalize=False))
 
         return result
 
@@ -197,31 +184,34 @@ class LSI(AbstractModel):
             topic_terms.append(topic_words_list)
         return topic_terms
 
-    def _get_topic_document_matrix(self):
+    def _get_topic_document_matrix(self, corpus=None, normalize=True):
         """
         Return the topic representation of the
-        corpus
-        """
-        topic_weights = self.trained_model[self.id_corpus]
-
-        topic_document = []
-
-        for document_topic_weights in topic_weights:
-
-            # Find min e max topic_weights values
-            minimum = document_topic_weights[0][1]
-            maximum = document_topic_weights[0][1]
-            for topic in document_topic_weights:
-                if topic[1] > maximum:
-                    maximum = topic[1]
-                if topic[1] < minimum:
-                    minimum = topic[1]
-
-            # For each topic compute normalized weight
-            # in the form (value-min)/(max-min)
-            topic_w = []
-            for topic in document_topic_weights:
-                topic_w.append((topic[1]-minimum)/(maximum-minimum))
-            topic_document.append(topic_w)
-
-        return np.array(topic_document).transpose()
+        corpus (default: the training corpus). If normalize is True, the
+        topic weights of each document are normalized in the form
+        (value-min)/(max-min)
+        """
+        if corpus is None:
+            corpus = self.id_corpus
+        return get_topic_document_matrix(
+            partial(_infer_topics, self.trained_model, normalize), corpus,
+            self.hyperparameters["num_topics"],
+            self.hyperparameters["chunksize"])
+
+
+def _infer_topics(model, normalize, chunk):
+    """
+    Return the topic weights of a chunk of documents, projecting the
+    whole chunk at once
+    """
+    vec = matutils.corpus2csc(chunk, num_terms=model.num_terms, num_docs=len(chunk),
+                              dtype=model.projection.u.dtype)
+    topic_weights = vec.T @ model.projection.u[:, :model.num_topics]
+    if not normalize:
+        # as LsiModel[document], which drops the near-zero weights
+        topic_weights[np.abs(topic_weights) < 1e-9] = 0
+        return topic_weights
+    minimum = topic_weights.min(axis=1, keepdims=True)
+    span = topic_weights.max(axis=1, keepdims=True) - minimum
+    return np.divide(topic_weights - minimum, span,
+                     out=np.zeros_like(topic_weights), where=span != 0)
@@ -1,7 +1,8 @@
-from octis.models.model import AbstractModel
+from functools import partial
+from octis.models.model import AbstractModel, get_gensim_corpus, get_gensim_dictionary, get_topic_document_matrix
 import numpy as np
+from gensim import matutils
 from gensim.models import nmf
-import gensim.corpora as corpora
 import octis.configuration.citations as citations
 import octis.configuration.defaults as defaults
 
@@ -13,7 +14,7 @@ class NMF(AbstractModel):
         minimum_probability=0.01, w_max_iter=200,
         w_stop_condition=0.0001, h_max_iter=50, h_stop_condition=0.001,
         eval_every=10, normalize=True, random_state=None,
-            use_partitions=True):
+            use_partitions=True, inference_jobs=1):
         """
         Initialize NMF model
 
@@ -56,6 +57,9 @@ class NMF(AbstractModel):
 
         random_state ({np.random.RandomState, int}, optional) – Seed for
         random generator. Needed for reproducibility.
+
+        inference_jobs (int, optional) – Number of worker processes that
+        infer the topic distributions of the documents after training.
         """
         super().__init__()
         self.hyperparameters["num_topics"] = num_topics
@@ -71,6 +75,7 @@ class NMF(AbstractModel):
         self.hyperparameters["normalize"] = normalize
         self.hyperparameters["random_state"] = random_state
         self.use_partitions = use_partitions
+        self.inference_jobs = inference_jobs
 
         self.id2word = None
         self.id_corpus = None
@@ -129,15 +134,14 @@ class NMF(AbstractModel):
         if hyperparameters is None:
             hyperparameters = {}
         if self.use_partitions:
-            partition = dataset.get_partitioned_corpus(use_validation=False)
+            partition = dataset.get_partitioned_document_term_matrix(use_validation=False)
         else:
-            partition = [dataset.get_corpus(), []]
+            partition = [dataset.get_document_term_matrix()]
 
         if self.id2word is None:
-            self.id2word = corpora.Dictionary(dataset.get_corpus())
+            self.id2word = get_gensim_dictionary(dataset.get_vocabulary())
         if self.id_corpus is None:
-            self.id_corpus = [self.id2word.doc2bow(
-                document) for document in partition[0]]
+            self.id_corpus = get_gensim_corpus(partition[0])
 
         hyperparameters["corpus"] = self.id_corpus
         hyperparameters["id2word"] = self.id2word
@@ -160,8 +164,7 @@ class NMF(AbstractModel):
         result["topic-document-matrix"] = self._get_topic_document_matrix()
 
         if self.use_partitions:
-            new_corpus = [self.id2word.doc2bow(
-                document) for document in partition[1]]
+            new_corpus = get_gensim_corpus(partition[1])
             if self.update_with_test:
                 self.trained_model.update(new_corpus)
                 self.id_corpus.extend(new_corpus)
@@ -202,24 +205,26 @@ class NMF(AbstractModel):
         Return the topic representation of the
         corpus
         """
-        doc_topic_tuples = []
-
-        if test_corpus is None:
-            for document in self.id_corpus:
-                doc_topic_tuples.append(
-                    self.trained_model.get_document_topics(
-                        document, minimum_probability=0))
-        else:
-            for document in test_corpus:
-                doc_topic_tuples.append(
-                    self.trained_model.get_document_topics(
-                        document, minimum_probability=0))
-        topic_document = np.zeros((
+        corpus = self.id_corpus if test_corpus is None else test_corpus
+        return get_topic_document_matrix(
+            partial(_infer_topics, self.trained_model), corpus,
             self.hyperparameters["num_topics"],
-            len(doc_topic_tuples)))
-
-        for ndoc in range(len(doc_topic_tuples)):
-            document = doc_topic_tuples[ndoc]
-            for topic_tuple in document:
-                topic_document[topic_tuple[0]][ndoc] = topic_tuple[1]
-        return topic_document
+            self.hyperparameters["chunksize"], self.inference_jobs)
+
+
+def _infer_topics(model, chunk):
+    """
+    Return the topic distributions of a chunk of documents, as
+    Nmf.get_document_topics computes them. The projection of each document
+    is solved separately, since the stopping condition of the solver would
+    otherwise be shared by the whole chunk
+    """
+    h = np.empty((len(chunk), model.num_topics))
+    for i, document in enumerate(chunk):
+        v = matutils.corpus2csc([document], model.num_tokens)
+        h[i] = model._solveproj(v, model._W, v_max=np.inf)[:, 0]
+    if model.normalize:
+        norm = h.sum(axis=1, keepdims=True)
+        h = np.divide(h, norm, out=np.zeros_like(h), where=norm != 0)
+    h[h <= 1e-8] = 0
+    return h
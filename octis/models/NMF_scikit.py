@@ -1,7 +1,7 @@
 from octis.models.model import AbstractModel
 import numpy as np
 from sklearn.decomposition import NMF
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfTransformer
 import octis.configuration.defaults as defaults
 
 
@@ -103,27 +103,21 @@ class NMF_scikit(AbstractModel):
             hyperparameters = {}
 
         if self.id2word is None or self.id_corpus is None:
-            vectorizer = TfidfVectorizer(
-                min_df=0.0, token_pattern=r"(?u)\b[\w|\-]+\b",
-                vocabulary=dataset.get_vocabulary())
+            transformer = TfidfTransformer()
 
             if self.use_partitions:
-                partition = dataset.get_partitioned_corpus(
+                partition = dataset.get_partitioned_document_term_matrix(
                     use_validation=False)
-                corpus = partition[0]
+                document_term_matrix = partition[0]
             else:
-                corpus = dataset.get_corpus()
+                document_term_matrix = dataset.get_document_term_matrix()
 
-            real_corpus = [" ".join(document) for document in corpus]
-            X = vectorizer.fit_transform(real_corpus)
+            X = transformer.fit_transform(document_term_matrix)
 
             self.id2word = {i: k for i, k in enumerate(
-                vectorizer.get_feature_names_out())}
+                dataset.get_vocabulary())}
             if self.use_partitions:
-                test_corpus = []
-                for document in partition[1]:
-                    test_corpus.append(" ".join(document))
-                Y = vectorizer.transform(test_corpus)
+                Y = transformer.transform(partition[1])
                 self.id_corpus = X
                 self.new_corpus = Y
             else:
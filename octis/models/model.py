@@ -1,7 +1,14 @@
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 import os
+import queue
+import shutil
+import tempfile
+import threading
 import numpy as np
 import json
+import gensim.corpora as corpora
 
 
 class AbstractModel(ABC):
@@ -43,41 +50,322 @@ class AbstractModel(ABC):
         pass
 
 
-def save_model_output(model_output, path=os.curdir, appr_order=7):
+def get_gensim_dictionary(vocabulary):
     """
-    Saves the model output in the chosen directory
+    Returns a gensim dictionary in which the id of a word is its position in
+    the vocabulary, i.e. its column in the document-term matrix of the dataset
 
-    :param model_output: output of the model
-    :param path: path in which the file will be saved and name of the file
-    :param appr_order: approximation order (used to round model_output values)
+    :param vocabulary: list of words
+    """
+    id2word = corpora.Dictionary()
+    id2word.token2id = {word: i for i, word in enumerate(vocabulary)}
+    return id2word
+
+
+def get_gensim_corpus(document_term_matrix):
+    """
+    Returns the bag-of-words corpus, in gensim format, of a document-term
+    matrix. A new list is returned each time, so that it can be extended
+
+    :param document_term_matrix: sparse CSR matrix (documents x words) of the
+     word counts, with sorted indices
+    """
+    indptr = document_term_matrix.indptr.tolist()
+    indices = document_term_matrix.indices.tolist()
+    data = document_term_matrix.data.tolist()
+    return [list(zip(indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]]))
+            for i in range(len(indptr) - 1)]
+
+
+# inference function of the worker processes of get_topic_document_matrix
+_worker_infer = None
+
+
+def _init_inference_worker(infer):
+    global _worker_infer
+    _worker_infer = infer
+
+
+def _infer_chunk(chunk):
+    return _worker_infer(chunk)
+
+
+def get_topic_document_matrix(infer, corpus, num_topics, chunksize=2000, n_jobs=1):
     """
+    Returns the (topics x documents) float32 matrix of the topic weights of a
+    corpus, inferred a chunk of documents at a time
+
+    :param infer: function that returns the (documents x topics) matrix of a
+     chunk of the corpus. It must be picklable if n_jobs > 1
+    :param corpus: bag-of-words corpus, in gensim format
+    :param num_topics: number of topics
+    :param chunksize: number of documents inferred at a time (default: 2000)
+    :param n_jobs: number of worker processes that infer the chunks (default:
+     1, the chunks are inferred in this process)
+    """
+    topic_document = np.empty((num_topics, len(corpus)), dtype=np.float32)
+    starts = range(0, len(corpus), chunksize)
+    chunks = (corpus[start:start + chunksize] for start in starts)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(
+                n_jobs, initializer=_init_inference_worker,
+                initargs=(infer,)) as executor:
+            for start, weights in zip(starts, executor.map(_infer_chunk, chunks)):
+                topic_document[:, start:start + len(weights)] = weights.T
+    else:
+        for start, chunk in zip(starts, chunks):
+            topic_document[:, start:start + len(chunk)] = infer(chunk).T
+    return topic_document
+
 
+# keys of the topic-document matrices, which can be saved sparsely
+_TOPIC_DOCUMENT_KEYS = ["topic-document-matrix", "test-topic-document-matrix"]
+
+# suffixes of the arrays of a topic-document matrix saved sparsely
+_TOP_INDICES = "-top-indices"
+_TOP_VALUES = "-top-values"
+_SHAPE = "-shape"
+
+
+def _encode_model_output(model_output, appr_order=7, dtype=None, top_n=None):
+    """
+    Returns the arrays of a model output to save, with the matrices encoded
+    as requested by the storage policy of save_model_output
+    """
     to_save = {}
+    for single_output in model_output.keys():
+        if single_output == "topics" or single_output == "test-topics":
+            to_save[single_output] = model_output[single_output]
+            continue
+        matrix = np.asarray(model_output[single_output])
+        if dtype is None:
+            matrix = matrix.round(appr_order)
+        else:
+            matrix = matrix.astype(dtype)
+        if (top_n is not None and single_output in _TOPIC_DOCUMENT_KEYS
+                and top_n < len(matrix)):
+            # the top_n topics of each document (column)
+            indices = np.argpartition(-matrix, top_n - 1, axis=0)[:top_n]
+            to_save[single_output + _TOP_VALUES] = np.take_along_axis(
+                matrix, indices, axis=0)
+            to_save[single_output + _TOP_INDICES] = indices.astype(
+                np.int16 if len(matrix) <= np.iinfo(np.int16).max else np.int32)
+            to_save[single_output + _SHAPE] = np.array(matrix.shape)
+        else:
+            to_save[single_output] = matrix
+    return to_save
+
+
+def _decode_topic_document_matrix(indices, values, shape):
+    """
+    Rebuilds a dense topic-document matrix saved sparsely, with zeros for the
+    topics that were not saved
+    """
+    matrix = np.zeros(tuple(shape), dtype=values.dtype)
+    np.put_along_axis(matrix, np.asarray(indices, dtype=np.intp), values,
+                      axis=0)
+    return matrix
+
+
+def _load_npy(path, mmap_mode=None):
+    """
+    Loads an array of a model output saved with the npy layout
+    """
     try:
-        for single_output in model_output.keys():
-            if single_output != "topics" and single_output != "test-topics":
-                to_save[single_output] = (
-                    model_output[single_output].round(appr_order))
+        return np.load(path, mmap_mode=mmap_mode, allow_pickle=True)
+    except ValueError:
+        # the topics of different lengths are Python objects
+        return np.load(path, allow_pickle=True)
+
+
+class LazyModelOutput(Mapping):
+    """
+    Read-only model output saved by save_model_output, whose arrays are read
+    and decoded only when they are first accessed. The .npz file of the npz
+    layout is kept open, and only the members of the accessed arrays are
+    decompressed.
+    """
+
+    def __init__(self, output_path, mmap_mode=None):
+        """
+        Open a model output
+
+        :param output_path: path in which the model output is saved (the .npz
+         file or the directory of the npy layout)
+        :param mmap_mode: if set (e.g. 'r'), the matrices of a model output
+         saved with the npy layout are memory-mapped with this mode
+        """
+        self._output_path = output_path
+        self._mmap_mode = mmap_mode
+        if os.path.isdir(output_path):
+            self._npz = None
+            self._files = [file_name[:-len(".npy")]
+                           for file_name in sorted(os.listdir(output_path))]
+        else:
+            self._npz = np.load(output_path, allow_pickle=True)
+            self._files = list(self._npz.files)
+        self._keys = [
+            name[:-len(_TOP_INDICES)] if name.endswith(_TOP_INDICES) else name
+            for name in self._files
+            if not name.endswith(_TOP_VALUES) and not name.endswith(_SHAPE)]
+        self._arrays = dict()
+        # the members of an .npz file are read from a single file object
+        self._lock = threading.Lock()
+
+    def _read(self, name):
+        if self._npz is None:
+            return _load_npy(os.path.join(self._output_path, name + ".npy"),
+                             self._mmap_mode)
+        return self._npz[name]
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key not in self._arrays:
+                if key not in self._keys:
+                    raise KeyError(key)
+                if key + _TOP_INDICES in self._files:
+                    self._arrays[key] = _decode_topic_document_matrix(
+                        self._read(key + _TOP_INDICES),
+                        self._read(key + _TOP_VALUES),
+                        self._read(key + _SHAPE))
+                else:
+                    self._arrays[key] = self._read(key)
+            return self._arrays[key]
+
+    def shape(self, key):
+        """
+        Returns the shape of an array, reading only the header of the arrays
+        that have not been accessed yet
+
+        :param key: name of the array
+        """
+        with self._lock:
+            if key in self._arrays:
+                return self._arrays[key].shape
+            if key not in self._keys:
+                raise KeyError(key)
+            if key + _TOP_INDICES in self._files:
+                return tuple(int(size) for size in self._read(key + _SHAPE))
+            if self._npz is None:
+                file = open(os.path.join(self._output_path, key + ".npy"), 'rb')
             else:
-                to_save[single_output] = (model_output[single_output])
-        np.savez_compressed(path, **to_save)
+                file = self._npz.zip.open(key + ".npy")
+            with file:
+                if np.lib.format.read_magic(file) == (1, 0):
+                    return np.lib.format.read_array_header_1_0(file)[0]
+                return np.lib.format.read_array_header_2_0(file)[0]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def close(self):
+        """
+        Closes the .npz file of the model output, if any
+        """
+        if self._npz is not None:
+            self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_model_output(model_output, path=os.curdir, appr_order=7, dtype=None,
+                      top_n=None, layout="npz"):
+    """
+    Saves the model output in the chosen directory
+
+    :param model_output: output of the model
+    :param path: path in which the file will be saved and name of the file
+    :param appr_order: approximation order (used to round model_output values
+     when dtype is None)
+    :param dtype: type of the saved matrices, e.g. 'float32' or 'float16'
+     (default: None, the matrices are rounded to appr_order decimals and
+     saved in their type)
+    :param top_n: if set, only the top_n topics of each document of the
+     topic-document matrices are saved, with their indexes
+    :param layout: 'npz' to save a compressed .npz file (path.npz), 'npy' to
+     save each array in an uncompressed .npy file of the directory path, which
+     load_model_output can memory-map (default: 'npz')
+    """
+    if layout not in ["npz", "npy"]:
+        raise Exception("layout must be 'npz' or 'npy'")
+    try:
+        to_save = _encode_model_output(model_output, appr_order, dtype, top_n)
+        if layout == "npz":
+            np.savez_compressed(path, **to_save)
+        else:
+            # the directory is written aside and moved to path, so that the
+            # readers never see a partial model output
+            tmp_path = tempfile.mkdtemp(
+                dir=os.path.dirname(os.path.abspath(path)))
+            try:
+                for single_output, array in to_save.items():
+                    np.save(os.path.join(
+                        tmp_path, single_output + ".npy"), array)
+                remove_model_output(path)
+                os.rename(tmp_path, path)
+            except:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
     except:
         raise Exception("error in saving the output model file")
 
 
-def load_model_output(output_path, vocabulary_path=None, top_words=10):
+def rename_model_output(old_path, new_path):
+    """
+    Renames a model output saved by save_model_output with the npz or the npy
+    layout
+
+    :param old_path: path with which the model output was saved
+    :param new_path: new path of the model output
+    """
+    if os.path.isdir(old_path):
+        remove_model_output(new_path)
+        os.rename(old_path, new_path)
+    elif os.path.isfile(old_path + ".npz"):
+        os.replace(old_path + ".npz", new_path + ".npz")
+
+
+def remove_model_output(path):
+    """
+    Removes a model output saved by save_model_output with the npz or the npy
+    layout, if any
+
+    :param path: path with which the model output was saved
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path + ".npz"):
+        os.remove(path + ".npz")
+
+
+def load_model_output(output_path, vocabulary_path=None, top_words=10,
+                      mmap_mode=None):
     """
     Loads a model output from the choosen directory
 
     Parameters
     ----------
-    :param output_path: path in which th model output is saved
+    :param output_path: path in which th model output is saved (the .npz file
+     or the directory of the npy layout)
     :param vocabulary_path: path in which the vocabulary is saved (optional,
      used to retrieve the top k words of each topic)
     :param top_words: top k words to retrieve for each topic (in case a
      vocabulary path is given)
+    :param mmap_mode: if set (e.g. 'r'), the matrices of a model output saved
+     with the npy layout are memory-mapped with this mode
     """
-    output = dict(np.load(output_path, allow_pickle=True))
+    with LazyModelOutput(output_path, mmap_mode) as lazy_output:
+        output = dict(lazy_output)
     if vocabulary_path is not None:
         vocabulary_file = open(vocabulary_path, 'r')
         vocabulary = json.load(vocabulary_file)
@@ -103,3 +391,100 @@ def load_model_output(output_path, vocabulary_path=None, top_words=10):
 
         output["topics"] = topics_output
     return output
+
+
+class ModelOutputWriter:
+    """
+    Background thread that saves model outputs, so that the training of the
+    models is not stalled by their compression. The operations are performed
+    in order, and at most queue_size of them wait in the queue: a caller that
+    produces the model outputs faster than they are saved waits for the
+    queue instead of accumulating them in memory.
+    """
+
+    def __init__(self, queue_size=2, **save_kwargs):
+        """
+        Initialize the writer
+
+        :param queue_size: maximum number of operations waiting to be
+         performed (default: 2)
+        :param save_kwargs: keyword arguments of save_model_output (appr_order,
+         dtype, top_n, layout)
+        """
+        self.save_kwargs = save_kwargs
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            operation = self._queue.get()
+            try:
+                if operation is None:
+                    return
+                if self._error is None:
+                    function, args = operation
+                    function(*args)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _put(self, function, *args):
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise Exception("the model output writer is closed")
+        self._queue.put((function, args))
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, model_output, path):
+        """
+        Saves a model output in the background with save_model_output. The
+        arrays of the model output must not be modified afterwards.
+
+        :param model_output: output of the model
+        :param path: path in which the model output will be saved
+        """
+        self._put(lambda: save_model_output(
+            model_output, path, **self.save_kwargs))
+
+    def rename(self, old_path, new_path):
+        """
+        Renames a model output, after the operations already requested
+        """
+        self._put(rename_model_output, old_path, new_path)
+
+    def remove(self, path):
+        """
+        Removes a model output, after the operations already requested
+        """
+        self._put(remove_model_output, path)
+
+    def flush(self):
+        """
+        Waits until all the requested operations are performed, raising the
+        error of the first one that failed, if any. The operations requested
+        after a failure are skipped.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Performs the requested operations and stops the thread
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
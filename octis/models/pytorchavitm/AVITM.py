@@ -1,3 +1,4 @@
+from scipy import sparse
 from sklearn.feature_extraction.text import CountVectorizer
 
 from octis.models.model import AbstractModel
@@ -74,20 +75,14 @@ class AVITM(AbstractModel):
         self.set_params(hyperparameters)
 
         if self.use_partitions:
-            train, validation, test = dataset.get_partitioned_corpus(use_validation=True)
-
-            data_corpus_train = [' '.join(i) for i in train]
-            data_corpus_test = [' '.join(i) for i in test]
-            data_corpus_validation = [' '.join(i) for i in validation]
+            train, validation, test = dataset.get_partitioned_document_term_matrix(use_validation=True)
 
             self.vocab = dataset.get_vocabulary()
             x_train, x_test, x_valid, input_size = \
-                self.preprocess(self.vocab, data_corpus_train, test=data_corpus_test,
-                                validation=data_corpus_validation)
+                self.preprocess(self.vocab, train, test=test, validation=validation)
         else:
             self.vocab = dataset.get_vocabulary()
-            data_corpus = [' '.join(i) for i in dataset.get_corpus()]
-            x_train, input_size = self.preprocess(self.vocab, train=data_corpus)
+            x_train, input_size = self.preprocess(self.vocab, train=dataset.get_document_term_matrix())
 
         self.model = avitm_model.AVITM_model(
             input_size=input_size, num_topics=self.hyperparameters['num_topics'],
@@ -152,33 +147,30 @@ class AVITM(AbstractModel):
 
     @staticmethod
     def preprocess(vocab, train, test=None, validation=None):
-        vocab2id = {w: i for i, w in enumerate(vocab)}
-        vec = CountVectorizer(vocabulary=vocab2id, token_pattern=r'(?u)\b\w+\b')
-        entire_dataset = train.copy()
-        if test is not None:
-            entire_dataset.extend(test)
-        if validation is not None:
-            entire_dataset.extend(validation)
-
-        vec.fit(entire_dataset)
-        idx2token = {v: k for (k, v) in vec.vocabulary_.items()}
-        X_train = vec.transform(train)
-        train_data = datasets.BOWDataset(X_train.toarray(), idx2token)
+        """
+        Builds the datasets of the partitions, given either as document-term
+        matrices (columns in vocabulary order) or as lists of documents joined
+        in strings
+        """
+        idx2token = {i: w for i, w in enumerate(vocab)}
+        if not sparse.issparse(train):
+            vocab2id = {w: i for i, w in enumerate(vocab)}
+            vec = CountVectorizer(vocabulary=vocab2id, token_pattern=r'(?u)\b\w+\b')
+            vec.fit(train)
+            train, test, validation = [None if documents is None else vec.transform(documents)
+                                       for documents in (train, test, validation)]
+        train_data = datasets.BOWDataset(train, idx2token)
         input_size = len(idx2token.keys())
 
         if test is not None and validation is not None:
-            x_test = vec.transform(test)
-            test_data = datasets.BOWDataset(x_test.toarray(), idx2token)
-            x_valid = vec.transform(validation)
-            valid_data = datasets.BOWDataset(x_valid.toarray(), idx2token)
+            test_data = datasets.BOWDataset(test, idx2token)
+            valid_data = datasets.BOWDataset(validation, idx2token)
             return train_data, test_data, valid_data, input_size
         if test is None and validation is not None:
-            x_valid = vec.transform(validation)
-            valid_data = datasets.BOWDataset(x_valid.toarray(), idx2token)
+            valid_data = datasets.BOWDataset(validation, idx2token)
             return train_data, valid_data, input_size
         if test is not None and validation is None:
-            x_test = vec.transform(test)
-            test_data = datasets.BOWDataset(x_test.toarray(), idx2token)
+            test_data = datasets.BOWDataset(test, idx2token)
             return train_data, test_data, input_size
         if test is None and validation is None:
             return train_data, input_size
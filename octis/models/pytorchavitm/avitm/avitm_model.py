@@ -8,9 +8,9 @@ import numpy as np
 import torch
 from torch import optim
 from torch.optim.lr_scheduler import ReduceLROnPlateau
-from torch.utils.data import DataLoader
 
 from octis.models.early_stopping.pytorchtools import EarlyStopping
+from octis.models.pytorchavitm.datasets import batch_loader
 from octis.models.pytorchavitm.avitm.decoder_network import DecoderNetwork
 
 
@@ -238,8 +238,8 @@ class AVITM_model(object):
         self.model_dir = save_dir
         self.train_data = train_dataset
         self.validation_data = validation_dataset
-        train_loader = DataLoader(
-            self.train_data, batch_size=self.batch_size, shuffle=True,
+        train_loader = batch_loader(
+            self.train_data, self.batch_size, shuffle=True,
             num_workers=self.num_data_loader_workers)
 
         # init training variables
@@ -265,8 +265,8 @@ class AVITM_model(object):
             self.final_topic_document = topic_document
             self.best_loss_train = train_loss
             if self.validation_data is not None:
-                validation_loader = DataLoader(
-                    self.validation_data, batch_size=self.batch_size, shuffle=True,
+                validation_loader = batch_loader(
+                    self.validation_data, self.batch_size, shuffle=True,
                     num_workers=self.num_data_loader_workers)
                 # train epoch
                 s = datetime.datetime.now()
@@ -292,8 +292,9 @@ class AVITM_model(object):
         """Predict input."""
         self.model.eval()
 
-        loader = DataLoader(dataset, batch_size=self.batch_size, shuffle=False,
-                            num_workers=self.num_data_loader_workers)
+        loader = batch_loader(
+            dataset, self.batch_size, shuffle=False,
+            num_workers=self.num_data_loader_workers)
 
         topic_document_mat = []
         with torch.no_grad():
@@ -411,8 +412,9 @@ class AVITM_model(object):
         """
         self.model.eval()
 
-        loader = DataLoader(
-            dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.num_data_loader_workers)
+        loader = batch_loader(
+            dataset, self.batch_size, shuffle=False,
+            num_workers=self.num_data_loader_workers)
         final_thetas = []
         for sample_index in range(self.num_samples):
             with torch.no_grad():
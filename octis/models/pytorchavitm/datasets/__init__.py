@@ -1,3 +1,3 @@
 """Init datasets."""
 
-from octis.models.pytorchavitm.datasets.bow import BOWDataset
+from octis.models.pytorchavitm.datasets.bow import BOWDataset, batch_loader
@@ -1,7 +1,9 @@
 """Class for loading BOW dataset."""
 
+import numpy as np
 import torch
-from torch.utils.data import Dataset
+from scipy import sparse
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
 
 
 class BOWDataset(Dataset):
@@ -13,18 +15,46 @@ class BOWDataset(Dataset):
         Initialize NewsGroupDataset.
 
         Args
-            X : array-like, shape=(n_samples, n_features)
-                Document word matrix.
+            X : array-like or sparse matrix, shape=(n_samples, n_features)
+                Document word matrix. A sparse matrix is kept in CSR format
+                and densified one batch at a time.
         """
+        if sparse.issparse(X):
+            X = sparse.csr_matrix(X, dtype=np.float32)
         self.X = X
         self.idx2token = idx2token
 
     def __len__(self):
         """Return length of dataset."""
-        return len(self.X)
+        return self.X.shape[0]
 
     def __getitem__(self, i):
-        """Return sample from dataset at index i."""
-        X = torch.FloatTensor(self.X[i])
+        """
+        Return sample from dataset at index i, or the batch of the samples
+        at the indices i if i is a list.
+        """
+        if sparse.issparse(self.X):
+            X = self.X[i].toarray()
+            if np.isscalar(i):
+                X = X[0]
+            X = torch.from_numpy(X)
+        else:
+            X = torch.FloatTensor(self.X[i])
 
         return {'X': X}
+
+
+def batch_loader(dataset, batch_size, shuffle=False, num_workers=0):
+    """
+    Return a DataLoader that reads the dataset a batch at a time.
+
+    Args
+        dataset : BOWDataset (or any dataset that accepts a list of indices)
+        batch_size : size of the batches
+        shuffle : if True, the samples are shuffled at every epoch
+        num_workers : number of worker processes of the loader
+    """
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset, sampler=BatchSampler(sampler, batch_size, drop_last=False),
+        batch_size=None, num_workers=num_workers)
@@ -1,21 +1,122 @@
 # Utils
 import json
+import os
 import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 import numpy as np
 
 # utils from skopt and sklearn
 from sklearn.gaussian_process.kernels import *
 from skopt.space.space import *
+from skopt.utils import create_result
 
 from octis.dataset.dataset import Dataset
+from octis.evaluation_metrics.metric_suite import MetricSuite
 # utils from other files of the framework
-from octis.models.model import save_model_output
+from octis.models.model import ModelOutputWriter, save_model_output
 from octis.optimization.optimizer_evaluation import OptimizerEvaluation
 from octis.optimization.optimizer_tool import (
-    choose_optimizer, early_condition, load_model, select_metric)
+    choose_optimizer, early_condition, hyperband_brackets, load_model,
+    select_metric)
 from octis.optimization.optimizer_tool import (
     load_search_space, plot_bayesian_optimization, plot_model_runs)
+from octis.optimization.trial_store import (
+    TrialStore, split_results, trial_store_path)
+
+# state of a worker process of the model runs pool
+_worker_state = dict()
+
+
+def _init_model_run_worker(model, dataset, topk, save_format):
+    """
+    Initialize a worker process of the model runs pool, so that the model and
+    the dataset are shipped once per worker and not once per run
+    """
+    _worker_state['model'] = model
+    _worker_state['dataset'] = dataset
+    _worker_state['topk'] = topk
+    _worker_state['save_format'] = save_format
+
+
+def _train(model, dataset, params, topk):
+    """
+    Train a model
+
+    :return: model output and hyper-parameters of the trained model
+    :rtype: tuple
+    """
+    model_output = model.train_model(dataset, params, topk)
+    return model_output, model.hyperparameters
+
+
+def _subsample_dataset(dataset, documents):
+    """
+    Return a dataset with the first fraction of the training documents of a
+    dataset and all its validation and test documents. The partitions of
+    OCTIS datasets are shuffled, and keeping a prefix of the training
+    documents keeps the labels aligned with the classification metrics.
+
+    :param documents: fraction of the training documents, in (0, 1)
+    :type documents: float
+    """
+    corpus = dataset.get_corpus()
+    labels = dataset.get_labels()
+    metadata = dict(dataset.get_metadata())
+    last_training_doc = metadata.get("last-training-doc", 0)
+    if last_training_doc == 0:
+        last_training_doc = len(corpus)
+    n_training = max(1, int(round(documents * last_training_doc)))
+    indexes = list(range(n_training)) + list(
+        range(last_training_doc, len(corpus)))
+    if metadata.get("last-training-doc", 0) != 0:
+        metadata["last-training-doc"] = n_training
+        if metadata.get("last-validation-doc", 0) != 0:
+            metadata["last-validation-doc"] = metadata[
+                "last-validation-doc"] - last_training_doc + n_training
+    return Dataset(
+        corpus=[corpus[i] for i in indexes],
+        vocabulary=dataset.get_vocabulary(),
+        labels=[labels[i] for i in indexes] if labels else labels,
+        metadata=metadata)
+
+
+def _get_dataset(dataset, documents, datasets):
+    """
+    Return the dataset of a model run, subsampled (once) if documents is
+    not None
+
+    :param documents: fraction of the training documents, or None
+    :param datasets: subsampled datasets, keyed by fraction
+    :type datasets: dict
+    """
+    if documents is None:
+        return dataset
+    if documents not in datasets:
+        datasets[documents] = _subsample_dataset(dataset, documents)
+    return datasets[documents]
+
+
+def _model_run(params, documents=None, save_model_path=None):
+    """
+    Perform a model run in a worker process of the model runs pool. The
+    worker saves the model output with the storage policy of the
+    optimization, so that the compression of the outputs is shared by the
+    workers and does not stall the main process.
+
+    :param save_model_path: path where the model output is saved, if None
+        the output is not saved
+    """
+    dataset = _get_dataset(
+        _worker_state['dataset'], documents,
+        _worker_state.setdefault('datasets', dict()))
+    model_output, hyperparameters = _train(
+        _worker_state['model'], dataset, params, _worker_state['topk'])
+    if save_model_path is not None:
+        save_model_output(
+            model_output, save_model_path, **_worker_state['save_format'])
+    return model_output, hyperparameters
 
 
 class Optimizer:
@@ -31,10 +132,13 @@ class Optimizer:
         kernel=1.0 * Matern(
             length_scale=1.0, length_scale_bounds=(1e-1, 10.0), nu=1.5),
         acq_func="LCB", random_state=False, x0=None, y0=None,
-        save_models=True, save_step=1, save_name="result",
+        save_models=True, save_step=None, save_name="result",
         save_path="results/", early_stop=False, early_step=5,
         plot_best_seen=False, plot_model=False, plot_name="B0_plot",
-            log_scale_plot=False, topk=10):
+            log_scale_plot=False, topk=10, n_jobs=1, n_points=1,
+            lie_strategy="cl_min", metrics_n_jobs=1, multi_fidelity=None,
+            budget_parameter=None, min_budget=None, max_budget=None,
+            reduction_factor=3, save_format=None):
         """
         Perform hyper-parameter optimization for a Topic Model
 
@@ -81,8 +185,11 @@ class Optimizer:
         :param save_models: if 'True' save all the topic models generated
             during the optimization process
         :type: bool, optional
-        :param save_step: decide how much to save the results of the
-            optimization
+        :param save_step: number of evaluations after which the results of
+            the optimization are exported to the json file (if None, they are
+            exported at the end of the optimization). Each evaluation is
+            appended to the trial store (<save_name>.trials.jsonl) as soon as
+            it is completed
         :type: int, optional
         :param save_name: name of the file where the results of the
             optimization will be saved
@@ -108,6 +215,47 @@ class Optimizer:
         :type log_scale_plot: bool, optional
         :param topk:
         :type topk: int, optional
+        :param n_jobs: number of processes used to perform the model runs of
+            each evaluation in parallel
+        :type n_jobs: int, optional
+        :param n_points: number of hyper-parameter configurations evaluated
+            at the same time (asynchronous batch optimization)
+        :type n_points: int, optional
+        :param lie_strategy: fake objective value assumed for the
+            configurations in evaluation when n_points > 1. Can be either
+            "cl_min", "cl_mean" or "cl_max" (minimum, mean or maximum of the
+            values observed so far)
+        :type lie_strategy: str, optional
+        :param metrics_n_jobs: number of threads used to score the optimized
+            metric and the extra metrics of each model run concurrently
+        :type metrics_n_jobs: int, optional
+        :param multi_fidelity: if set, evaluate the configurations in brackets
+            of successive halving, starting from a small budget and promoting
+            only the best 1 / reduction_factor of them to larger budgets. Can
+            be either "hyperband" (cycle over the Hyperband brackets) or
+            "successive_halving" (always use the most exploratory bracket).
+            number_of_call is then the number of configurations told to the
+            surrogate model, each one with the value observed at the largest
+            budget it reached
+        :type multi_fidelity: str, optional
+        :param budget_parameter: hyper-parameter of the model that sets the
+            budget of a run (e.g. "num_epochs", "passes" or "max_iters"), or
+            "documents" to train the model on a fraction of the training
+            documents
+        :type budget_parameter: str, optional
+        :param min_budget: budget of the first rung of the brackets
+        :type min_budget: int or float, optional
+        :param max_budget: full budget of a configuration (default 1 if
+            budget_parameter is "documents")
+        :type max_budget: int or float, optional
+        :param reduction_factor: ratio between the budgets (and the number of
+            configurations) of two consecutive rungs
+        :type reduction_factor: int, optional
+        :param save_format: storage policy of the saved model outputs, a
+            dictionary of keyword arguments of save_model_output (e.g.
+            {"dtype": "float32", "top_n": 5, "layout": "npy"}). The model
+            outputs are saved by a background thread
+        :type save_format: dict, optional
         :return: OptimizerEvaluation object
         :rtype: class
         """
@@ -145,12 +293,31 @@ class Optimizer:
         self.plot_name = plot_name
         self.log_scale_plot = log_scale_plot
         self.topk = topk
+        self.n_jobs = n_jobs
+        self.n_points = n_points
+        self.lie_strategy = lie_strategy
+        self.metrics_n_jobs = metrics_n_jobs
+        self.multi_fidelity = multi_fidelity
+        self.budget_parameter = budget_parameter
+        self.min_budget = min_budget
+        if max_budget is None and budget_parameter == "documents":
+            max_budget = 1.0
+        self.max_budget = max_budget
+        self.reduction_factor = reduction_factor
+        self.save_format = save_format
 
         self.hyperparameters = list(sorted(self.search_space.keys()))
         self.dict_model_runs = dict()
         self.number_of_previous_calls = 0
         self.current_call = 0
         self.time_eval = []
+        self.current_bracket = 0
+        self.budgets = []
+        self.rung_model_runs = dict()
+        # configurations and objective values of all the evaluations of a
+        # multi-fidelity optimization, at any budget
+        self._evaluated_x = []
+        self._evaluated_y = []
 
         self.name_optimized_metric = metric.__class__.__name__
         self.dict_model_runs[self.name_optimized_metric] = dict()
@@ -177,6 +344,12 @@ class Optimizer:
             self.model_path_models = self.save_path + "models/"
             Path(self.model_path_models).mkdir(parents=True, exist_ok=True)
 
+        # Start a new trial store
+        self._trial_store = TrialStore(trial_store_path(
+            self.save_path + self.save_name + ".json"))
+        self._trial_store.reset()
+        self._stored_trials = 0
+
         # Choice of the optimizer
         opt = choose_optimizer(self)
 
@@ -185,17 +358,36 @@ class Optimizer:
 
         return results
 
-    def resume_optimization(self, name_path, extra_evaluations=0):
+    def resume_optimization(
+            self, name_path, extra_evaluations=0, n_jobs=1, n_points=1,
+            lie_strategy="cl_min", metrics_n_jobs=1):
         """
-        Restart the optimization from the json file.
+        Restart the optimization from its trial store or, if the optimization
+        has no trial store, from the json file.
 
         :param name_path: path of the json file
         :type name_path: str
         :param extra_evaluations: extra iterations for the BO optimization
         :type extra_evaluations: int
+        :param n_jobs: number of processes used to perform the model runs of
+            each evaluation in parallel
+        :type n_jobs: int
+        :param n_points: number of hyper-parameter configurations evaluated
+            at the same time
+        :type n_points: int
+        :param lie_strategy: fake objective value assumed for the
+            configurations in evaluation ("cl_min", "cl_mean" or "cl_max")
+        :type lie_strategy: str
+        :param metrics_n_jobs: number of threads used to score the metrics of
+            each model run concurrently
+        :type metrics_n_jobs: int
         :return: object with the results of the optimization
         :rtype: object
         """
+        self.n_jobs = n_jobs
+        self.n_points = n_points
+        self.lie_strategy = lie_strategy
+        self.metrics_n_jobs = metrics_n_jobs
 
         # Restore of the parameters
         res, opt = self._restore_parameters(name_path)
@@ -216,59 +408,174 @@ class Optimizer:
 
         return results
 
-    def _objective_function(self, hyperparameter_values):
+    def _objective_function(self, hyperparameter_values, budget=None):
         """
         Evaluate the objective function
 
         :param hyperparameter_values: hyper-parameters of the Topic Model
         :type hyperparameter_values: list
+        :param budget: budget of the model runs in a multi-fidelity
+            optimization
         :return: value of the objective function
         :rtype: float
         """
-        # Retrieve parameters labels
+        params = self._get_params(hyperparameter_values, budget)
+        documents = self._get_documents(budget)
+        save_model_paths = self._get_save_model_paths(str(self.current_call))
+
+        # The runs are performed by the pool (if any) and scored in order as
+        # soon as they are available
+        if self._executor is None:
+            dataset = self._get_dataset(documents)
+            model_runs = (
+                _train(self.model, dataset, params, self.topk)
+                for i in range(self.model_runs))
+        else:
+            # the workers save the model outputs
+            model_runs = self._executor.map(
+                _model_run, [params] * self.model_runs,
+                [documents] * self.model_runs, save_model_paths)
+            save_model_paths = [None] * self.model_runs
+
+        return self._evaluate_model_runs(model_runs, save_model_paths)
+
+    def _get_params(self, hyperparameter_values, budget=None):
+        """
+        Retrieve the hyper-parameters labels
+
+        :param hyperparameter_values: hyper-parameters of the Topic Model
+        :type hyperparameter_values: list
+        :param budget: budget of the model runs in a multi-fidelity
+            optimization
+        :return: hyper-parameters of the Topic Model
+        :rtype: dict
+        """
         params = {}
         for i in range(len(self.hyperparameters)):
             params[self.hyperparameters[i]] = hyperparameter_values[i]
+        if budget is not None and self.budget_parameter != "documents":
+            params[self.budget_parameter] = budget
+        return params
+
+    def _get_documents(self, budget):
+        """
+        Fraction of the training documents of the model runs at a budget
 
-        # Compute the score of the hyper-parameter configuration
-        different_model_runs = []
-        different_model_runs_extra_metrics = [[] for i in range(len(
-            self.extra_metrics))]
+        :param budget: budget of the model runs in a multi-fidelity
+            optimization
+        :return: fraction of the training documents, None if the model runs
+            use the whole dataset
+        :rtype: float
+        """
+        if (budget is None or self.budget_parameter != "documents"
+                or budget >= 1):
+            return None
+        return budget
 
-        for i in range(self.model_runs):
+    def _get_dataset(self, documents):
+        """
+        Dataset of the model runs performed by this process
 
-            # Prepare model
-            model_output = self.model.train_model(
-                self.dataset, params, self.topk)
-            # Score of the model
-            score = self.metric.score(model_output)
-            different_model_runs.append(score)
+        :param documents: fraction of the training documents, or None
+        :return: the dataset, subsampled if documents is not None
+        :rtype: OCTIS dataset
+        """
+        return _get_dataset(self.dataset, documents, self._budget_datasets)
 
-            # Update of the extra metric values
-            for j, extra_metric in enumerate(self.extra_metrics):
-                different_model_runs_extra_metrics[j].append(
-                    extra_metric.score(model_output))
+    def _get_save_model_paths(self, name):
+        """
+        Paths where the outputs of the model runs of an evaluation are saved
 
-            # Save the model for each run
-            if self.save_models:
-                name = str(self.current_call) + "_" + str(i)
-                save_model_path = self.model_path_models + name
-                save_model_output(model_output, save_model_path)
+        :param name: prefix of the names of the model outputs
+        :type name: str
+        :return: one path for each model run (None if models are not saved)
+        :rtype: list
+        """
+        if not self.save_models:
+            return [None] * self.model_runs
+        return [self.model_path_models + name + "_" + str(i)
+                for i in range(self.model_runs)]
 
-        # Update of the dictionaries
-        self.dict_model_runs[self.name_optimized_metric][
-            'iteration_' + str(self.current_call)] = different_model_runs
+    def _evaluate_model_runs(self, model_runs, save_model_paths):
+        """
+        Score the model runs of the current call
+
+        :param model_runs: iterable of (model output, hyper-parameters of the
+            trained model)
+        :type model_runs: iterable
+        :param save_model_paths: paths where the model outputs of the runs
+            performed by this process are saved (None if they are not saved
+            or are saved by the pool workers)
+        :type save_model_paths: list
+        :return: value of the objective function
+        :rtype: float
+        """
+        return self._record_model_runs(
+            self._score_model_runs(model_runs, save_model_paths))
 
-        for j, extra_metric in enumerate(self.extra_metrics):
-            self.dict_model_runs[self.extra_metric_names[j]][
-                'iteration_' + str(self.current_call)] = (
-                    different_model_runs_extra_metrics[j])
+    def _score_model_runs(self, model_runs, save_model_paths):
+        """
+        Score the model runs of a configuration, saving the outputs of the
+        runs performed by this process in the background
+
+        :param model_runs: iterable of (model output, hyper-parameters of the
+            trained model)
+        :type model_runs: iterable
+        :param save_model_paths: paths where the model outputs are saved
+            (None if they are not saved or are saved by the pool workers)
+        :type save_model_paths: list
+        :return: the scores of the optimized metric and of each extra metric,
+            one list of scores per metric
+        :rtype: list
+        """
+        scores = [[] for i in range(len(self.extra_metrics) + 1)]
+        for (model_output, hyperparameters), path in zip(
+                model_runs, save_model_paths):
+            if path is not None:
+                self._model_writer.save(model_output, path)
+            self.model.hyperparameters = hyperparameters
+
+            # Score of the model and extra metric values, computed by the
+            # suite with the intermediate results shared by all the metrics
+            for j, score in enumerate(self._metric_suite.score(model_output)):
+                scores[j].append(score)
+        return scores
+
+    def _objective_value(self, different_model_runs):
+        """
+        Value of the objective function for the scores of the model runs
 
+        :param different_model_runs: scores of the optimized metric
+        :type different_model_runs: list
+        :return: median of the scores, with the sign of a minimization
+        :rtype: float
+        """
         # The output for BO is the median over different_model_runs
         result = np.median(different_model_runs)
 
         if self.optimization_type == 'Maximize':
             result = - result
+        return result
+
+    def _record_model_runs(self, scores):
+        """
+        Record the scores of the model runs of the current call
+
+        :param scores: scores of the optimized metric and of each extra
+            metric, as returned by _score_model_runs
+        :type scores: list
+        :return: value of the objective function
+        :rtype: float
+        """
+        # Update of the dictionaries
+        self.dict_model_runs[self.name_optimized_metric][
+            'iteration_' + str(self.current_call)] = scores[0]
+
+        for j, extra_metric in enumerate(self.extra_metrics):
+            self.dict_model_runs[self.extra_metric_names[j]][
+                'iteration_' + str(self.current_call)] = scores[j + 1]
+
+        result = self._objective_value(scores[0])
 
         # Boxplot for matrix_model_runs
         if self.plot_model:
@@ -293,6 +600,46 @@ class Optimizer:
         """
         Perform the optimization through Bayesian Optimization
 
+        :return: result of the optimization
+        :rtype: class
+        """
+        self._executor = None
+        self._model_writer = None
+        if self.save_models:
+            # up to the outputs of a configuration wait to be saved
+            self._model_writer = ModelOutputWriter(
+                queue_size=self.model_runs, **(self.save_format or dict()))
+        self._stored_header = False
+        self._budget_datasets = dict()
+        self._metric_suite = MetricSuite(
+            [self.metric] + self.extra_metrics, n_jobs=self.metrics_n_jobs)
+        n_workers = max(self.n_jobs, self.n_points)
+        if n_workers > 1:
+            self._executor = ProcessPoolExecutor(
+                max_workers=n_workers, initializer=_init_model_run_worker,
+                initargs=(self.model, self.dataset, self.topk,
+                          self.save_format or dict()))
+        failed = True
+        try:
+            if self.multi_fidelity is not None:
+                results = self._multi_fidelity_steps(opt)
+            elif self.n_points > 1:
+                results = self._batch_optimization_steps(opt)
+            else:
+                results = self._optimization_steps(opt)
+            failed = False
+        finally:
+            self._close_resources(failed)
+
+        # Export the results
+        if results is not None:
+            results.save(self.save_path + self.save_name + ".json")
+        return results
+
+    def _optimization_steps(self, opt):
+        """
+        Perform the iterations of the Bayesian Optimization
+
         :return: result of the optimization
         :rtype: class
         """
@@ -325,38 +672,502 @@ class Optimizer:
             # Update the opt using (next_x,f_val)
             res = opt.tell(next_x, f_val)
 
-            # Update the computational time for next_x (BO+Function evaluation)
-            end_time = time.time()
-            total_time_function = end_time - start_time
-            self.time_eval.append(total_time_function)
-
-            # Plot best seen
-            if self.plot_best_seen:
-                plot_bayesian_optimization(
-                    res.func_vals,
-                    self.save_path + self.plot_name + "_best_seen",
-                    self.log_scale_plot,
-                    conv_max=self.optimization_type == 'Maximize')
-
-            # Create an object related to the BO optimization
-            results = OptimizerEvaluation(self, BO_results=res)
-
-            # Save the object
-            if i % self.save_step == 0:
-                name_json = self.save_path + self.save_name + ".json"
-                results.save(name_json)
-
-            # Early stop condition
-            if i >= len(self.x0) and self.early_stop and early_condition(
-                    res.func_vals, self.early_step, self.n_random_starts):
-                print("Stop because of early stopping condition")
+            results, stop = self._update_results(res, i, start_time)
+            if stop:
                 break
 
-            # Update current_call
-            self.current_call = self.current_call + 1
+        return results
+
+    def _batch_optimization_steps(self, opt):
+        """
+        Perform the iterations of the Bayesian Optimization keeping n_points
+        hyper-parameter configurations in evaluation at the same time. Each
+        new configuration is proposed by a copy of the surrogate model that
+        believes that the configurations still in evaluation have a fake
+        objective value (constant liar), and the result of each configuration
+        is told to the surrogate model as soon as it is available.
+
+        :return: result of the optimization
+        :rtype: class
+        """
+        results = None
+        pending = []
+        # index of the next configuration to submit and of the next result
+        n_submitted = self.number_of_previous_calls
+        i = self.number_of_previous_calls
+        stop = False
+        try:
+            while i < self.number_of_call and not stop:
+                # Submit new configurations until n_points are in evaluation
+                while (len(pending) < self.n_points
+                       and n_submitted < self.number_of_call):
+                    start_time = time.time()
+                    if n_submitted < self.lenx0:
+                        next_x = [self.x0[name][n_submitted]
+                                  for name in self.hyperparameters]
+                        if len(self.y0) > 0:
+                            # the initial points come first, so that this is
+                            # also the index of the next result
+                            self.dict_model_runs[self.name_optimized_metric][
+                                'iteration_' + str(i)] = self.y0[i]
+                            f_val = -self.y0[i] if (
+                                self.optimization_type == 'Maximize') else (
+                                    self.y0[i])
+                            res = opt.tell(next_x, f_val)
+                            results, stop = self._update_results(
+                                res, i, start_time)
+                            n_submitted = n_submitted + 1
+                            i = i + 1
+                            if stop:
+                                break
+                            continue
+                    else:
+                        next_x = self._ask_with_pending(
+                            opt, [evaluation['x'] for evaluation in pending])
+                    print("Submitted call: ", n_submitted)
+                    # the outputs are renamed after the call once completed
+                    pending.append(self._submit_evaluation(
+                        next_x, start_time, save_model_paths=(
+                            self._get_save_model_paths(
+                                "batch_" + str(n_submitted)))))
+                    n_submitted = n_submitted + 1
+
+                if stop or len(pending) == 0:
+                    break
+
+                # Wait until the model runs of at least one configuration are
+                # all completed
+                completed = []
+                while len(completed) == 0:
+                    wait([future for evaluation in pending
+                          for future in evaluation['futures']
+                          if not future.done()], return_when=FIRST_COMPLETED)
+                    completed = [
+                        evaluation for evaluation in pending
+                        if all(f.done() for f in evaluation['futures'])]
+
+                for evaluation in completed:
+                    pending.remove(evaluation)
+                    print("Current call: ", self.current_call)
+                    model_runs = [
+                        future.result() for future in evaluation['futures']]
+                    self._rename_model_outputs(
+                        evaluation['save_model_paths'],
+                        self._get_save_model_paths(str(self.current_call)))
+                    f_val = self._evaluate_model_runs(
+                        model_runs, [None] * self.model_runs)
+
+                    # Update the opt using (next_x,f_val)
+                    res = opt.tell(evaluation['x'], f_val)
+
+                    results, stop = self._update_results(
+                        res, i, evaluation['start_time'])
+                    i = i + 1
+                    if stop:
+                        break
+        finally:
+            # Discard the configurations still in evaluation
+            for evaluation in pending:
+                for future in evaluation['futures']:
+                    future.cancel()
+                wait(evaluation['futures'])
+                self._remove_model_outputs(evaluation['save_model_paths'])
 
         return results
 
+    def _close_resources(self, failed):
+        """
+        Shut down the metric suite, the pool of the model runs and the writer
+        of the model outputs, each one even if the previous ones fail
+
+        :param failed: True if the optimization raised an error, which an
+            error of the writer must not replace: the error of the writer is
+            then only reported as a warning
+        """
+        try:
+            self._metric_suite.close()
+        finally:
+            try:
+                if self._executor is not None:
+                    self._executor.shutdown()
+                    self._executor = None
+            finally:
+                model_writer, self._model_writer = self._model_writer, None
+                if model_writer is not None:
+                    try:
+                        model_writer.close()
+                    except Exception as error:
+                        if not failed:
+                            raise
+                        warnings.warn(
+                            "error in saving the model outputs: "
+                            + repr(error))
+
+    def _multi_fidelity_steps(self, opt):
+        """
+        Perform the iterations of the multi-fidelity Bayesian Optimization.
+        The configurations proposed by the surrogate model are evaluated in
+        brackets of successive halving: all the configurations of a bracket
+        are evaluated at the budget of its first rung, and only the best
+        1 / reduction_factor of them are promoted to the next rung, up to
+        max_budget. Each configuration is recorded, with the value observed
+        at the largest budget it reached, as soon as it is discarded or it
+        completes the bracket, but only the values observed at max_budget are
+        told to the surrogate model, which has no budget dimension. The
+        initial points (x0) are evaluated at max_budget.
+
+        :return: result of the optimization
+        :rtype: class
+        """
+        results = None
+        brackets = hyperband_brackets(
+            self.min_budget, self.max_budget, self.reduction_factor,
+            hyperband=self.multi_fidelity == "hyperband")
+        i = self.number_of_previous_calls
+        # configurations of the current bracket not told to the surrogate
+        untold = []
+        try:
+            while i < min(self.lenx0, self.number_of_call):
+                print("Current call: ", self.current_call)
+                start_time = time.time()
+                next_x = [self.x0[name][i] for name in self.hyperparameters]
+                if len(self.y0) == 0:
+                    f_val = self._objective_function(next_x, self.max_budget)
+                else:
+                    self.dict_model_runs[self.name_optimized_metric][
+                        'iteration_' + str(i)] = self.y0[i]
+                    f_val = -self.y0[i] if (
+                        self.optimization_type == 'Maximize') else self.y0[i]
+                res = self._tell_multi_fidelity(
+                    opt, next_x, f_val, self.max_budget)
+                results, stop = self._update_results(res, i, start_time)
+                i = i + 1
+                if stop:
+                    return results
+
+            while i < self.number_of_call:
+                n_configs, budgets = brackets[
+                    self.current_bracket % len(brackets)]
+                self.current_bracket = self.current_bracket + 1
+                start_time = time.time()
+                next_xs = opt.ask(
+                    n_points=min(n_configs, self.number_of_call - i),
+                    strategy=self.lie_strategy)
+                untold = [{'x': next_x, 'name': "pending_" + str(k),
+                           'start_time': start_time, 'save_model_paths': [],
+                           'rung_model_runs': dict()}
+                          for k, next_x in enumerate(next_xs)]
+
+                # Number of configurations of each rung, skipping the rungs
+                # that would not discard any configuration
+                counts = [len(untold)]
+                for budget in budgets[1:]:
+                    counts.append(max(1, counts[-1] // self.reduction_factor))
+                rungs = [(rung, counts[rung], budget)
+                         for rung, budget in enumerate(budgets)
+                         if rung == len(budgets) - 1
+                         or counts[rung + 1] < counts[rung]]
+
+                promoted = list(untold)
+                for rung, count, budget in rungs:
+                    if count < len(promoted):
+                        # Promote the best configurations to the next rung
+                        promoted.sort(key=lambda configuration: (
+                            configuration['f_val']))
+                        for configuration in promoted[count:]:
+                            results, stop = self._tell_configuration(
+                                opt, configuration, i)
+                            untold.remove(configuration)
+                            i = i + 1
+                            if stop:
+                                return results
+                        promoted = promoted[:count]
+                    self._evaluate_rung(promoted, rung, budget)
+
+                promoted.sort(key=lambda configuration: configuration['f_val'])
+                for configuration in promoted:
+                    results, stop = self._tell_configuration(
+                        opt, configuration, i)
+                    untold.remove(configuration)
+                    i = i + 1
+                    if stop:
+                        return results
+        finally:
+            # Discard the model outputs of the configurations in evaluation
+            for configuration in untold:
+                self._remove_model_outputs(configuration['save_model_paths'])
+
+        return results
+
+    def _evaluate_rung(self, configurations, rung, budget):
+        """
+        Evaluate the configurations of a rung of successive halving, storing
+        in each configuration its scores at the budget
+
+        :param configurations: configurations to evaluate
+        :type configurations: list
+        :param rung: index of the rung in the bracket
+        :type rung: int
+        :param budget: budget of the model runs
+        """
+        evaluations = []
+        try:
+            for configuration in configurations:
+                # the outputs of the previous rung are superseded
+                self._remove_model_outputs(configuration['save_model_paths'])
+                configuration['save_model_paths'] = (
+                    self._get_save_model_paths(
+                        configuration['name'] + "_rung_" + str(rung)))
+                if self._executor is None:
+                    evaluations.append(dict())
+                else:
+                    evaluations.append(self._submit_evaluation(
+                        configuration['x'], configuration['start_time'],
+                        budget, configuration['save_model_paths']))
+
+            for configuration, evaluation in zip(configurations, evaluations):
+                save_model_paths = configuration['save_model_paths']
+                if self._executor is None:
+                    params = self._get_params(configuration['x'], budget)
+                    dataset = self._get_dataset(self._get_documents(budget))
+                    model_runs = (
+                        _train(self.model, dataset, params, self.topk)
+                        for i in range(self.model_runs))
+                else:
+                    # the workers save the model outputs
+                    model_runs = (
+                        future.result() for future in evaluation['futures'])
+                    save_model_paths = [None] * self.model_runs
+                scores = self._score_model_runs(model_runs, save_model_paths)
+                configuration['scores'] = scores
+                configuration['budget'] = budget
+                configuration['f_val'] = self._objective_value(scores[0])
+                configuration['rung_model_runs'][str(budget)] = scores[0]
+        finally:
+            for evaluation in evaluations:
+                for future in evaluation.get('futures', []):
+                    future.cancel()
+                wait(evaluation.get('futures', []))
+
+    def _tell_configuration(self, opt, configuration, i):
+        """
+        Tell a configuration of a multi-fidelity bracket to the surrogate
+        model, recording its scores at the largest budget it reached
+
+        :param opt: optimizer
+        :param configuration: evaluated configuration
+        :type configuration: dict
+        :param i: index of the evaluation
+        :type i: int
+        :return: object with the results of the optimization and True if the
+            optimization has to be stopped
+        :rtype: tuple
+        """
+        print("Current call: ", self.current_call)
+        self._rename_model_outputs(
+            configuration['save_model_paths'],
+            self._get_save_model_paths(str(self.current_call)))
+        configuration['save_model_paths'] = []
+        f_val = self._record_model_runs(configuration['scores'])
+        self.rung_model_runs['iteration_' + str(self.current_call)] = (
+            configuration['rung_model_runs'])
+
+        res = self._tell_multi_fidelity(
+            opt, configuration['x'], f_val, configuration['budget'])
+        return self._update_results(res, i, configuration['start_time'])
+
+    def _tell_multi_fidelity(self, opt, next_x, f_val, budget):
+        """
+        Record an evaluation of a multi-fidelity optimization, telling it to
+        the surrogate model only if it was observed at max_budget
+
+        :param opt: optimizer
+        :param next_x: hyper-parameters of the Topic Model
+        :type next_x: list
+        :param f_val: objective value (to minimize)
+        :type f_val: float
+        :param budget: budget of the evaluation
+        :return: result of the optimization, with all the evaluations and the
+            best one among those at max_budget
+        :rtype: OptimizeResult
+        """
+        self.budgets.append(budget)
+        self._evaluated_x.append(next_x)
+        self._evaluated_y.append(f_val)
+        if budget == self.max_budget:
+            opt.tell(next_x, f_val)
+        return self._multi_fidelity_result(opt)
+
+    def _multi_fidelity_result(self, opt):
+        """
+        Return the result of a multi-fidelity optimization: all the
+        evaluations, and the best one among those at max_budget (or among
+        all of them if none was observed at max_budget yet)
+        """
+        res = create_result(
+            self._evaluated_x, self._evaluated_y, space=opt.space)
+        full_budget = [k for k, budget in enumerate(self.budgets)
+                       if budget == self.max_budget]
+        if len(full_budget) > 0:
+            best = min(full_budget, key=lambda k: self._evaluated_y[k])
+            res.x = self._evaluated_x[best]
+            res.fun = self._evaluated_y[best]
+        return res
+
+    def _ask_with_pending(self, opt, pending_x):
+        """
+        Ask the next point to evaluate, lying to a copy of the optimizer about
+        the points that are still in evaluation
+
+        :param opt: optimizer
+        :param pending_x: points in evaluation
+        :type pending_x: list
+        :return: next point to evaluate
+        :rtype: list
+        """
+        if len(pending_x) == 0:
+            return opt.ask()
+        if len(opt.yi) == 0:
+            y_lie = 0.0
+        elif self.lie_strategy == "cl_min":
+            y_lie = np.min(opt.yi)
+        elif self.lie_strategy == "cl_mean":
+            y_lie = np.mean(opt.yi)
+        else:
+            y_lie = np.max(opt.yi)
+        opt_lie = opt.copy(
+            random_state=opt.rng.randint(0, np.iinfo(np.int32).max))
+        opt_lie.tell(pending_x, [y_lie] * len(pending_x))
+        return opt_lie.ask()
+
+    def _submit_evaluation(self, next_x, start_time, budget=None,
+                           save_model_paths=None):
+        """
+        Submit the model runs of a configuration to the pool, whose workers
+        save the model outputs
+
+        :param next_x: hyper-parameters of the Topic Model
+        :type next_x: list
+        :param start_time: time at which the configuration was proposed
+        :type start_time: float
+        :param budget: budget of the model runs in a multi-fidelity
+            optimization
+        :param save_model_paths: paths where the model outputs are saved
+            (None if they are not saved)
+        :type save_model_paths: list
+        :return: configuration in evaluation
+        :rtype: dict
+        """
+        params = self._get_params(next_x, budget)
+        documents = self._get_documents(budget)
+        if save_model_paths is None:
+            save_model_paths = [None] * self.model_runs
+        futures = [self._executor.submit(
+            _model_run, params, documents, save_model_paths[i])
+            for i in range(self.model_runs)]
+        return {'x': next_x, 'futures': futures, 'start_time': start_time,
+                'save_model_paths': save_model_paths}
+
+    def _rename_model_outputs(self, old_paths, new_paths):
+        """
+        Rename the saved model outputs of a configuration, once they are
+        written
+
+        :param old_paths: current paths of the model outputs
+        :type old_paths: list
+        :param new_paths: new paths of the model outputs
+        :type new_paths: list
+        """
+        for old_path, new_path in zip(old_paths, new_paths):
+            if old_path is not None:
+                self._model_writer.rename(old_path, new_path)
+
+    def _remove_model_outputs(self, paths):
+        """
+        Remove the saved model outputs of a configuration, if any, once they
+        are written
+
+        :param paths: paths of the model outputs
+        :type paths: list
+        """
+        for path in paths:
+            if path is not None:
+                self._model_writer.remove(path)
+
+    def _update_results(self, res, i, start_time):
+        """
+        Update the results after the evaluation of a configuration
+
+        :param res: result of the optimization (scikit-optimize object)
+        :param i: index of the evaluation
+        :type i: int
+        :param start_time: time at which the configuration was proposed
+        :type start_time: float
+        :return: object with the results of the optimization and True if the
+            optimization has to be stopped
+        :rtype: tuple
+        """
+        # Update the computational time for next_x (BO+Function evaluation)
+        end_time = time.time()
+        total_time_function = end_time - start_time
+        self.time_eval.append(total_time_function)
+
+        # the low-budget evaluations of a multi-fidelity optimization are
+        # not comparable with the full-budget ones
+        func_vals = res.func_vals
+        if self.multi_fidelity is not None:
+            func_vals = [f_val for f_val, budget in zip(
+                func_vals, self.budgets) if budget == self.max_budget]
+
+        # Plot best seen
+        if self.plot_best_seen and len(func_vals) > 0:
+            plot_bayesian_optimization(
+                func_vals,
+                self.save_path + self.plot_name + "_best_seen",
+                self.log_scale_plot,
+                conv_max=self.optimization_type == 'Maximize')
+
+        # Create an object related to the BO optimization
+        results = OptimizerEvaluation(self, BO_results=res)
+
+        # Append the evaluation to the trial store
+        self._store_trials(results, i)
+
+        # Export the object
+        if self.save_step is not None and i % self.save_step == 0:
+            name_json = self.save_path + self.save_name + ".json"
+            results.save(name_json)
+
+        # Early stop condition
+        if i >= len(self.x0) and self.early_stop and early_condition(
+                func_vals, self.early_step, self.n_random_starts):
+            print("Stop because of early stopping condition")
+            return results, True
+
+        # Update current_call
+        self.current_call = self.current_call + 1
+
+        return results, False
+
+    def _store_trials(self, results, i):
+        """
+        Append the evaluations up to the i-th one to the trial store, with
+        the settings of the optimization before the first evaluation stored
+        by this run
+
+        :param results: object with the results of the optimization
+        :type results: OptimizerEvaluation
+        :param i: index of the evaluation
+        :type i: int
+        """
+        for call in range(self._stored_trials, i + 1):
+            header, trial = split_results(results.info, call)
+            if not self._stored_header:
+                self._trial_store.append_header(header)
+                self._stored_header = True
+            self._trial_store.append_trial(trial)
+        self._stored_trials = i + 1
+
     def _load_metric(self, optimization_object, dataset):
         """
         Load the metric from the json file, useful for the resume method
@@ -406,9 +1217,15 @@ class Optimizer:
         :rtype: tuple
         """
 
-        # Load the previous results
-        with open(name_path, 'rb') as file:
-            optimization_object = json.load(file)
+        # Load the previous results, copying the results of an optimization
+        # without a trial store to a new store at the first evaluation
+        self._trial_store = TrialStore(trial_store_path(name_path))
+        optimization_object = self._trial_store.load()
+        self._stored_trials = len(optimization_object["f_val"]) if (
+            optimization_object is not None) else 0
+        if optimization_object is None:
+            with open(name_path, 'rb') as file:
+                optimization_object = json.load(file)
 
         self.search_space = load_search_space(
             optimization_object["search_space"])
@@ -441,6 +1258,20 @@ class Optimizer:
             'initial_point_generator']
         self.topk = optimization_object['topk']
         self.time_eval = optimization_object["time_eval"]
+        # the brackets in evaluation when the results were saved are restarted
+        multi_fidelity = optimization_object.get(
+            "multi_fidelity", {"mode": None})
+        self.multi_fidelity = multi_fidelity["mode"]
+        self.budget_parameter = multi_fidelity.get("budget_parameter")
+        self.min_budget = multi_fidelity.get("min_budget")
+        self.max_budget = multi_fidelity.get("max_budget")
+        self.reduction_factor = multi_fidelity.get("reduction_factor", 3)
+        self.current_bracket = multi_fidelity.get("current_bracket", 0)
+        self.budgets = multi_fidelity.get("budgets", [])
+        self.rung_model_runs = multi_fidelity.get("rung_model_runs", dict())
+        self._evaluated_x = []
+        self._evaluated_y = []
+        self.save_format = optimization_object.get("save_format")
         res = None
 
         # Load the dataset
@@ -474,7 +1305,15 @@ class Optimizer:
                 f_val = -optimization_object["f_val"][i]
             else:
                 f_val = optimization_object["f_val"][i]
-            res = opt.tell(next_x, f_val)
+            if self.multi_fidelity is None:
+                res = opt.tell(next_x, f_val)
+            else:
+                self._evaluated_x.append(next_x)
+                self._evaluated_y.append(f_val)
+                if self.budgets[i] == self.max_budget:
+                    opt.tell(next_x, f_val)
+        if self.multi_fidelity is not None and self.number_of_previous_calls > 0:
+            res = self._multi_fidelity_result(opt)
 
             # Create the directory where the results are saved
         Path(self.save_path).mkdir(parents=True, exist_ok=True)
@@ -523,14 +1362,52 @@ class Optimizer:
             print("Error: n_random_starts must be an integer")
             return -1
 
-        if not isinstance(self.save_step, int):
+        if self.save_step is not None and not isinstance(self.save_step, int):
             print("Error: save_step must be an integer")
             return -1
 
-        if not isinstance(self.save_step, int):
+        if self.save_step is not None and not isinstance(self.save_step, int):
             print("Error: save_step must be an integer")
             return -1
 
+        if not isinstance(self.n_jobs, int) or self.n_jobs <= 0:
+            print("Error: n_jobs must be an integer >= 1")
+            return -1
+
+        if not isinstance(self.n_points, int) or self.n_points <= 0:
+            print("Error: n_points must be an integer >= 1")
+            return -1
+
+        if self.lie_strategy not in ['cl_min', 'cl_mean', 'cl_max']:
+            print("Error: lie_strategy must be cl_min, cl_mean or cl_max")
+            return -1
+
+        if self.multi_fidelity is not None:
+            if self.multi_fidelity not in ['hyperband', 'successive_halving']:
+                print("Error: multi_fidelity must be hyperband or "
+                      "successive_halving")
+                return -1
+
+            if (self.budget_parameter is None
+                    or self.budget_parameter in self.search_space):
+                print("Error: budget_parameter must be 'documents' or a "
+                      "hyper-parameter that is not in the search space")
+                return -1
+
+            if (self.min_budget is None or self.max_budget is None
+                    or not 0 < self.min_budget < self.max_budget):
+                print("Error: min_budget must be > 0 and < max_budget")
+                return -1
+
+            if self.budget_parameter == "documents" and self.max_budget > 1:
+                print("Error: the budget of documents must be <= 1")
+                return -1
+
+            if (not isinstance(self.reduction_factor, int)
+                    or self.reduction_factor < 2):
+                print("Error: reduction_factor must be an integer >= 2")
+                return -1
+
         if self.n_random_starts <= 0:
             print("Error: the number of initial_points must be >=1 !!!")
             return -1
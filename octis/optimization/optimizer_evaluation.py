@@ -95,6 +95,18 @@ class OptimizerEvaluation:
         self.info.update({"topk": optimizer.topk})
         self.info.update({"time_eval": optimizer.time_eval})
         self.info.update({"dict_model_runs": optimizer.dict_model_runs})
+        if optimizer.save_format is not None:
+            self.info.update({"save_format": optimizer.save_format})
+        if optimizer.multi_fidelity is not None:
+            self.info.update({"multi_fidelity": {
+                "mode": optimizer.multi_fidelity,
+                "budget_parameter": optimizer.budget_parameter,
+                "min_budget": optimizer.min_budget,
+                "max_budget": optimizer.max_budget,
+                "reduction_factor": optimizer.reduction_factor,
+                "current_bracket": optimizer.current_bracket,
+                "budgets": optimizer.budgets,
+                "rung_model_runs": optimizer.rung_model_runs}})
 
         # Reverse the sign of minimization if the problem is a maximization
         if optimization_type == "Maximize":
@@ -159,6 +171,9 @@ class OptimizerEvaluation:
                 self.metric.__class__.__name__]['iteration_' + str(i)])
             for i in range(n_row)]
 
+        if "multi_fidelity" in self.info:
+            df['budget'] = self.info["multi_fidelity"]["budgets"]
+
         for hyperparameter in list(self.x_iters.keys()):
             df[hyperparameter] = self.x_iters[hyperparameter]
 
@@ -188,6 +188,50 @@ def early_condition(values, n_stop, n_random):
     return False
 
 
+def hyperband_brackets(min_budget, max_budget, reduction_factor=3,
+                       hyperband=True):
+    """
+    Compute the brackets of successive halving of a multi-fidelity
+    optimization. In each bracket, the configurations are evaluated at the
+    budget of the first rung and only the best 1 / reduction_factor of them
+    are promoted to the budget of the next rung, up to max_budget.
+
+    :param min_budget: smallest budget of a configuration
+    :type min_budget: int or float
+    :param max_budget: full budget of a configuration
+    :type max_budget: int or float
+    :param reduction_factor: ratio between the budgets of two consecutive
+        rungs
+    :type reduction_factor: int
+    :param hyperband: if True return the brackets of Hyperband, from the most
+        to the least exploratory, otherwise the single bracket of successive
+        halving
+    :type hyperband: bool
+    :return: list of brackets, each one a tuple (number of configurations,
+        list of the budgets of the rungs). The budgets are integers if both
+        min_budget and max_budget are integers
+    :rtype: list
+    """
+    s_max = int(np.floor(
+        np.log(max_budget / min_budget) / np.log(reduction_factor) + 1e-9))
+    integer = isinstance(min_budget, int) and isinstance(max_budget, int)
+    brackets = []
+    for s in range(s_max, -1, -1):
+        if hyperband:
+            n_configs = int(np.ceil(
+                (s_max + 1) / (s + 1) * reduction_factor ** s))
+        else:
+            n_configs = reduction_factor ** s
+        budgets = [max_budget * float(reduction_factor) ** (i - s)
+                   for i in range(s + 1)]
+        if integer:
+            budgets = [int(round(budget)) for budget in budgets]
+        brackets.append((n_configs, budgets))
+        if not hyperband:
+            break
+    return brackets
+
+
 def plot_model_runs(model_runs, current_call, name_plot):
     """
     Save a boxplot of the data (Works only when optimization_runs is 1).
@@ -0,0 +1,253 @@
+import json
+import os
+import tempfile
+import threading
+
+"""
+Append-only store of the trials of an optimization.
+
+The store is a JSON-lines file next to the JSON export of the results
+(<save_name>.trials.jsonl). Each line is either a header, with the settings
+of the optimization, or a trial, with the results of one evaluation; every
+write appends a single small line, so the I/O of an optimization grows
+linearly with its evaluations. The readers fold the lines into the
+dictionary of the JSON export, parsing only the lines appended since their
+last read, and ignore a last line that is still being written.
+"""
+
+# keys of the results stored in the trials and not in the header
+_TRIAL_KEYS = ["dict_model_runs", "f_val", "x_iters", "time_eval",
+               "current_call"]
+
+# size of the blocks read backwards to find the end of the last whole line
+_TAIL_BLOCK_SIZE = 1 << 16
+
+# headers and trials already read by this process, keyed by store path
+_read_cache = dict()
+_read_cache_lock = threading.Lock()
+
+
+def trial_store_path(name_json):
+    """
+    Return the path of the trial store of a JSON export of the results
+
+    :param name_json: path of the json file
+    :type name_json: str
+    :return: path of the trial store
+    :rtype: str
+    """
+    if name_json.endswith(".json"):
+        name_json = name_json[:-5]
+    return name_json + ".trials.jsonl"
+
+
+def _end_of_last_line(file):
+    """
+    Return the offset after the last newline of a file opened in binary mode
+    (0 if the file has no newline), reading the file backwards in blocks
+    from its end instead of reading the whole file
+    """
+    end = file.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - _TAIL_BLOCK_SIZE)
+        file.seek(start)
+        newline = file.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+def load_optimization_results(name_json):
+    """
+    Load the results of an optimization from its trial store or, if the
+    optimization has no trial store, from the JSON export
+
+    :param name_json: path of the json file
+    :type name_json: str
+    :return: dictionary of the results, as in the JSON export
+    :rtype: dict
+    """
+    store = TrialStore(trial_store_path(name_json))
+    results = store.load()
+    if results is None:
+        with open(name_json, 'rb') as file:
+            results = json.load(file)
+    return results
+
+
+class TrialStore:
+    """
+    Append-only JSON-lines store of the trials of an optimization
+    """
+
+    def __init__(self, path):
+        """
+        Initialize a trial store
+
+        :param path: path of the store
+        :type path: str
+        """
+        self.path = path
+
+    def exists(self):
+        """
+        :return: True if the store has been created
+        :rtype: bool
+        """
+        return os.path.isfile(self.path)
+
+    def reset(self):
+        """
+        Replace the store with an empty one. The file is replaced atomically,
+        so that the readers never mix the lines of two optimizations.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        os.replace(tmp_path, self.path)
+
+    def append_header(self, header):
+        """
+        Append the settings of the optimization. A header overrides the
+        previous ones (e.g. when an optimization is resumed with extra
+        evaluations).
+
+        :param header: results of the optimization, without the results of
+            the trials
+        :type header: dict
+        """
+        # the header is the first line written by an optimization, after the
+        # partial line of an optimization that was interrupted, if any
+        if self.exists():
+            with open(self.path, 'r+b') as file:
+                file.truncate(_end_of_last_line(file))
+        self._append({"header": header})
+
+    def append_trial(self, trial):
+        """
+        Append the results of an evaluation. A trial replaces the trial with
+        the same call and the ones after it.
+
+        :param trial: results of the evaluation
+        :type trial: dict
+        """
+        self._append({"trial": trial})
+
+    def _append(self, record):
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        # a single write on a file opened in append mode, so that the
+        # concurrent readers see either the whole line or a partial last line
+        with open(self.path, 'ab', buffering=0) as file:
+            file.write(line)
+
+    def load(self):
+        """
+        Load the results of the optimization
+
+        :return: dictionary of the results, as in the JSON export, or None if
+            the store does not exist or has no header yet
+        :rtype: dict
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        with _read_cache_lock:
+            cached = _read_cache.get(self.path)
+            if (cached is None or cached['file'] != (stat.st_dev, stat.st_ino)
+                    or cached['offset'] > stat.st_size):
+                cached = {'file': (stat.st_dev, stat.st_ino), 'offset': 0,
+                          'header': None, 'trials': []}
+                _read_cache[self.path] = cached
+            if cached['offset'] < stat.st_size:
+                self._read_lines(cached)
+            if cached['header'] is None:
+                return None
+            return _build_results(cached['header'], cached['trials'])
+
+    def _read_lines(self, cached):
+        with open(self.path, 'rb') as file:
+            file.seek(cached['offset'])
+            data = file.read()
+        # the last line may still be in writing
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "header" in record:
+                cached['header'] = record["header"]
+            else:
+                trial = record["trial"]
+                del cached['trials'][trial["call"]:]
+                cached['trials'].append(trial)
+        cached['offset'] = cached['offset'] + end
+
+
+def split_results(results, call):
+    """
+    Split the results of an optimization into the header and the trial of an
+    evaluation
+
+    :param results: dictionary of the results, as in the JSON export
+    :type results: dict
+    :param call: index of the evaluation
+    :type call: int
+    :return: the header and the trial
+    :rtype: tuple
+    """
+    header = {key: value for key, value in results.items()
+              if key not in _TRIAL_KEYS}
+    trial = {
+        "call": call,
+        "x": {name: values[call]
+              for name, values in results["x_iters"].items()},
+        "f_val": results["f_val"][call],
+        "time": results["time_eval"][call],
+        "model_runs": {
+            name: model_runs['iteration_' + str(call)]
+            for name, model_runs in results["dict_model_runs"].items()
+            if 'iteration_' + str(call) in model_runs},
+        "model_attributes": results["model_attributes"]}
+    if "multi_fidelity" in results:
+        multi_fidelity = dict(results["multi_fidelity"])
+        trial["budget"] = multi_fidelity.pop("budgets")[call]
+        trial["rung_model_runs"] = multi_fidelity.pop(
+            "rung_model_runs").get('iteration_' + str(call))
+        trial["current_bracket"] = multi_fidelity.pop("current_bracket")
+        header["multi_fidelity"] = multi_fidelity
+    return header, trial
+
+
+def _build_results(header, trials):
+    """
+    Fold the header and the trials of a store into the dictionary of the
+    JSON export
+    """
+    results = dict(header)
+    metric_names = [header["metric_name"]] + header["extra_metric_names"]
+    results["dict_model_runs"] = {name: dict() for name in metric_names}
+    results["f_val"] = [trial["f_val"] for trial in trials]
+    results["x_iters"] = {
+        name: [trial["x"][name] for trial in trials]
+        for name in (trials[0]["x"] if trials else [])}
+    results["time_eval"] = [trial["time"] for trial in trials]
+    results["current_call"] = len(trials) - 1
+    for trial in trials:
+        for name, model_runs in trial["model_runs"].items():
+            results["dict_model_runs"][name][
+                'iteration_' + str(trial["call"])] = model_runs
+    if trials:
+        results["model_attributes"] = trials[-1]["model_attributes"]
+    if "multi_fidelity" in header:
+        multi_fidelity = dict(header["multi_fidelity"])
+        multi_fidelity["budgets"] = [trial["budget"] for trial in trials]
+        multi_fidelity["rung_model_runs"] = {
+            'iteration_' + str(trial["call"]): trial["rung_model_runs"]
+            for trial in trials if trial["rung_model_runs"] is not None}
+        multi_fidelity["current_bracket"] = (
+            trials[-1]["current_bracket"] if trials else 0)
+        results["multi_fidelity"] = multi_fidelity
+    return results
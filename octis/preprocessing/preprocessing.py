@@ -1,6 +1,15 @@
+import csv
+import json
+import numbers
+import os
 import string
+import tempfile
+from array import array
+from itertools import islice
+from multiprocessing import Pool
 from typing import List, Union
 
+import numpy as np
 import spacy
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.model_selection import train_test_split
@@ -8,7 +17,7 @@ from tqdm.contrib.concurrent import process_map  # or thread_map
 from tqdm import tqdm
 from pathlib import Path
 from octis.dataset.dataset import Dataset
-from collections import Counter
+from collections import Counter, OrderedDict
 
 """
 Maps the language to its corresponding spacy model
@@ -23,6 +32,18 @@ spacy_model_mapping = {
     'portuguese': 'pt_core_news_sm', 'romanian': 'ro_core_news_sm',
     'russian': 'ru_core_news_sm', 'spanish': 'es_core_news_sm'}
 
+# preprocessing of the worker processes of the streaming preprocessing
+_worker_preprocessing = None
+
+
+def _init_preprocessing_worker(preprocessing):
+    global _worker_preprocessing
+    _worker_preprocessing = preprocessing
+
+
+def _clean_document(doc):
+    return _worker_preprocessing.simple_preprocessing_steps(doc)
+
 
 class Preprocessing:
     def __init__(
@@ -33,7 +54,8 @@ class Preprocessing:
         stopword_list: Union[str, List[str]] = None, min_chars: int = 1,
         min_words_docs: int = 0, language: str = 'english', split: bool = True,
         verbose: bool = False, num_processes: int = None,
-        save_original_indexes=True, remove_stopwords_spacy: bool = True):
+        save_original_indexes=True, remove_stopwords_spacy: bool = True,
+        batch_size: int = 1000, lemma_cache_size: int = 100000):
         """
         init Preprocessing
 
@@ -91,6 +113,13 @@ class Preprocessing:
         :type num_processes: int
         :param save_original_indexes: if true, it keeps track of the original
             indexes of the documents
+        :param batch_size: number of documents that spacy lemmatizes at a
+            time (default: 1000)
+        :type batch_size: int
+        :param lemma_cache_size: maximum number of lemmas, of a word form
+            with a given part of speech, that are kept in memory instead of
+            being computed again (default: 100000)
+        :type lemma_cache_size: int
         """
         self.vocabulary = vocabulary
         self.lowercase = lowercase
@@ -108,7 +137,9 @@ class Preprocessing:
         if self.lemmatize:
             lang = spacy_model_mapping[self.language]
             try:
-                self.spacy_model = spacy.load(lang)
+                # the parser and the named entity recognizer are not needed
+                # for the lemmas and the stopwords
+                self.spacy_model = spacy.load(lang, exclude=['parser', 'ner'])
             except IOError:
                 raise IOError("Can't find model " + lang + ". Check the data directory or download it using the "
                                                            "following command:\npython -m spacy download " + lang)
@@ -137,6 +168,12 @@ class Preprocessing:
                         assert stopword_list == language
 
         self.stopwords = stopwords
+        self._stopword_set = frozenset(stopwords)
+        self.batch_size = batch_size
+        self.lemma_cache_size = lemma_cache_size
+        self._lemma_cache = OrderedDict()
+        self._punctuation_table = str.maketrans(self.punctuation, ' ' * len(self.punctuation))
+        self._numbers_table = str.maketrans("0123456789", ' ' * len("0123456789"))
         self.min_chars = min_chars
         self.min_doc_words = min_words_docs
         self.preprocessing_steps = []
@@ -156,19 +193,17 @@ class Preprocessing:
         :return octis.dataset.dataset.Dataset
         """
         docs = [line.strip() for line in open(documents_path, 'r').readlines()]
-        if self.num_processes is not None:
+        if self.lemmatize:
+            # spacy lemmatizes the documents in batches, with num_processes processes
+            docs = self.preprocess_documents(tqdm(docs), n_process=self.num_processes or 1)
+        elif self.num_processes is not None:
             # with Pool(self.num_processes) as p:
             #    docs = p.map(self.simple_preprocessing_steps, docs)
             chunksize = max(1, len(docs) // (self.num_processes * 20))
-            docs_list = process_map(self.simple_preprocessing_steps, docs, max_workers=self.num_processes, chunksize=chunksize)
+            docs = process_map(self.simple_preprocessing_steps, docs, max_workers=self.num_processes, chunksize=chunksize)
         else:
             docs = list(map(self.simple_preprocessing_steps, tqdm(docs)))
-        if self.lowercase:
-            self.preprocessing_steps.append("lowercase")
-        if self.remove_punctuation:
-            self.preprocessing_steps.append('remove_punctuation')
-        if self.lemmatize:
-            self.preprocessing_steps.append('lemmatize')
+        self._append_cleaning_steps()
 
         vocabulary = self.filter_words(docs)
         print("created vocab")
@@ -258,15 +293,215 @@ class Preprocessing:
 
                 return Dataset(final_docs, vocabulary=vocabulary, metadata=metadata, labels=final_labels)
 
+    def preprocess_dataset_streaming(self, documents_path, output_path, labels_path=None, multilabel=False,
+                                     chunk_size=10000):
+        """
+        preprocess the input dataset and save it in a folder, without holding the corpus in memory. The documents
+        are read and cleaned in chunks, and the document frequencies of the words are computed incrementally. The
+        cleaned documents are then read again from a temporary file to filter them and write the dataset.
+        The documents of each partition are saved in their original order
+
+        :param documents_path: path to the documents file. Each row of the file represents a document
+        :type documents_path: str
+        :param output_path: path of the folder in which the dataset is saved. It can be loaded with
+        octis.dataset.dataset.Dataset.load_custom_dataset_from_folder
+        :type output_path: str
+        :param labels_path: path to the documents file. Each row of the file represents a label. Its index corresponds
+        to the index of the documents file (default: None)
+        :type labels_path: str
+        :param multilabel: if true, a document is supposed to have more than one label (labels are split by whitespace)
+        :type multilabel: bool
+        :param chunk_size: number of documents read and cleaned at a time (default: 10000)
+        :type chunk_size: int
+        """
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        file_descriptor, cleaned_path = tempfile.mkstemp(dir=output_path, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as cleaned_file:
+                num_docs, vocabulary = self._clean_and_count(documents_path, cleaned_file, chunk_size)
+            if self.verbose:
+                print("created vocab")
+                print(len(vocabulary))
+
+            kept_indexes, label_ids, label_counts = self._select_documents(
+                cleaned_path, labels_path, multilabel, vocabulary)
+            if labels_path is not None:
+                rare_labels = np.array([count <= 3 for count in label_counts], dtype=bool)
+                final_indexes = kept_indexes[~rare_labels[label_ids]]
+            else:
+                final_indexes = kept_indexes
+            self.preprocessing_steps.append('filter documents with less than ' + str(self.min_doc_words) + " words")
+            if self.verbose:
+                print("words filtering done")
+
+            # 0: train, 1: validation, 2: test
+            partitions = np.zeros(len(final_indexes), dtype=np.int8)
+            if self.split:
+                train, test = train_test_split(np.arange(len(final_indexes)), test_size=0.15, random_state=1)
+                train, validation = train_test_split(train, test_size=3 / 17, random_state=1)
+                partitions[validation] = 1
+                partitions[test] = 2
+            self._write_documents(cleaned_path, labels_path, multilabel, vocabulary, final_indexes, partitions,
+                                  os.path.join(output_path, "corpus.tsv"))
+        finally:
+            os.remove(cleaned_path)
+
+        with open(os.path.join(output_path, "vocabulary.txt"), 'w', encoding='utf8') as vocabulary_file:
+            for word in vocabulary:
+                vocabulary_file.write(word + "\n")
+        if self.save_original_indexes:
+            # the documents are loaded grouped by partition
+            with open(os.path.join(output_path, "indexes.txt"), 'w') as indexes_file:
+                for i in final_indexes[np.argsort(partitions, kind='stable')]:
+                    indexes_file.write(str(i) + "\n")
+        metadata = {"total_documents": num_docs, "vocabulary_length": len(vocabulary),
+                    "preprocessing-info": self.preprocessing_steps}
+        if self.split:
+            metadata["last-training-doc"] = int(np.sum(partitions == 0))
+            metadata["last-validation-doc"] = int(np.sum(partitions <= 1))
+        with open(os.path.join(output_path, "metadata.json"), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+
+    def _clean_and_count(self, documents_path, cleaned_file, chunk_size):
+        """
+        First pass of the streaming preprocessing: cleans the documents in chunks, writes them in a file and
+        computes the vocabulary from the document frequencies of the words
+
+        :return the number of documents and the vocabulary
+        """
+        self._append_cleaning_steps()
+        analyzer = self._get_vectorizer().build_analyzer()
+        document_frequency, term_frequency, num_docs = Counter(), Counter(), 0
+        for docs in self._clean_chunks(documents_path, chunk_size):
+            for doc in docs:
+                tokens = analyzer(doc)
+                document_frequency.update(set(tokens))
+                if self.max_features is not None:
+                    term_frequency.update(tokens)
+                cleaned_file.write(doc + "\n")
+            num_docs += len(docs)
+        return num_docs, self._select_vocabulary(document_frequency, term_frequency, num_docs)
+
+    def _clean_chunks(self, documents_path, chunk_size):
+        """
+        Yields the cleaned documents, a chunk at a time. If num_processes is set, the chunks are cleaned by a pool of
+        processes, or lemmatized by num_processes spacy processes
+        """
+        pool = None
+        if self.num_processes is not None and not self.lemmatize:
+            pool = Pool(self.num_processes, initializer=_init_preprocessing_worker, initargs=(self,))
+        try:
+            with open(documents_path, 'r') as documents_file:
+                while True:
+                    docs = [line.strip() for line in islice(documents_file, chunk_size)]
+                    if len(docs) == 0:
+                        break
+                    if self.lemmatize:
+                        yield self.preprocess_documents(docs, n_process=self.num_processes or 1)
+                    elif pool is not None:
+                        yield pool.map(_clean_document, docs,
+                                       chunksize=max(1, len(docs) // (self.num_processes * 4)))
+                    else:
+                        yield list(map(self.simple_preprocessing_steps, docs))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def _select_vocabulary(self, document_frequency, term_frequency, num_docs):
+        """
+        Selects the vocabulary as the vectorizer of filter_words does, from the document frequencies of the words and,
+        if max_features is set, from their frequencies in the corpus
+        """
+        if self.vocabulary is not None:
+            return list(self.vocabulary)
+        words = sorted(document_frequency)
+        if self.max_features is not None:
+            # the most frequent words, ties are broken in alphabetical order
+            return sorted(sorted(words, key=lambda w: -term_frequency[w])[:self.max_features])
+        max_count = self.max_df if isinstance(self.max_df, numbers.Integral) else self.max_df * num_docs
+        min_count = self.min_df if isinstance(self.min_df, numbers.Integral) else self.min_df * num_docs
+        return [w for w in words if min_count <= document_frequency[w] <= max_count]
+
+    def _select_documents(self, cleaned_path, labels_path, multilabel, vocabulary):
+        """
+        Second pass of the streaming preprocessing: finds the documents that are long enough once filtered
+
+        :return the indexes of the kept documents, the ids of their labels and the number of kept documents of each
+        label id
+        """
+        vocab = set(vocabulary)
+        kept_indexes, label_ids, label2id, label_counts = array('q'), array('q'), dict(), []
+        with open(cleaned_path, 'r') as cleaned_file:
+            for i, (doc, label) in enumerate(zip(cleaned_file, self._read_labels(labels_path, multilabel))):
+                if len([w for w in doc.split() if w in vocab]) > self.min_doc_words:
+                    kept_indexes.append(i)
+                    if label is not None:
+                        if multilabel:
+                            label = tuple(label)
+                        if label not in label2id:
+                            label2id[label] = len(label_counts)
+                            label_counts.append(0)
+                        label_ids.append(label2id[label])
+                        label_counts[label2id[label]] += 1
+        return np.array(kept_indexes, dtype=np.int64), np.array(label_ids, dtype=np.int64), label_counts
+
+    def _write_documents(self, cleaned_path, labels_path, multilabel, vocabulary, final_indexes, partitions,
+                         corpus_path):
+        """
+        Last pass of the streaming preprocessing: filters the words of the selected documents and writes them, with
+        their partition and label, in the format of octis.dataset.dataset.Dataset.save
+        """
+        vocab = set(vocabulary)
+        partition_names = ['train', 'val', 'test']
+        with open(cleaned_path, 'r') as cleaned_file, open(corpus_path, 'w', newline='') as corpus_file:
+            writer = csv.writer(corpus_file, delimiter='\t', lineterminator='\n')
+            j = 0
+            for i, (doc, label) in enumerate(zip(cleaned_file, self._read_labels(labels_path, multilabel))):
+                if j == len(final_indexes):
+                    break
+                if i != final_indexes[j]:
+                    continue
+                row = [' '.join([w for w in doc.split() if w in vocab]), partition_names[partitions[j]]]
+                if label is not None:
+                    row.append(' '.join(label) if multilabel else label)
+                writer.writerow(row)
+                j += 1
+
+    @staticmethod
+    def _read_labels(labels_path, multilabel=False):
+        """
+        Yields the labels of the documents, or None for each document if there are no labels
+        """
+        if labels_path is None:
+            while True:
+                yield None
+        with open(labels_path, 'r') as labels_file:
+            for line in labels_file:
+                yield line.strip().split() if multilabel else line.strip()
+
+    def _append_cleaning_steps(self):
+        if self.lowercase:
+            self.preprocessing_steps.append("lowercase")
+        if self.remove_punctuation:
+            self.preprocessing_steps.append('remove_punctuation')
+        if self.lemmatize:
+            self.preprocessing_steps.append('lemmatize')
+
     def filter_words(self, docs):
+        vectorizer = self._get_vectorizer()
+        vectorizer.fit_transform(docs)
+        vocabulary = vectorizer.get_feature_names_out()
+        return vocabulary
+
+    def _get_vectorizer(self):
         if self.vocabulary is not None:
             self.preprocessing_steps.append('filter words by vocabulary')
             self.preprocessing_steps.append('filter words with document frequency lower than ' + str(self.min_df) +
                                             ' and higher than ' + str(self.max_df))
             self.preprocessing_steps.append('filter words with less than ' + str(self.min_chars) + " character")
-            vectorizer = TfidfVectorizer(df_max_freq=self.max_df, df_min_freq=self.min_df, vocabulary=self.vocabulary,
+            vectorizer = TfidfVectorizer(max_df=self.max_df, min_df=self.min_df, vocabulary=self.vocabulary,
                                          token_pattern=r"(?u)\b\w{" + str(self.min_chars) + ",}\b",
-                                         lowercase=self.lowercase, stop_words=self.stopwords)
+                                         lowercase=self.lowercase, stop_words=list(self.stopwords))
 
         elif self.max_features is not None:
             self.preprocessing_steps.append('filter vocabulary to ' + str(self.max_features) + ' terms')
@@ -275,7 +510,7 @@ class Preprocessing:
             self.preprocessing_steps.append('filter words with less than ' + str(self.min_chars) + " character")
             # we ignore df_max_freq e df_min_freq because self.max_features is not None
             vectorizer = TfidfVectorizer(lowercase=self.lowercase, max_features=self.max_features,
-                                         stop_words=self.stopwords,
+                                         stop_words=list(self.stopwords),
                                          token_pattern=r"(?u)\b[\w|\-]{" + str(self.min_chars) + r",}\b")
 
         else:
@@ -287,11 +522,9 @@ class Preprocessing:
             self.preprocessing_steps.append('filter words with less than ' + str(self.min_chars) + " character")
             vectorizer = TfidfVectorizer(max_df=self.max_df, min_df=self.min_df, lowercase=self.lowercase,
                                          token_pattern=r"(?u)\b[\w|\-]{" + str(self.min_chars) + r",}\b",
-                                         stop_words=self.stopwords)
+                                         stop_words=list(self.stopwords))
 
-        vectorizer.fit_transform(docs)
-        vocabulary = vectorizer.get_feature_names_out()
-        return vocabulary
+        return vectorizer
 
     '''
     def _foo(self, docs, vocabulary, labels_path):
@@ -313,23 +546,75 @@ class Preprocessing:
     '''
 
     def simple_preprocessing_steps(self, doc):
-        new_d = doc
-        new_d = new_d.replace('\n', '')
+        return self.preprocess_documents([doc])[0]
+
+    def preprocess_documents(self, docs, n_process=1):
+        """
+        preprocess a list of documents. The documents are lemmatized in batches of batch_size documents
+
+        :param docs: documents to preprocess
+        :type docs: iterable of str
+        :param n_process: number of processes that lemmatize the documents (default: 1)
+        :type n_process: int
+
+        :return list of the preprocessed documents
+        """
+        docs = [self._normalize(doc) for doc in docs]
+        if self.lemmatize:
+            lemmatizer_name, lemmatizer = self._get_lemmatizer()
+            # the lemmas of the rule and lookup lemmatizers are computed from the cache
+            disable = [] if lemmatizer is None else [lemmatizer_name]
+            docs = [self._lemmatized_text(spacy_doc, lemmatizer) for spacy_doc in self.spacy_model.pipe(
+                docs, batch_size=self.batch_size, n_process=n_process, disable=disable)]
+        return [self._remove_characters(doc) for doc in docs]
+
+    def _normalize(self, doc):
+        new_d = doc.replace('\n', '')
         new_d = new_d.replace('\t', '')
         if self.lowercase:
             new_d = new_d.lower()
-        if self.lemmatize:
-            if self.remove_stopwords_spacy:
-                new_d = ' '.join([token.lemma_ for token in self.spacy_model(new_d) if not token.is_stop])
-            elif self.stopwords:
-                new_d = ' '.join(
-                    [token.lemma_ for token in self.spacy_model(new_d) if token.lemma_ not in set(self.stopwords)])
-            else:
-                new_d = ' '.join([token.lemma_ for token in self.spacy_model(new_d)])
+        return new_d
 
+    def _remove_characters(self, doc):
+        new_d = doc
         if self.remove_punctuation:
-            new_d = new_d.translate(str.maketrans(self.punctuation, ' ' * len(self.punctuation)))
+            new_d = new_d.translate(self._punctuation_table)
         if self.remove_numbers:
-            new_d = new_d.translate(str.maketrans("0123456789", ' ' * len("0123456789")))
-        new_d = " ".join(new_d.split())
-        return new_d
+            new_d = new_d.translate(self._numbers_table)
+        return " ".join(new_d.split())
+
+    def _get_lemmatizer(self):
+        """
+        Returns the name and the component of the lemmatizer of the spacy pipeline, or (None, None) if the lemmas are
+        set by other components
+        """
+        for name, component in self.spacy_model.pipeline:
+            if isinstance(component, spacy.pipeline.Lemmatizer):
+                return name, component
+        return None, None
+
+    def _lemmatized_text(self, spacy_doc, lemmatizer):
+        if self.remove_stopwords_spacy:
+            return ' '.join([self._get_lemma(token, lemmatizer) for token in spacy_doc if not token.is_stop])
+        lemmas = [self._get_lemma(token, lemmatizer) for token in spacy_doc]
+        if self.stopwords:
+            lemmas = [lemma for lemma in lemmas if lemma not in self._stopword_set]
+        return ' '.join(lemmas)
+
+    def _get_lemma(self, token, lemmatizer):
+        """
+        Returns the lemma of a token, from the cache of the lemmas of the word forms with a given part of speech and
+        morphology
+        """
+        if lemmatizer is None or (token.lemma != 0 and not lemmatizer.overwrite):
+            return token.lemma_
+        key = (token.orth, token.pos, token.morph.key)
+        lemma = self._lemma_cache.get(key)
+        if lemma is None:
+            lemma = lemmatizer.lemmatize(token)[0]
+            self._lemma_cache[key] = lemma
+            if len(self._lemma_cache) > self.lemma_cache_size:
+                self._lemma_cache.popitem(last=False)
+        else:
+            self._lemma_cache.move_to_end(key)
+        return lemma
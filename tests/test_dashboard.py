@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""Tests for the dashboard of `octis` package."""
+
+import json
+import os
+import signal
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from octis.models.model import load_model_output, save_model_output
+from octis.optimization.trial_store import TrialStore, trial_store_path
+
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "octis", "dashboard"))
+
+import experimentManager as expManager
+import server
+from queueManager import QueueManager
+
+
+def _stub_experiment(parameters):
+    def _exit_slowly(signum, frame):
+        # a killed experiment takes some time to exit
+        time.sleep(0.5)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, _exit_slowly)
+    time.sleep(parameters["t"])
+
+
+def _wait_until(condition, timeout=10):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise AssertionError("condition not met in " + str(timeout) + "s")
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def queue_manager(tmpdir, monkeypatch):
+    monkeypatch.setattr(
+        QueueManager, "_execute_and_update", staticmethod(_stub_experiment))
+    managers = []
+
+    def make(**kwargs):
+        manager = QueueManager(str(tmpdir) + "/state.json", **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.stop()
+
+
+def test_queue_manager_slots(queue_manager, tmpdir):
+    manager = queue_manager(slots=2, cpus=4)
+    # hold the queue while the experiments are added
+    manager.pause()
+    manager.add_experiment("b", "a", {"path": str(tmpdir), "t": 1.5, "resources": {"cpus": 2}})
+    manager.add_experiment("b", "c", {"path": str(tmpdir), "t": 0.2, "resources": {"cpus": 3}})
+    manager.add_experiment("b", "d", {"path": str(tmpdir), "t": 0.3})
+    manager.editOrder(["bd", "ba", "bc"])
+    assert manager.getOrder() == ["bd", "ba", "bc"]
+    assert manager.getRunningExperiments() == []
+
+    manager.start()
+    _wait_until(lambda: manager.getRunningExperiments() == ["bd", "ba"])
+    # a slot is free when d ends, but c does not fit in the cpus left by a
+    _wait_until(lambda: "bd" in manager.completed)
+    assert manager.getRunningExperiments() == ["ba"]
+    assert manager.getOrder() == ["bc"]
+    _wait_until(lambda: manager.getRunningExperiments() == ["bc"])
+    _wait_until(lambda: len(manager.completed) == 3)
+    assert manager.getRunning() is None
+
+
+def test_queue_manager_backfill(queue_manager, tmpdir):
+    manager = queue_manager(slots=3, cpus=4)
+    manager.pause()
+    manager.add_experiment("b", "a", {"path": str(tmpdir), "t": 1, "resources": {"cpus": 3}})
+    manager.add_experiment("b", "c", {"path": str(tmpdir), "t": 0.2, "resources": {"cpus": 2}})
+    manager.add_experiment("b", "d", {"path": str(tmpdir), "t": 2, "resources": {"cpus": 1}})
+
+    # d starts while c waits for the cpus left by a
+    manager.start()
+    _wait_until(lambda: manager.getRunningExperiments() == ["ba", "bd"])
+    assert manager.getOrder() == ["bc"]
+    _wait_until(lambda: "ba" in manager.completed)
+    _wait_until(lambda: manager.getRunningExperiments() == ["bd", "bc"])
+    _wait_until(lambda: len(manager.completed) == 3)
+
+
+def test_queue_manager_pause_resume(queue_manager, tmpdir):
+    manager = queue_manager()
+    manager.add_experiment("b", "e", {"path": str(tmpdir), "t": 2})
+    _wait_until(lambda: manager.getRunning() == "be")
+    pid = manager.process["be"]
+
+    assert manager.pause() == "be"
+    assert manager.getOrder() == ["be"]
+    assert manager.getRunning() is None
+    manager.start()
+    # the experiment starts again once the killed process has exited
+    _wait_until(lambda: manager.getRunning() == "be")
+    assert manager.process["be"] != pid
+    time.sleep(1)
+    assert manager.getRunning() == "be"
+    assert "be" not in manager.completed
+    _wait_until(lambda: "be" in manager.completed
+                and "be" not in manager.getToRun())
+
+
+def _append_trial(store, call, f_val):
+    store.append_trial({
+        "call": call, "f_val": f_val, "x": {"num_topics": 5 + call},
+        "time": 1.0, "model_runs": {"coherence": [f_val]},
+        "model_attributes": {}})
+
+
+def test_cached_single_info(tmpdir, monkeypatch):
+    path = str(tmpdir.join("exp.json"))
+    store = TrialStore(trial_store_path(path))
+    store.append_header({
+        "metric_name": "coherence", "extra_metric_names": [],
+        "optimization_type": "Maximize", "model_runs": 1,
+        "number_of_call": 5, "model_name": "LDA"})
+    _append_trial(store, 0, 0.2)
+    _append_trial(store, 1, 0.5)
+
+    reads = []
+    load_optimization_results = expManager.load_optimization_results
+
+    def counting_load(name_json):
+        reads.append(name_json)
+        return load_optimization_results(name_json)
+
+    monkeypatch.setattr(
+        expManager, "load_optimization_results", counting_load)
+    index = dict()
+    summary = expManager.cachedSingleInfo(path, index)
+    assert summary["best_seen"] == 0.5 and summary["current_iteration"] == 1
+    assert index[path]["signature"] == expManager.resultSignature(path)
+    # the summary of the unchanged results is not computed again
+    assert expManager.cachedSingleInfo(path, index) == summary
+    assert len(reads) == 1
+
+    _append_trial(store, 2, 0.7)
+    summary = expManager.cachedSingleInfo(path, index)
+    assert len(reads) == 2
+    assert summary["best_seen"] == 0.7 and summary["current_iteration"] == 2
+    assert summary == expManager.singleInfo(path)
+
+    os.remove(trial_store_path(path))
+    assert expManager.resultSignature(path) is None
+    assert expManager.cachedSingleInfo(path, index) is None
+    assert path not in index
+
+
+def _save_model_output(experiment_path, name, layout, seed=0, top_n=None):
+    """
+    Save a random model output of 3 topics, 12 words and 6 (4 test)
+    documents in the models folder of an experiment
+    """
+    rng = np.random.RandomState(seed)
+    models_path = os.path.join(experiment_path, "models")
+    os.makedirs(models_path, exist_ok=True)
+    with open(os.path.join(models_path, "vocabulary.json"), "w") as file:
+        json.dump({str(i): "w" + str(i) for i in range(12)}, file)
+    save_model_output({
+        "topic-word-matrix": rng.dirichlet(np.ones(12), size=3),
+        "topic-document-matrix": rng.dirichlet(np.ones(3), size=6).T,
+        "test-topic-document-matrix": rng.dirichlet(np.ones(3), size=4).T},
+        os.path.join(models_path, name), layout=layout, top_n=top_n)
+    return expManager._modelOutputPaths(experiment_path, *name.split("_"))
+
+
+@pytest.fixture
+def model_output_cache(monkeypatch):
+    monkeypatch.setattr(expManager, "MODEL_OUTPUT_CACHE_SIZE", 2)
+    expManager._model_output_cache.clear()
+    yield expManager._model_output_cache
+    expManager._model_output_cache.clear()
+
+
+@pytest.mark.parametrize("layout", ["npz", "npy"])
+def test_model_output_slices(tmpdir, model_output_cache, layout):
+    path = str(tmpdir)
+    outputfile, vocabularyfile = _save_model_output(path, "0_0", layout)
+    output = load_model_output(outputfile)
+
+    summary = expManager.getModelSummary(path, 0, 0)
+    assert summary["num_topics"] == 3 and summary["num_words"] == 12
+    assert summary["num_documents"] == 6
+    assert summary["num_test_documents"] == 4
+    assert summary["topics"] == load_model_output(
+        outputfile, vocabularyfile, 20)["topics"]
+    assert expManager.getTopicRow(path, 0, 0, 1, 2, 7) == output[
+        "topic-word-matrix"][1, 2:7].tolist()
+    assert expManager.getTopicRow(path, 0, 0, 2) == output[
+        "topic-word-matrix"][2].tolist()
+    assert expManager.getDocumentTopics(path, 0, 0, 1, 4) == output[
+        "topic-document-matrix"][:, 1:4].T.tolist()
+    assert expManager.getDocumentTopics(path, 0, 0, 0, 2, test=True) == \
+        output["test-topic-document-matrix"][:, 0:2].T.tolist()
+    assert expManager.getModelSummary(path, 0, 1) is False
+
+
+@pytest.mark.parametrize("top_n", [None, 2])
+def test_model_output_summary_npz(tmpdir, model_output_cache, monkeypatch,
+                                  top_n):
+    path = str(tmpdir)
+    outputfile, _ = _save_model_output(path, "0_0", "npz", top_n=top_n)
+    reads = []
+    npz_getitem = np.lib.npyio.NpzFile.__getitem__
+
+    def recording_getitem(npz, key):
+        reads.append(key)
+        return npz_getitem(npz, key)
+
+    monkeypatch.setattr(np.lib.npyio.NpzFile, "__getitem__", recording_getitem)
+    summary = expManager.getModelSummary(path, 0, 0)
+    assert summary["num_documents"] == 6
+    assert summary["num_test_documents"] == 4
+    # the topic-document matrices are not decompressed
+    assert [key for key in reads if "topic-document" in key
+            and not key.endswith("-shape")] == []
+
+    documents = expManager.getDocumentTopics(path, 0, 0, 1, 4)
+    assert [key for key in reads if key.startswith("test-topic-document")
+            and not key.endswith("-shape")] == []
+    assert documents == load_model_output(outputfile)[
+        "topic-document-matrix"][:, 1:4].T.tolist()
+
+
+@pytest.mark.parametrize("layout", ["npz", "npy"])
+def test_model_output_cache(tmpdir, model_output_cache, layout):
+    path = str(tmpdir)
+    for name in ["0_0", "1_0", "2_0"]:
+        _save_model_output(path, name, layout)
+
+    first = expManager.openModelOutput(path, 0, 0)
+    assert expManager.openModelOutput(path, 0, 0) is first
+    expManager.openModelOutput(path, 1, 0)
+    # the least recently used output is evicted
+    expManager.openModelOutput(path, 0, 0)
+    expManager.openModelOutput(path, 2, 0)
+    assert len(model_output_cache) == 2
+    assert expManager.openModelOutput(path, 0, 0) is first
+    second = expManager.openModelOutput(path, 1, 0)
+    assert expManager.openModelOutput(path, 1, 0) is second
+    assert expManager.openModelOutput(path, 0, 0) is first
+    expManager.openModelOutput(path, 2, 0)
+    assert expManager.openModelOutput(path, 1, 0) is not second
+
+    # a model output saved again is opened again
+    first = expManager.openModelOutput(path, 0, 0)
+    outputfile, _ = _save_model_output(path, "0_0", layout, seed=1)
+    mtime = os.path.getmtime(outputfile)
+    os.utime(outputfile, (mtime + 1, mtime + 1))
+    reopened = expManager.openModelOutput(path, 0, 0)
+    assert reopened is not first
+    assert expManager.getTopicRow(path, 0, 0, 0) == load_model_output(
+        outputfile)["topic-word-matrix"][0].tolist()
+
+
+def test_model_output_routes(tmpdir, queue_manager, model_output_cache):
+    manager = queue_manager()
+    manager.completed["bexp"] = {"path": str(tmpdir), "experimentId": "exp"}
+    outputfile, _ = _save_model_output(
+        os.path.join(str(tmpdir), "exp"), "0_0", "npy")
+    output = load_model_output(outputfile)
+    client = server.app.test_client()
+    server.queueManager = manager
+
+    def post(route, **data):
+        data.update({"batchId": "b", "experimentId": "exp",
+                     "iteration": 0, "model_run": 0})
+        return client.post(route, json={"data": data}).get_json()
+
+    assert post("/getTopicRow", topic=1, start=3, end=9)["row"] == output[
+        "topic-word-matrix"][1, 3:9].tolist()
+    assert post("/getDocumentTopics", start=2, end=5)["documents"] == output[
+        "topic-document-matrix"][:, 2:5].T.tolist()
+    assert post("/getDocumentTopics", start=1, end=3, test=True)[
+        "documents"] == output["test-topic-document-matrix"][:, 1:3].T.tolist()
+    assert post("/getIterationData")["output"]["num_documents"] == 6
+
+
+def test_download_failure_releases_queue(queue_manager, tmpdir):
+    manager = queue_manager()
+    manager.add_experiment("b", "e", {"path": str(tmpdir), "t": 2})
+    _wait_until(lambda: manager.getRunning() == "be")
+    server.queueManager = manager
+
+    # the experiment has no results yet, the report cannot be written
+    response = server.app.test_client().get(
+        "/downloadSingleExp?batchId=b&experimentId=e")
+    assert response.status_code == 500
+    assert not manager.held[0]
+    _wait_until(lambda: manager.getRunning() == "be")
@@ -8,10 +8,15 @@ from click.testing import CliRunner
 from octis.evaluation_metrics.classification_metrics import F1Score
 
 from octis.evaluation_metrics.coherence_metrics import *
-from octis.dataset.dataset import Dataset
+from octis.dataset.dataset import Dataset, count_lines, line_index, read_line
+import octis.dataset.dataset as dataset_module
 
 import os
+import numpy as np
+import pickle
+import time
 from octis.preprocessing.preprocessing import Preprocessing
+import octis.preprocessing.preprocessing as preprocessing
 
 from octis.dataset.downloader import get_data_home, _pkl_filepath
 
@@ -106,3 +111,187 @@ def test_partitions_custom(data_dir):
 def test_fetch_encoding():
     dataset = Dataset()
     dataset.fetch_dataset('DBPedia_IT')
+
+
+def test_columnar_dataset(data_dir, tmpdir):
+    dataset = Dataset()
+    dataset.load_custom_dataset_from_folder(data_dir + "M10")
+    dataset.save(str(tmpdir))
+    assert os.path.isfile(str(tmpdir) + "/columnar/tokens.npy")
+
+    columnar_dataset = Dataset()
+    columnar_dataset.load_custom_dataset_from_folder(str(tmpdir))
+    assert columnar_dataset.get_metadata() == dataset.get_metadata()
+    assert columnar_dataset.get_vocabulary() == dataset.get_vocabulary()
+    assert columnar_dataset.get_labels() == dataset.get_labels()
+    assert columnar_dataset.get_corpus() == dataset.get_corpus()
+    partitions = columnar_dataset.get_partitioned_corpus()
+    assert len(partitions[0]) == 5847
+    assert len(partitions[1]) == 1254
+
+    # the corpus is rebuilt from the memory-mapped files after pickling
+    unpickled_dataset = pickle.loads(pickle.dumps(columnar_dataset))
+    assert unpickled_dataset.get_corpus() == dataset.get_corpus()
+
+    # a corpus.tsv more recent than the columnar files is used instead
+    os.utime(str(tmpdir) + "/corpus.tsv", (time.time() + 10, time.time() + 10))
+    tsv_dataset = Dataset()
+    tsv_dataset.load_custom_dataset_from_folder(str(tmpdir))
+    assert tsv_dataset._columnar is None
+    assert tsv_dataset.get_corpus() == dataset.get_corpus()
+
+
+def test_line_index(data_dir, tmpdir):
+    dataset = Dataset()
+    dataset.load_custom_dataset_from_folder(data_dir + "M10")
+    dataset.save(str(tmpdir))
+    corpus_path = str(tmpdir) + "/corpus.tsv"
+    with open(corpus_path, 'r') as corpus_file:
+        lines = corpus_file.read().splitlines()
+
+    assert Dataset.count_documents(str(tmpdir)) == len(lines)
+    assert os.path.getsize(corpus_path + ".idx") == 8 * (len(lines) + 1)
+    for i in [0, 10, len(lines) - 1]:
+        assert read_line(corpus_path, i) == lines[i]
+        assert Dataset.read_document(str(tmpdir), i) == dataset.get_corpus()[i]
+    with pytest.raises(IndexError):
+        read_line(corpus_path, len(lines))
+
+    columnar_dataset = Dataset()
+    columnar_dataset.load_custom_dataset_from_folder(str(tmpdir))
+    assert columnar_dataset._columnar is not None
+    assert columnar_dataset.get_document(10) == dataset.get_corpus()[10]
+
+    # the index is rebuilt when the file changes
+    with open(corpus_path, 'a') as corpus_file:
+        corpus_file.write("new document\ttest")
+    assert count_lines(corpus_path) == len(lines) + 1
+    assert read_line(corpus_path, len(lines)) == "new document\ttest"
+
+
+def test_line_index_read_only_folder(data_dir, tmpdir, monkeypatch):
+    corpus_path = str(tmpdir.mkdir("read_only").join("corpus.tsv"))
+    with open(data_dir + "M10/corpus.tsv", 'r') as corpus_file:
+        lines = corpus_file.read().splitlines()
+    with open(corpus_path, 'w') as corpus_file:
+        corpus_file.write("\n".join(lines) + "\n")
+    data_home = str(tmpdir.mkdir("octis_data"))
+    monkeypatch.setenv("OCTIS_DATA", data_home)
+    monkeypatch.setattr(dataset_module, "_home_line_indexes", dict())
+
+    # the temporary files cannot be created in the folder of the corpus
+    mkstemp = dataset_module.tempfile.mkstemp
+
+    def read_only_mkstemp(dir=None):
+        if os.path.abspath(dir) == os.path.dirname(corpus_path):
+            raise PermissionError("read-only folder")
+        return mkstemp(dir=dir)
+
+    monkeypatch.setattr(dataset_module.tempfile, "mkstemp", read_only_mkstemp)
+    index_name = line_index(corpus_path)
+    assert index_name.startswith(os.path.join(data_home, "line_indexes"))
+    assert os.listdir(os.path.dirname(corpus_path)) == ["corpus.tsv"]
+    assert count_lines(corpus_path) == len(lines)
+    assert read_line(corpus_path, 10) == lines[10]
+
+    # the index of the data home is used by the other processes too
+    monkeypatch.setattr(dataset_module, "_home_line_indexes", dict())
+    assert line_index(corpus_path) == index_name
+    with open(corpus_path, 'a') as corpus_file:
+        corpus_file.write("new document\ttest\n")
+    assert line_index(corpus_path) == index_name
+    assert read_line(corpus_path, len(lines)) == "new document\ttest"
+
+
+def test_document_term_matrix(data_dir, tmpdir):
+    dataset = Dataset()
+    dataset.load_custom_dataset_from_folder(data_dir + "M10")
+    vocabulary = dataset.get_vocabulary()
+    vocab2id = {w: i for i, w in enumerate(vocabulary)}
+    corpus = dataset.get_corpus()
+
+    dtm = dataset.get_document_term_matrix()
+    assert dtm.shape == (len(corpus), len(vocabulary))
+    assert dtm.indices.dtype == np.int32
+    assert dataset.get_document_term_matrix() is dtm
+    for i in [0, 10, len(corpus) - 1]:
+        counts = np.zeros(len(vocabulary), dtype=int)
+        for word in corpus[i]:
+            counts[vocab2id[word]] += 1
+        assert (dtm[i].toarray()[0] == counts).all()
+
+    train, validation, test = dataset.get_partitioned_document_term_matrix()
+    assert [m.shape[0] for m in (train, validation, test)] == [5847, 1254, 1254]
+    assert (test != dtm[-1254:]).nnz == 0
+    train, test = dataset.get_partitioned_document_term_matrix(use_validation=False)
+    assert [m.shape[0] for m in (train, test)] == [5847, 1254]
+
+    # the words out of the given vocabulary are left out
+    token_ids, offsets = dataset.get_token_ids(vocabulary[:10])
+    assert len(offsets) == len(corpus) + 1
+    assert token_ids.tolist() == [vocab2id[w] for doc in corpus for w in doc if vocab2id[w] < 10]
+
+    # the columnar dataset gives the same matrix without building the corpus
+    dataset.save(str(tmpdir))
+    columnar_dataset = Dataset()
+    columnar_dataset.load_custom_dataset_from_folder(str(tmpdir))
+    assert (columnar_dataset.get_document_term_matrix() != dtm).nnz == 0
+    assert columnar_dataset._Dataset__corpus is None
+
+
+def _lemmatizer_pipeline():
+    # a small pipeline with a rule lemmatizer, so that the lemma of a word
+    # form depends on its part of speech
+    import spacy
+    from spacy.lookups import Lookups
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("attribute_ruler")
+    ruler.add([[{"LOWER": {"IN": ["cats", "dogs", "runs", "walks"]}}]], {"POS": "NOUN"})
+    ruler.add([[{"LOWER": {"IN": ["he", "she"]}}, {"LOWER": {"IN": ["runs", "walks"]}}]],
+              {"POS": "VERB"}, index=1)
+    ruler.add([[{"LOWER": {"IN": ["were", "running"]}}]], {"POS": "VERB"})
+    lemmatizer = nlp.add_pipe("lemmatizer", config={"mode": "rule"})
+    lookups = Lookups()
+    lookups.add_table("lemma_rules", {"noun": [["s", ""]], "verb": [["ning", ""], ["s", ""]]})
+    lookups.add_table("lemma_index", {"noun": [], "verb": []})
+    lookups.add_table("lemma_exc", {"noun": {"runs": ["runs"]}, "verb": {"were": ["be"]}})
+    lemmatizer.initialize(lookups=lookups)
+    return nlp
+
+
+def test_preprocessing_lemma_cache(monkeypatch):
+    nlp = _lemmatizer_pipeline()
+    monkeypatch.setattr(preprocessing.spacy, "load", lambda *args, **kwargs: nlp)
+    docs = ["the cats were running", "he runs and she walks", "the runs of the dogs",
+            "cats dogs walks runs", "she runs the walks", "he walks the cats"]
+    p = Preprocessing(remove_punctuation=False, remove_numbers=False, lemmatize=True,
+                      stopword_list=None, lemma_cache_size=2)
+    # the lemmas of the cache are the ones set by the lemmatizer of the pipeline
+    expected = [" ".join(token.lemma_ for token in nlp(doc)) for doc in docs]
+    assert p.preprocess_documents(docs) == expected
+    assert expected[1] == "he run and she walk"
+    assert expected[2] == "the runs of the dog"
+    assert len(p._lemma_cache) == 2
+    # the evicted lemmas are computed again
+    assert p.preprocess_documents(docs[::-1]) == expected[::-1]
+
+
+def test_preprocessing_streaming(data_dir, tmpdir):
+    texts_path = data_dir + "/sample_texts/unprepr_docs.txt"
+    p = Preprocessing(vocabulary=None, max_features=None, remove_punctuation=True, punctuation=".,?:",
+                      lemmatize=False, min_chars=2, min_words_docs=1, max_df=0.5, num_processes=2)
+    dataset = p.preprocess_dataset(documents_path=texts_path)
+    p.preprocess_dataset_streaming(documents_path=texts_path, output_path=str(tmpdir), chunk_size=3)
+
+    streamed_dataset = Dataset()
+    streamed_dataset.load_custom_dataset_from_folder(str(tmpdir))
+    assert list(streamed_dataset.get_vocabulary()) == list(dataset.get_vocabulary())
+    assert streamed_dataset.get_metadata()["last-training-doc"] == dataset.get_metadata()["last-training-doc"]
+    assert streamed_dataset.get_metadata()["last-validation-doc"] == dataset.get_metadata()["last-validation-doc"]
+    # the same documents in each partition, in their original order
+    for streamed_partition, partition in zip(streamed_dataset.get_partitioned_corpus(),
+                                             dataset.get_partitioned_corpus()):
+        assert sorted(streamed_partition) == sorted(partition)
+    documents = dict(zip(dataset._Dataset__original_indexes, dataset.get_corpus()))
+    for i, document in zip(streamed_dataset._Dataset__original_indexes, streamed_dataset.get_corpus()):
+        assert documents[int(i)] == document
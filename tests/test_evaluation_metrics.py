@@ -14,9 +14,20 @@ from octis.evaluation_metrics.similarity_metrics import WordEmbeddingsRBOMatch,
     WordEmbeddingsCentroidSimilarity, WordEmbeddingsPairwiseSimilarity
 
 from octis.evaluation_metrics.coherence_metrics import *
+from octis.evaluation_metrics import embeddings_store
+from octis.evaluation_metrics.embeddings_store import load_word_embeddings
+from octis.evaluation_metrics.cooccurrence_index import corpus_fingerprint
+from octis.evaluation_metrics.rbo import rbo, pairwise_rbo_ext
+from octis.evaluation_metrics.diversity_metrics import WordEmbeddingsInvertedRBOCentroid
+from octis.evaluation_metrics import word_embeddings_rbo, word_embeddings_rbo_centroid
+from octis.evaluation_metrics.metric_suite import MetricSuite, ModelOutput, shared_intermediate
+from octis.evaluation_metrics.divergences import kl_divergence_to_reference, pairwise_kl_divergence, \
+    pairwise_log_odds_ratio
+from gensim.models import KeyedVectors
 from octis.dataset.dataset import Dataset
 from octis.models.LDA import LDA
 
+import itertools
 import os
 
 
@@ -25,6 +36,15 @@ def root_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
 
+@pytest.fixture
+def store_home(tmpdir, monkeypatch):
+    # the embeddings are stored in a temporary octis data home and loaded
+    # again by each test
+    monkeypatch.setenv("OCTIS_DATA", str(tmpdir))
+    monkeypatch.setattr(embeddings_store, "_loaded_embeddings", {})
+    return os.path.join(str(tmpdir), "embeddings")
+
+
 @pytest.fixture
 def dataset(root_dir):
     dataset = Dataset()
@@ -74,6 +94,22 @@ def test_svm_persistency(dataset, model_output):
     assert not metric.same_svm
 
 
+def test_svm_cache(dataset, model_output):
+    metrics = [F1Score(dataset=dataset), PrecisionScore(dataset=dataset), RecallScore(dataset=dataset),
+               AccuracyScore(dataset=dataset)]
+    other_output = dict(model_output)
+    other_output['topic-document-matrix'] = model_output['topic-document-matrix'].copy()
+    other_output['topic-document-matrix'][0, 0] += 1
+
+    for output in [model_output, other_output]:
+        for metric in metrics:
+            metric.score(output)
+    # each output was fitted once, and both are still cached
+    assert [metric.same_svm for metric in metrics] == [False, True, True, True]
+    metrics[0].score(model_output)
+    assert metrics[0].same_svm
+
+
 def test_npmi_coherence_measures(dataset, model_output):
     metric = Coherence(topk=10, texts=dataset.get_corpus())
     score = metric.score(model_output)
@@ -81,6 +117,28 @@ def test_npmi_coherence_measures(dataset, model_output):
     assert -1 <= score <= 1
 
 
+def test_corpus_fingerprint():
+    corpora = [[["new york"]], [["new", "york"]], [["new"], ["york"]],
+               [["new\nyork"]], [["new york", ""]], []]
+    fingerprints = [corpus_fingerprint(texts) for texts in corpora]
+    assert len(set(fingerprints)) == len(corpora)
+    assert corpus_fingerprint([["new", "york"]]) == fingerprints[1]
+
+
+def test_coherence_measures_match_gensim(dataset, model_output):
+    from gensim.corpora.dictionary import Dictionary
+    from gensim.models import CoherenceModel
+
+    texts = dataset.get_corpus()
+    for measure in ['u_mass', 'c_v', 'c_uci', 'c_npmi']:
+        metric = Coherence(topk=10, texts=texts, measure=measure)
+        score = metric.score(model_output)
+        expected = CoherenceModel(
+            topics=model_output["topics"], texts=texts, dictionary=Dictionary(texts),
+            coherence=measure, topn=10).get_coherence()
+        assert score == pytest.approx(expected)
+
+
 def test_we_coherence_measures(dataset, model_output):
     metric = WECoherenceCentroid(topk=5)
     score = metric.score(model_output)
@@ -110,6 +168,46 @@ def test_we_coherence_measures_oov(dataset):
     print(score)
 
 
+def test_we_coherence_measures_local_embeddings(root_dir, store_home):
+    word2vec_path = root_dir + "/../trained_embeddings/test_example/example.bin"
+    model_output = {'topics': [['the', 'in', 'your', 'his', 'and'],
+                               ['to', 'even', 'unknownword', 'of', 'were'],
+                               ['aaaaa', 'bbb', 'cc', 'd', 'EEE']]}
+    wv = KeyedVectors.load_word2vec_format(word2vec_path, binary=True)
+    expected = []
+    for topic in model_output['topics'][:2]:
+        E = np.array([wv[w] / wv[w].sum() for w in topic if w in wv.key_to_index], dtype=np.float64)
+        E = E / np.linalg.norm(E, axis=1, keepdims=True)
+        expected.append(((E @ E.T).sum() - len(E)) / (5 * 4))
+    expected.append(-1)
+
+    metric = WECoherencePairwise(topk=5, word2vec_path=word2vec_path, binary=True)
+    assert metric.score(model_output) == pytest.approx(np.mean(expected))
+
+    metric = WECoherenceCentroid(topk=5, word2vec_path=word2vec_path, binary=True)
+    score = metric.score(model_output)
+    assert type(score) == np.float64 or type(score) == float
+    assert -1 <= score <= 2
+    assert len(os.listdir(store_home)) == 1
+
+
+def test_embeddings_store(root_dir, tmpdir, store_home):
+    word2vec_path = root_dir + "/../trained_embeddings/test_example/example.bin"
+    wv = load_word_embeddings(word2vec_path, binary=True, store_home=str(tmpdir))
+    assert isinstance(wv.vectors, np.memmap)
+    assert load_word_embeddings(word2vec_path, binary=True, store_home=str(tmpdir)) is wv
+
+    # the embeddings of another store are loaded from that store
+    other = load_word_embeddings(word2vec_path, binary=True)
+    assert other is not wv
+    assert os.path.dirname(other.vectors.filename).startswith(store_home)
+    assert load_word_embeddings(word2vec_path, binary=True) is other
+
+    original = KeyedVectors.load_word2vec_format(word2vec_path, binary=True)
+    assert wv.index_to_key == original.index_to_key
+    assert np.array_equal(wv.vectors, original.vectors)
+
+
 def test_diversity_measures(dataset, model_output):
     metric = TopicDiversity(topk=10)
     score = metric.score(model_output)
@@ -166,6 +264,70 @@ def test_irbo(dataset, model_output):
     assert 0 <= score <= 1
 
 
+def test_pairwise_rbo_ext(model_output):
+    topics = model_output['topics'] + [['a', 'b', 'a'], ['b', 'c']]
+    expected = [rbo(list1[:5], list2[:5], p=0.9).ext for list1, list2 in itertools.combinations(topics, 2)]
+    assert np.allclose(pairwise_rbo_ext(topics, p=0.9, topk=5), expected)
+
+
+def test_pairwise_word_embeddings_rbo(root_dir):
+    word2vec_path = root_dir + "/../trained_embeddings/test_example/example.bin"
+    topics = [['the', 'in', 'your', 'his', 'and'],
+              ['to', 'even', 'his', 'of', 'were'],
+              ['in', 'the', 'told', 'unknownword']]
+    wv = KeyedVectors.load_word2vec_format(word2vec_path, binary=True)
+    expected, expected_centroid = [], []
+    for list1, list2 in itertools.combinations(topics, 2):
+        words = sorted(set(list1 + list2))
+        word2index = {w: i for i, w in enumerate(words)}
+        indexed_list1 = [word2index[w] for w in list1]
+        indexed_list2 = [word2index[w] for w in list2]
+        expected_centroid.append(word_embeddings_rbo_centroid.word_embeddings_rbo(
+            indexed_list1, indexed_list2, p=0.9, index2word=words, embedding_space=wv, norm=True)[2])
+        if 'unknownword' not in list1 + list2:
+            expected.append(word_embeddings_rbo.word_embeddings_rbo(
+                indexed_list1, indexed_list2, p=0.9, index2word=words, word2vec=wv, norm=True)[2])
+
+    metric = WordEmbeddingsInvertedRBO(topk=5, word2vec_path=word2vec_path, binary=True)
+    assert metric.score({'topics': topics[:2]}) == pytest.approx(1 - np.mean(expected), abs=1e-4)
+
+    metric = WordEmbeddingsInvertedRBOCentroid(topk=5, word2vec_path=word2vec_path, binary=True)
+    assert metric.score({'topics': topics}) == pytest.approx(1 - np.mean(expected_centroid), abs=1e-4)
+
+
+def test_divergence_kernels(model_output):
+    beta = model_output['topic-word-matrix']
+    beta[0, :10] = 0
+    P = beta + 0.00001
+    expected_kl = [[np.sum(P[i] * np.log(P[i] / P[j])) for j in range(len(P))] for i in range(len(P))]
+    assert np.allclose(pairwise_kl_divergence(beta), expected_kl, atol=1e-5)
+    assert np.allclose(kl_divergence_to_reference(beta, beta[1]), np.array(expected_kl)[:, 1], atol=1e-5)
+
+    lor = pairwise_log_odds_ratio(beta)
+    assert np.isinf(lor[0, 1]) and lor[0, 0] == 0
+    expected_lor = np.abs(np.log(beta[1]) - np.log(beta[2])).mean()
+    assert lor[1, 2] == pytest.approx(expected_lor, rel=1e-5)
+
+    per_topic = KLDivergence().score(model_output, per_topic=True)
+    assert len(per_topic) == len(beta)
+    assert per_topic[2] == pytest.approx((expected_kl[2][0] + expected_kl[2][1]) / 2, rel=1e-5)
+
+
+def test_metric_suite(dataset, model_output):
+    metrics = [TopicDiversity(topk=10), InvertedRBO(topk=10), RBO(topk=5), KL_uniform(), KL_vacuous(),
+               KL_background(), F1Score(dataset=dataset)]
+    expected = [metric.score(model_output) for metric in metrics]
+    for n_jobs, backend in [(1, 'thread'), (3, 'thread'), (2, 'process')]:
+        with MetricSuite(metrics, n_jobs=n_jobs, backend=backend) as suite:
+            assert suite.score(model_output) == pytest.approx(expected)
+
+    calls = []
+    shared_output = ModelOutput(model_output)
+    for i in range(2):
+        shared_intermediate(shared_output, 'key', lambda: calls.append(i))
+    assert calls == [0]
+
+
 def test_kl_b(dataset, model_output):
     metric = KL_background()
     score = metric.score(model_output)
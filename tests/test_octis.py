@@ -10,12 +10,19 @@ from octis.models.LDA_tomopy import LDA_tomopy as LDATOMOTO
 from octis.models.ETM import ETM
 from octis.models.CTM import CTM
 from octis.models.NMF import NMF
+from octis.models.LSI import LSI
+from octis.models.HDP import HDP
 from octis.models.NMF_scikit import NMF_scikit
+from octis.models.model import (
+    ModelOutputWriter, get_gensim_corpus, load_model_output,
+    save_model_output)
 from octis.models.ProdLDA import ProdLDA
+from octis.models.pytorchavitm.datasets import BOWDataset, batch_loader
 from octis.preprocessing.preprocessing import Preprocessing
 
 import numpy as np
 import os
+import torch
 
 
 @pytest.fixture
@@ -63,6 +70,117 @@ def test_model_output_lda(data_dir):
         dataset.get_partitioned_corpus()[2]))
 
 
+def test_model_output_lda_inference_jobs(data_dir):
+    dataset = Dataset()
+    dataset.load_custom_dataset_from_folder(data_dir + '/M10')
+    num_topics = 3
+    model = LDA(num_topics=num_topics, iterations=5, chunksize=500,
+                inference_jobs=2)
+    output = model.train_model(dataset)
+
+    # check that the chunks are assembled in the order of the documents
+    topic_document = output['topic-document-matrix']
+    assert topic_document.shape == (num_topics, len(
+        dataset.get_partitioned_corpus()[0]))
+    assert np.allclose(topic_document.sum(axis=0), 1, atol=1e-4)
+    assert output['test-topic-document-matrix'].shape == (num_topics, len(
+        dataset.get_partitioned_corpus()[2]))
+
+
+def _per_document_matrix(topics_of, corpus, num_topics):
+    topic_document = np.zeros((num_topics, len(corpus)))
+    for i, document in enumerate(corpus):
+        for topic, weight in topics_of(document):
+            topic_document[topic, i] = weight
+    return topic_document
+
+
+def test_topic_document_matrix_per_document(data_dir):
+    dataset = Dataset()
+    dataset.load_custom_dataset_from_folder(data_dir + '/M10')
+
+    # the batched inference gives the weights of the per-document calls
+    model = NMF(num_topics=10, chunksize=500, w_max_iter=10, h_max_iter=10)
+    model.train_model(dataset)
+    nmf = model.trained_model
+    # the solver of the projections draws from the random state of the model
+    random_state = nmf.random_state.get_state()
+    topic_document = model._get_topic_document_matrix()
+    nmf.random_state.set_state(random_state)
+    expected = _per_document_matrix(
+        lambda doc: nmf.get_document_topics(doc, minimum_probability=0),
+        model.id_corpus, 10)
+    assert np.allclose(topic_document, expected, atol=1e-6)
+
+    model = HDP(max_time=5, chunksize=500)
+    output = model.train_model(dataset)
+    hdp = model.trained_model
+    test_corpus = get_gensim_corpus(
+        dataset.get_partitioned_document_term_matrix()[1])
+    num_topics = len(hdp.get_topics())
+    expected = _per_document_matrix(
+        lambda doc: hdp[doc], model.id_corpus, num_topics)
+    assert np.allclose(output['topic-document-matrix'], expected, atol=1e-6)
+    expected = _per_document_matrix(lambda doc: hdp[doc], test_corpus, num_topics)
+    assert np.allclose(output['test-topic-document-matrix'], expected, atol=1e-6)
+
+    model = LSI(num_topics=5, chunksize=500)
+    output = model.train_model(dataset)
+    lsi = model.trained_model
+    test_corpus = get_gensim_corpus(
+        dataset.get_partitioned_document_term_matrix(use_validation=False)[1])
+    expected = _per_document_matrix(lambda doc: lsi[doc], test_corpus, 5)
+    assert np.allclose(output['test-topic-document-matrix'], expected, atol=1e-5)
+    # the weights of the training documents are scaled in [0, 1]
+    expected = _per_document_matrix(lambda doc: lsi[doc], model.id_corpus, 5)
+    minimum, maximum = expected.min(axis=0), expected.max(axis=0)
+    expected = (expected - minimum) / (maximum - minimum)
+    assert np.allclose(output['topic-document-matrix'], expected, atol=1e-5)
+
+
+def test_save_model_output_policy(tmp_path):
+    rng = np.random.RandomState(0)
+    topic_document = rng.dirichlet(np.ones(5), size=20).T
+    model_output = {
+        "topics": [["a", "b"]] * 5,
+        "topic-word-matrix": rng.dirichlet(np.ones(8), size=5),
+        "topic-document-matrix": topic_document,
+        "test-topic-document-matrix": topic_document[:, :4]}
+
+    # default policy: rounded float64 in a compressed npz file
+    save_model_output(model_output, str(tmp_path / "default"))
+    output = load_model_output(str(tmp_path / "default.npz"))
+    assert output["topic-document-matrix"].dtype == np.float64
+    assert np.allclose(output["topic-document-matrix"], topic_document,
+                       atol=1e-7)
+
+    # float16 top-2 topics of each document, one memory-mappable npy file
+    # per array
+    save_model_output(model_output, str(tmp_path / "compact"),
+                      dtype="float16", top_n=2, layout="npy")
+    assert os.path.isdir(tmp_path / "compact")
+    output = load_model_output(str(tmp_path / "compact"), mmap_mode="r")
+    assert isinstance(output["topic-word-matrix"], np.memmap)
+    theta = output["topic-document-matrix"]
+    assert theta.dtype == np.float16 and theta.shape == (5, 20)
+    assert np.all((theta > 0).sum(axis=0) == 2)
+    top = np.sort(topic_document, axis=0)[-2:]
+    assert np.allclose(np.sort(theta, axis=0)[-2:], top, atol=1e-3)
+    assert output["test-topic-document-matrix"].shape == (5, 4)
+    assert output["topics"].tolist() == model_output["topics"]
+
+    # the writer saves, renames and removes in order in the background
+    with ModelOutputWriter(dtype="float32") as writer:
+        writer.save(model_output, str(tmp_path / "pending"))
+        writer.rename(str(tmp_path / "pending"), str(tmp_path / "0"))
+        writer.save(model_output, str(tmp_path / "discarded"))
+        writer.remove(str(tmp_path / "discarded"))
+    assert sorted(os.listdir(tmp_path)) == [
+        "0.npz", "compact", "default.npz"]
+    assert load_model_output(str(tmp_path / "0.npz"))[
+        "topic-word-matrix"].dtype == np.float32
+
+
 def test_model_output_etm(data_dir):
     dataset = Dataset()
     dataset.load_custom_dataset_from_folder(data_dir + '/M10')
@@ -574,3 +692,17 @@ def test_model_output_prodlda_not_partitioned(data_dir):
     assert type(output['topic-document-matrix']) == np.ndarray
     assert output['topic-document-matrix'].shape == (
         num_topics, len(dataset.get_corpus()))
+
+
+def test_bow_dataset_batches(data_dir):
+    dataset = Dataset()
+    dataset.load_custom_dataset_from_folder(data_dir + '/M10')
+    dtm = dataset.get_document_term_matrix()
+    bow_dataset = BOWDataset(dtm, dict(enumerate(dataset.get_vocabulary())))
+    assert len(bow_dataset) == dtm.shape[0]
+    assert bow_dataset[3]['X'].shape == (dtm.shape[1],)
+
+    batches = [batch['X'] for batch in batch_loader(bow_dataset, 1000)]
+    assert len(batches) == int(np.ceil(dtm.shape[0] / 1000))
+    assert all(batch.dtype == torch.float32 for batch in batches)
+    assert np.array_equal(np.vstack([batch.numpy() for batch in batches]), dtm.toarray())
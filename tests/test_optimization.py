@@ -3,6 +3,7 @@
 import json
 import os
 
+import numpy as np
 import pytest
 from skopt.space.space import Real
 
@@ -10,7 +11,13 @@ from octis.dataset.dataset import Dataset
 from octis.evaluation_metrics.coherence_metrics import Coherence
 from octis.evaluation_metrics.classification_metrics import F1Score
 from octis.models.LDA import LDA
+from octis.evaluation_metrics.metric_suite import MetricSuite
+from octis.models.model import ModelOutputWriter, load_model_output
 from octis.optimization.optimizer import Optimizer
+from octis.optimization.optimizer_tool import hyperband_brackets
+import octis.optimization.trial_store as trial_store
+from octis.optimization.trial_store import (
+    TrialStore, load_optimization_results, trial_store_path)
 
 os.chdir(os.path.pardir)
 
@@ -458,3 +465,292 @@ def test_initial_input(
     assert all(
         [file["x0"]["alpha"][i] == x0["alpha"][i]
          for i in range(len(x0["alpha"]))])
+
+
+def _no_save(writer, model_output, path):
+    raise AssertionError("model output saved by the main process")
+
+
+def test_parallel_model_runs(
+        dataset, model, metric, extra_metric, search_space, data_dir_test,
+        monkeypatch):
+    # Choose number of call and number of model_runs
+    number_of_call = 3
+    model_runs = 3
+    n_random_starts = 2
+
+    save_path = data_dir_test + "test_parallel_model_runs/"
+    # the model outputs are saved by the workers, not by the main process
+    monkeypatch.setattr(ModelOutputWriter, "save", _no_save)
+
+    # Optimize the function npmi performing the model runs in parallel
+    optimizer = Optimizer()
+    optimization_result = optimizer.optimize(
+        model, dataset, metric, search_space,
+        number_of_call=number_of_call,
+        model_runs=model_runs,
+        n_random_starts=n_random_starts,
+        save_path=save_path,
+        extra_metrics=[extra_metric],
+        n_jobs=2)
+
+    assert len(optimization_result.func_vals) == number_of_call
+    for i in range(number_of_call):
+        for j in range(model_runs):
+            assert os.path.isfile(save_path + "models/" +
+                                  str(i) + "_" + str(j) + ".npz")
+
+    f = open(save_path + "result.json")
+    file = json.load(f)
+
+    assert len(file) == 38
+    assert all(
+        [len(file["dict_model_runs"][name][el]) == model_runs
+         for name in file["dict_model_runs"].keys()
+         for el in file["dict_model_runs"][name].keys()])
+
+    # Resume the optimization with the model runs in parallel
+    optimizer = Optimizer()
+    optimization_result = optimizer.resume_optimization(
+        optimization_result.name_json, extra_evaluations=1, n_jobs=2)
+    assert len(optimization_result.func_vals) == number_of_call + 1
+
+
+def test_batch_optimization(
+        dataset, model, metric, extra_metric, search_space, data_dir_test):
+    # Choose number of call and number of model_runs
+    number_of_call = 5
+    model_runs = 2
+    n_random_starts = 2
+
+    x0 = {"eta": [0.1], "alpha": [0.5]}
+    save_path = data_dir_test + "test_batch_optimization/"
+
+    # Optimize the function npmi evaluating two configurations at a time
+    optimizer = Optimizer()
+    optimization_result = optimizer.optimize(
+        model, dataset, metric, search_space,
+        number_of_call=number_of_call,
+        model_runs=model_runs,
+        n_random_starts=n_random_starts,
+        x0=x0,
+        save_path=save_path,
+        extra_metrics=[extra_metric],
+        n_points=2)
+
+    assert len(optimization_result.func_vals) == number_of_call
+    assert 0.1 in optimization_result.info["x_iters"]["eta"]
+    for i in range(number_of_call):
+        for j in range(model_runs):
+            assert os.path.isfile(save_path + "models/" +
+                                  str(i) + "_" + str(j) + ".npz")
+    assert not any(name.startswith("pending")
+                   for name in os.listdir(save_path + "models/"))
+
+    f = open(save_path + "result.json")
+    file = json.load(f)
+
+    assert len(file) == 38
+    assert len(file["f_val"]) == number_of_call
+    assert all(
+        [len(file["dict_model_runs"][name]) == number_of_call
+         for name in file["dict_model_runs"].keys()])
+
+    # Resume the optimization in batch mode
+    optimizer = Optimizer()
+    optimization_result = optimizer.resume_optimization(
+        optimization_result.name_json, extra_evaluations=2, n_points=2)
+    assert len(optimization_result.func_vals) == number_of_call + 2
+    assert len(optimization_result.info["dict_model_runs"][
+        metric.__class__.__name__]) == number_of_call + 2
+    assert optimization_result.y_best == -max(
+        optimization_result.func_vals[3], optimization_result.func_vals[5])
+
+
+def test_hyperband_brackets():
+    assert hyperband_brackets(1, 9) == [
+        (9, [1, 3, 9]), (5, [3, 9]), (3, [9])]
+    assert hyperband_brackets(1, 10, hyperband=False) == [(9, [1, 3, 10])]
+    assert hyperband_brackets(0.25, 1.0, reduction_factor=2) == [
+        (4, [0.25, 0.5, 1.0]), (3, [0.5, 1.0]), (3, [1.0])]
+
+
+def test_multi_fidelity_optimization(
+        dataset, model, metric, extra_metric, search_space, data_dir_test):
+    # Choose number of call and number of model_runs
+    number_of_call = 4
+    model_runs = 1
+    n_random_starts = 2
+
+    save_path = data_dir_test + "test_multi_fidelity_optimization/"
+
+    # Optimize the function npmi training the models on 1/4, 1/2 and all
+    # the training documents
+    optimizer = Optimizer()
+    optimization_result = optimizer.optimize(
+        model, dataset, metric, search_space,
+        number_of_call=number_of_call,
+        model_runs=model_runs,
+        n_random_starts=n_random_starts,
+        save_path=save_path,
+        extra_metrics=[extra_metric],
+        n_points=2,
+        multi_fidelity="hyperband",
+        budget_parameter="documents",
+        min_budget=0.25,
+        reduction_factor=2)
+
+    assert len(optimization_result.func_vals) == number_of_call
+    multi_fidelity = optimization_result.info["multi_fidelity"]
+    # the first bracket discards two configurations at 1/4 of the documents
+    # and one at 1/2, and completes one
+    assert multi_fidelity["budgets"] == [0.25, 0.25, 0.5, 1.0]
+    assert list(multi_fidelity["rung_model_runs"]["iteration_3"]) == [
+        "0.25", "0.5", "1.0"]
+    assert multi_fidelity["current_bracket"] == 1
+    for i in range(number_of_call):
+        assert os.path.isfile(save_path + "models/" + str(i) + "_0.npz")
+    assert not any(name.startswith("pending")
+                   for name in os.listdir(save_path + "models/"))
+    # the best result is the one of the configuration evaluated at the full
+    # budget, the only one told to the surrogate model
+    assert optimization_result.y_best == -optimization_result.func_vals[3]
+    _, opt = Optimizer()._restore_parameters(optimization_result.name_json)
+    assert len(opt.yi) == 1
+
+    # Resume the optimization from the second bracket
+    optimizer = Optimizer()
+    optimization_result = optimizer.resume_optimization(
+        optimization_result.name_json, extra_evaluations=2, n_points=2)
+    assert len(optimization_result.func_vals) == number_of_call + 2
+    assert optimization_result.info["multi_fidelity"]["budgets"][4:] == [
+        0.5, 1.0]
+    assert len(optimization_result.info["dict_model_runs"][
+        metric.__class__.__name__]) == number_of_call + 2
+    assert optimization_result.y_best == -max(
+        optimization_result.func_vals[3], optimization_result.func_vals[5])
+
+
+def test_trial_store(tmp_path, monkeypatch):
+    # the end of the last line is searched backwards in blocks shorter than
+    # the lines
+    monkeypatch.setattr(trial_store, "_TAIL_BLOCK_SIZE", 8)
+    store = TrialStore(str(tmp_path / "result.trials.jsonl"))
+    assert store.load() is None
+    store.reset()
+    header = {"metric_name": "Coherence", "extra_metric_names": [],
+              "number_of_call": 3, "model_attributes": {}}
+    store.append_header(header)
+    for call in range(2):
+        store.append_trial({
+            "call": call, "x": {"alpha": 0.1 * call}, "f_val": call,
+            "time": 1.0, "model_runs": {"Coherence": [call]},
+            "model_attributes": {"passes": call}})
+    results = store.load()
+    assert results["f_val"] == [0, 1]
+    assert results["current_call"] == 1
+    assert results["x_iters"] == {"alpha": [0.0, 0.1]}
+    assert results["model_attributes"] == {"passes": 1}
+
+    # a trial in writing is ignored, and discarded when the optimization is
+    # resumed. A trial of a resumed optimization replaces the trials after it
+    with open(store.path, 'a') as file:
+        file.write('{"trial": {"call": 2')
+    assert store.load()["f_val"] == [0, 1]
+    store.append_header(dict(header, number_of_call=4))
+    store.append_trial({
+        "call": 1, "x": {"alpha": 0.5}, "f_val": 5, "time": 1.0,
+        "model_runs": {"Coherence": [5]}, "model_attributes": {}})
+    results = store.load()
+    assert results["f_val"] == [0, 5]
+    assert results["number_of_call"] == 4
+    store.reset()
+    store.append_header(header)
+    assert store.load()["f_val"] == []
+
+
+def test_trial_store_resume(
+        dataset, model, metric, search_space, data_dir_test):
+    number_of_call = 3
+    save_path = data_dir_test + "test_trial_store_resume/"
+
+    optimizer = Optimizer()
+    optimization_result = optimizer.optimize(
+        model, dataset, metric, search_space,
+        number_of_call=number_of_call,
+        model_runs=2,
+        n_random_starts=2,
+        save_path=save_path)
+
+    # the store has a header and one line for each evaluation
+    store_path = trial_store_path(optimization_result.name_json)
+    with open(store_path) as file:
+        assert len(file.readlines()) == number_of_call + 1
+    with open(optimization_result.name_json) as file:
+        exported = json.load(file)
+    stored = load_optimization_results(optimization_result.name_json)
+    for key in ["f_val", "x_iters", "time_eval", "dict_model_runs",
+                "current_call", "number_of_call", "model_attributes"]:
+        assert stored[key] == exported[key]
+
+    # an optimization without a store is resumed from the json file and
+    # copied to a new store
+    os.remove(store_path)
+    optimizer = Optimizer()
+    optimization_result = optimizer.resume_optimization(
+        optimization_result.name_json, extra_evaluations=1)
+    assert len(optimization_result.func_vals) == number_of_call + 1
+    stored = load_optimization_results(optimization_result.name_json)
+    assert stored["f_val"] == optimization_result.info["f_val"]
+    assert stored["number_of_call"] == number_of_call + 1
+
+
+def test_save_format(
+        dataset, model, metric, search_space, data_dir_test, monkeypatch):
+    number_of_call = 3
+    model_runs = 2
+    save_path = data_dir_test + "test_save_format/"
+    monkeypatch.setattr(ModelOutputWriter, "save", _no_save)
+
+    # Save the model outputs in float32, one npy file per array, while the
+    # configurations are evaluated two at a time by the workers, which save
+    # the model outputs
+    optimizer = Optimizer()
+    optimization_result = optimizer.optimize(
+        model, dataset, metric, search_space,
+        number_of_call=number_of_call,
+        model_runs=model_runs,
+        n_random_starts=2,
+        save_path=save_path,
+        n_points=2,
+        save_format={"dtype": "float32", "layout": "npy"})
+
+    assert optimization_result.info["save_format"]["layout"] == "npy"
+    assert sorted(os.listdir(save_path + "models/")) == sorted(
+        str(i) + "_" + str(j) for i in range(number_of_call)
+        for j in range(model_runs))
+    output = load_model_output(save_path + "models/0_0", mmap_mode="r")
+    assert output["topic-word-matrix"].dtype == np.float32
+
+
+def test_close_resources(tmp_path):
+    def failing_writer():
+        writer = ModelOutputWriter()
+        writer.save({"topic-word-matrix": np.ones((2, 3))},
+                    str(tmp_path / "missing" / "0_0"))
+        return writer
+
+    optimizer = Optimizer()
+    optimizer._executor = None
+    optimizer._metric_suite = MetricSuite([])
+    optimizer._model_writer = failing_writer()
+    # the error of the writer is raised if the optimization succeeded
+    with pytest.raises(Exception, match="saving the output model"):
+        optimizer._close_resources(failed=False)
+    assert optimizer._model_writer is None
+
+    # and only reported if it failed, not to replace the error
+    optimizer._model_writer = failing_writer()
+    with pytest.warns(UserWarning, match="saving the model outputs"):
+        optimizer._close_resources(failed=True)
+    assert optimizer._model_writer is None